@@ -0,0 +1,250 @@
+"""
+Benchmarks of the embedding store, Faiss index and API hot paths. Each benchmark takes the paths of a model's files
+(see `benchmarks.synthetic.generate_synthetic_model`) and returns a list of results, each a dict with the name of what
+was measured, the parameters it was measured with and the measurements.
+
+Each benchmark is meant to be run in a fresh process (see `benchmarks.run`), so that memory measurements and the
+API's module-level state aren't affected by earlier benchmarks.
+"""
+
+import os
+import resource
+import sys
+import time
+from typing import Callable, List
+import numpy as np
+from src.embedding_store import KGEmbeddingStore
+from src.nearest_neighbours import FaissNearestNeighbours
+
+
+def _rss_mb() -> float:
+    """Current resident set size of this process in MB, or the peak if the current size isn't available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return _peak_rss_mb()
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS, and in KB elsewhere.
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def latency_stats(seconds: List[float]) -> dict:
+    """Summary statistics in milliseconds of a list of latencies in seconds."""
+    ms = np.asarray(seconds) * 1000
+
+    return {
+        "n": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def _time_calls(fn: Callable, args_list: list, warmup: int = 3) -> List[float]:
+    for args in args_list[:warmup]:
+        fn(*args)
+
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+def _load_store(paths: dict, mmap: bool = False) -> KGEmbeddingStore:
+    return KGEmbeddingStore.from_dglke(
+        embeddings_folder=os.path.dirname(paths["ENTITY_EMBEDDING_PATH"]),
+        embeddings_file_names=[
+            os.path.basename(paths["ENTITY_EMBEDDING_PATH"]),
+            os.path.basename(paths["RELATION_EMBEDDING_PATH"]),
+        ],
+        mappings_folder=os.path.dirname(paths["ENTITY_MAPPING_PATH"]),
+        mappings_file_names=[
+            os.path.basename(paths["ENTITY_MAPPING_PATH"]),
+            os.path.basename(paths["RELATION_MAPPING_PATH"]),
+        ],
+        mmap=mmap,
+    )
+
+
+def _sample_entities(
+    store: KGEmbeddingStore, n: int, random_state: int = 42
+) -> List[str]:
+    rnd = np.random.RandomState(random_state)
+    rows = rnd.randint(0, store.ent_mapping.shape[0], size=n)
+
+    return store.ent_mapping["value"].values[rows].tolist()
+
+
+def benchmark_load(paths: dict, mmap: bool = False) -> List[dict]:
+    """Time and memory of `KGEmbeddingStore.from_dglke`."""
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    store = _load_store(paths, mmap=mmap)
+    load_time = time.perf_counter() - start
+
+    return [
+        {
+            "name": "store_load",
+            "params": {"mmap": mmap},
+            "metrics": {
+                "load_s": load_time,
+                "rss_mb": _rss_mb(),
+                "rss_increase_mb": _rss_mb() - rss_before,
+                "peak_rss_mb": _peak_rss_mb(),
+                "num_entities": store.ent_embedding_matrix.shape[0],
+            },
+        }
+    ]
+
+
+def benchmark_lookup(
+    paths: dict,
+    batch_sizes: List[int] = (1, 10, 100, 1000),
+    n_calls: int = 200,
+    mmap: bool = False,
+) -> List[dict]:
+    """Latency of `KGEmbeddingStore.get_entity_embeddings` for batches of random entities."""
+    store = _load_store(paths, mmap=mmap)
+    results = []
+
+    for batch_size in batch_sizes:
+        entities = _sample_entities(store, batch_size * n_calls)
+        batches = [
+            (entities[slice(start, start + batch_size)],)
+            for start in range(0, len(entities), batch_size)
+        ]
+        latencies = _time_calls(store.get_entity_embeddings, batches)
+
+        results.append(
+            {
+                "name": "get_entity_embeddings",
+                "params": {"batch_size": batch_size, "mmap": mmap},
+                "metrics": {
+                    **latency_stats(latencies),
+                    "entities_per_s": batch_size * len(latencies) / sum(latencies),
+                },
+            }
+        )
+
+    return results
+
+
+def benchmark_faiss(
+    paths: dict,
+    index_params: dict = None,
+    batch_sizes: List[int] = (1, 64),
+    n_queries: int = 1000,
+    k: int = 10,
+) -> List[dict]:
+    """Time of `FaissNearestNeighbours.fit`, and throughput of `search` for batches of random entities."""
+    store = _load_store(paths)
+    index_params = index_params or {}
+
+    start = time.perf_counter()
+    nn = FaissNearestNeighbours(store, **index_params).fit("entities")
+    results = [
+        {
+            "name": "faiss_fit",
+            "params": nn.get_params(),
+            "metrics": {"fit_s": time.perf_counter() - start},
+        }
+    ]
+
+    entities = _sample_entities(store, n_queries)
+
+    for batch_size in batch_sizes:
+        batches = [
+            (entities[slice(start, start + batch_size)], k)
+            for start in range(0, len(entities), batch_size)
+        ]
+        latencies = _time_calls(nn.search, batches)
+
+        results.append(
+            {
+                "name": "faiss_search",
+                "params": {**nn.get_params(), "batch_size": batch_size, "k": k},
+                "metrics": {
+                    **latency_stats(latencies),
+                    "qps": batch_size * len(latencies) / sum(latencies),
+                },
+            }
+        )
+
+    return results
+
+
+def benchmark_api(
+    paths: dict, n_requests: int = 500, k: int = 10, env: dict = None
+) -> List[dict]:
+    """Latency of `/neighbours` and `/distance` requests for random entities, through the FastAPI app in-process.
+
+    The API reads its configuration from environment variables when it's imported, so this sets them (from `paths`
+    and `env`) before importing it. The API fits a new index on the model rather than loading a bundle, and the
+    neighbours cache is disabled unless `env` sets `NEIGHBOURS_CACHE_SIZE`, so that requests measure the search path.
+    """
+    os.environ.update(paths)
+    # Set rather than unset, so that they aren't loaded from a .env file by the API.
+    os.environ.update(
+        {
+            "INDEX_BUNDLE_PATH": "",
+            "NEIGHBOUR_TABLE_PATH": "",
+            "MODEL_WATCH_INTERVAL": "",
+            "NEIGHBOURS_CACHE_SIZE": "0",
+        }
+    )
+    os.environ.update(env or {})
+
+    from fastapi.testclient import TestClient
+    from src import api
+
+    client = TestClient(api.app)
+    entities = _sample_entities(
+        api.model_manager.current.embedding_store, 2 * n_requests
+    )
+
+    def _post(endpoint: str, body: dict):
+        response = client.post(endpoint, json=body)
+        response.raise_for_status()
+
+    requests = {
+        "/neighbours": [
+            ("/neighbours", {"entities": [entity], "k": k})
+            for entity in entities[:n_requests]
+        ],
+        "/distance": [
+            ("/distance", {"entity_a": entity_a, "entity_b": entity_b})
+            for entity_a, entity_b in zip(entities[:n_requests], entities[n_requests:])
+        ],
+    }
+
+    return [
+        {
+            "name": "api",
+            "params": {
+                "endpoint": endpoint,
+                "k": k if endpoint == "/neighbours" else None,
+                "neighbours_cache_size": int(os.environ["NEIGHBOURS_CACHE_SIZE"]),
+                **api.model_manager.current.nearest_neighbours.get_params(),
+            },
+            "metrics": latency_stats(_time_calls(_post, endpoint_requests)),
+        }
+        for endpoint, endpoint_requests in requests.items()
+    ]
+
+
+BENCHMARKS = {
+    "load": benchmark_load,
+    "lookup": benchmark_lookup,
+    "faiss": benchmark_faiss,
+    "api": benchmark_api,
+}
@@ -0,0 +1,185 @@
+"""
+Run the hot path benchmarks (see `benchmarks.hot_paths`) on synthetic models at one or more scales, appending the
+results to a JSON lines file. Each line is one measurement, tagged with the git commit and environment it was made
+in, so results can be compared across commits.
+
+Run from the repository root, e.g.:
+python -m benchmarks.run -s 100000x100 -s 1000000x400 -o ./data/benchmarks/results.jsonl
+"""
+
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import click
+import faiss
+import numpy as np
+import pandas as pd
+from benchmarks.hot_paths import BENCHMARKS
+from benchmarks.synthetic import generate_synthetic_model
+from src.cli.log import get_logger
+
+logger = get_logger(__name__)
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_run_metadata() -> dict:
+    """The git commit and environment that results are measured in."""
+    status = _git("status", "--porcelain", "--untracked-files=no")
+
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "faiss": getattr(faiss, "__version__", None),
+    }
+
+
+def parse_scale(scale: str) -> tuple:
+    """Parse a scale of the form "{num_entities}x{dim}", e.g. "100000x100"."""
+    num_entities, dim = scale.lower().split("x")
+
+    return int(num_entities), int(dim)
+
+
+def run_in_subprocess(benchmark: str, *args, **kwargs) -> list:
+    """Run a benchmark in a fresh process, so that it starts with no memory in use and no modules imported."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(BENCHMARKS[benchmark], args, kwargs)
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--scale",
+    "scales",
+    type=str,
+    multiple=True,
+    default=["100000x100"],
+    help="Scale of synthetic model as {num_entities}x{dim}. Can be given more than once. Defaults to 100000x100.",
+)
+@click.option(
+    "-b",
+    "--benchmark",
+    "benchmarks",
+    type=click.Choice(list(BENCHMARKS)),
+    multiple=True,
+    default=list(BENCHMARKS),
+    help="Benchmark to run. Can be given more than once. Defaults to all benchmarks.",
+)
+@click.option(
+    "-o",
+    "--output_path",
+    type=click.Path(dir_okay=False),
+    default="./data/benchmarks/results.jsonl",
+    help="JSON lines file to append results to.",
+)
+@click.option(
+    "-d",
+    "--data_folder",
+    type=click.Path(file_okay=False),
+    default="./data/benchmarks",
+    help="Folder to generate synthetic models in. Models are reused by later runs at the same scale.",
+)
+@click.option(
+    "-p",
+    "--index_params",
+    type=str,
+    envvar="FAISS_INDEX_PARAMS",
+    default="{}",
+    help="JSON of `FaissNearestNeighbours` parameters. Defaults to $FAISS_INDEX_PARAMS, or an exact index if that isn't set.",
+)
+@click.option(
+    "-n",
+    "--n_queries",
+    type=int,
+    default=1000,
+    help="Number of searches and API requests to time.",
+)
+@click.option("-r", "--random_state", type=int, default=42)
+def main(
+    scales, benchmarks, output_path, data_folder, index_params, n_queries, random_state
+):
+    metadata = get_run_metadata()
+    index_params = json.loads(index_params)
+
+    if metadata["dirty"]:
+        logger.warning(
+            "There are uncommitted changes, so results won't match the recorded commit."
+        )
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    for scale in scales:
+        num_entities, dim = parse_scale(scale)
+        logger.info(f"Generating synthetic model of {num_entities:,} x {dim}")
+        paths = generate_synthetic_model(
+            os.path.join(data_folder, f"{num_entities}x{dim}"),
+            num_entities,
+            dim,
+            random_state=random_state,
+        )
+
+        runs = {
+            "load": [
+                ("load", (paths,), {"mmap": False}),
+                ("load", (paths,), {"mmap": True}),
+            ],
+            "lookup": [("lookup", (paths,), {})],
+            "faiss": [
+                (
+                    "faiss",
+                    (paths,),
+                    {"index_params": index_params, "n_queries": n_queries},
+                )
+            ],
+            "api": [
+                (
+                    "api",
+                    (paths,),
+                    {
+                        "n_requests": n_queries,
+                        "env": {"FAISS_INDEX_PARAMS": json.dumps(index_params)},
+                    },
+                )
+            ],
+        }
+
+        for benchmark in benchmarks:
+            for name, args, kwargs in runs[benchmark]:
+                logger.info(f"Running {name} benchmark {kwargs or ''} at {scale}")
+                results = run_in_subprocess(name, *args, **kwargs)
+
+                with open(output_path, "a") as f:
+                    for result in results:
+                        record = {
+                            **metadata,
+                            "num_entities": num_entities,
+                            "dim": dim,
+                            **result,
+                        }
+                        f.write(json.dumps(record) + "\n")
+                        logger.info(
+                            f"{result['name']} {result['params']}: {result['metrics']}"
+                        )
+
+    logger.info(f"Results appended to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Generate synthetic DGL-KE style model outputs (entity and relation embeddings matrices and their mapping TSVs) at a
+given scale, for benchmarking.
+"""
+
+import json
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+
+ENTITY_EMBEDDING_FILE_NAME = "synthetic_RotatE_entity.npy"
+RELATION_EMBEDDING_FILE_NAME = "synthetic_RotatE_relation.npy"
+ENTITY_MAPPING_FILE_NAME = "entities.tsv"
+RELATION_MAPPING_FILE_NAME = "relations.tsv"
+PARAMS_FILE_NAME = "params.json"
+
+# Roughly the mix of entities in the Heritage Connector graph.
+ENTITY_URI_TEMPLATES = (
+    "http://collection.sciencemuseumgroup.org.uk/objects/co{}",
+    "http://collection.sciencemuseumgroup.org.uk/people/cp{}",
+    "http://www.wikidata.org/entity/Q{}",
+)
+
+
+def entity_uri(idx: int) -> str:
+    return ENTITY_URI_TEMPLATES[idx % len(ENTITY_URI_TEMPLATES)].format(idx)
+
+
+def generate_synthetic_model(
+    folder: str,
+    num_entities: int,
+    dim: int,
+    num_relations: int = 100,
+    num_clusters: int = 1000,
+    block_size: int = 100_000,
+    random_state: int = 42,
+) -> dict:
+    """Write synthetic model outputs to `folder`, unless outputs with the same parameters are already there.
+
+    Entity embeddings are drawn around `num_clusters` random centres so that nearest neighbour searches behave more
+    like they do on trained embeddings than on uniform noise. Embeddings are written `block_size` rows at a time, so
+    scales larger than memory can be generated.
+
+    Args:
+        folder (str): folder to write to. Created if it doesn't exist.
+        num_entities (int): number of entities
+        dim (int): dimension of entity embeddings. Relation embeddings have half the dimension, as for RotatE.
+        num_relations (int, optional): Defaults to 100.
+        num_clusters (int, optional): Defaults to 1000.
+        block_size (int, optional): Defaults to 100_000.
+        random_state (int, optional): Defaults to 42.
+
+    Returns:
+        dict: paths of the generated files, keyed by the environment variables the API reads them from
+    """
+    params = {
+        "num_entities": num_entities,
+        "dim": dim,
+        "num_relations": num_relations,
+        "num_clusters": num_clusters,
+        "random_state": random_state,
+    }
+    paths = {
+        "ENTITY_EMBEDDING_PATH": os.path.join(folder, ENTITY_EMBEDDING_FILE_NAME),
+        "RELATION_EMBEDDING_PATH": os.path.join(folder, RELATION_EMBEDDING_FILE_NAME),
+        "ENTITY_MAPPING_PATH": os.path.join(folder, ENTITY_MAPPING_FILE_NAME),
+        "RELATION_MAPPING_PATH": os.path.join(folder, RELATION_MAPPING_FILE_NAME),
+    }
+    params_path = os.path.join(folder, PARAMS_FILE_NAME)
+
+    if os.path.exists(params_path):
+        with open(params_path, "r") as f:
+            if json.load(f) == params:
+                return paths
+
+    os.makedirs(folder, exist_ok=True)
+    if os.path.exists(params_path):
+        os.remove(params_path)
+
+    rnd = np.random.RandomState(random_state)
+    centres = rnd.normal(size=(num_clusters, dim)).astype(np.float32)
+
+    entities = open_memmap(
+        paths["ENTITY_EMBEDDING_PATH"],
+        mode="w+",
+        dtype=np.float32,
+        shape=(num_entities, dim),
+    )
+    with open(paths["ENTITY_MAPPING_PATH"], "w") as f:
+        for start in range(0, num_entities, block_size):
+            stop = min(start + block_size, num_entities)
+            block = slice(start, stop)
+            clusters = rnd.randint(0, num_clusters, size=stop - start)
+            entities[block] = centres[clusters] + 0.3 * rnd.normal(
+                size=(stop - start, dim)
+            ).astype(np.float32)
+            f.write(
+                "".join(f"{idx}\t{entity_uri(idx)}\n" for idx in range(start, stop))
+            )
+    entities.flush()
+    del entities
+
+    np.save(
+        paths["RELATION_EMBEDDING_PATH"],
+        rnd.uniform(-1, 1, size=(num_relations, dim // 2)).astype(np.float32),
+    )
+    with open(paths["RELATION_MAPPING_PATH"], "w") as f:
+        f.write(
+            "".join(
+                f"{idx}\thttp://www.wikidata.org/prop/direct/P{idx}\n"
+                for idx in range(num_relations)
+            )
+        )
+
+    # Written last, so that interrupted generation is redone.
+    with open(params_path, "w") as f:
+        json.dump(params, f)
+
+    return paths
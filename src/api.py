@@ -1,11 +1,37 @@
 import argparse
+import importlib.util
+import json
 import os
-from typing import List
-from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+import time
+from functools import partial
+from typing import Dict, List, Literal, Optional, Tuple
+from pydantic import BaseModel, conint
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
-from src.embedding_store import KGEmbeddingStore
+from src.clustering import ClusterLabels
+from src.embedding_store import KGEmbeddingStore, UnknownValuesError
+from src.embedding_export import ARROW_MEDIA_TYPE, iter_embeddings_arrow
+from src.entity_filters import EntityGroups, UnknownGroupsError
 from src.nearest_neighbours import FaissNearestNeighbours
+from src.sharding import ShardError, ShardedNearestNeighbours
+from src.link_prediction import LinkPredictor
+from src.index_bundle import load_bundle
+from src.cache import NeighboursCache
+from src.neighbour_table import NeighbourTable
+from src.model_manager import ModelManager, ServingModel, bundle_fingerprint
+from src.response_formats import (
+    UnsupportedFormatError,
+    negotiate_media_type,
+    render_neighbours,
+)
+from src.metrics import (
+    REGISTRY,
+    SIZE_BUCKETS,
+    process_rss_bytes,
+    timed_stage,
+    track_request,
+)
 from pathlib import Path
 from dotenv import load_dotenv
 from src.cli.log import get_logger
@@ -14,70 +40,468 @@ logger = get_logger(__name__)
 
 load_dotenv()
 
-EMBEDDINGS_FILE_NAMES = [
-    Path(os.environ.get("ENTITY_EMBEDDING_PATH")).name,
-    Path(os.environ.get("RELATION_EMBEDDING_PATH")).name,
-]
 
-assert (
-    Path(os.environ.get("ENTITY_EMBEDDING_PATH")).parent
-    == Path(os.environ.get("RELATION_EMBEDDING_PATH")).parent  # noqa: W503
-)
+def _env_flag(name: str, default: str = "false") -> bool:
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
 
-EMBEDDINGS_FOLDER = os.path.join(
-    os.path.dirname(__file__),
-    "..",
-    Path(os.environ.get("ENTITY_EMBEDDING_PATH")).parent,
-)
 
-MAPPINGS_FILE_NAMES = [
-    Path(os.environ.get("ENTITY_MAPPING_PATH")).name,
-    Path(os.environ.get("RELATION_MAPPING_PATH")).name,
-]
+EMBEDDINGS_MMAP = _env_flag("EMBEDDINGS_MMAP")
+INDEX_BUNDLE_PATH = os.environ.get("INDEX_BUNDLE_PATH")
+SHARD_ADDRESSES = os.environ.get("SHARD_ADDRESSES")
+
+
+def load_store_from_dglke() -> KGEmbeddingStore:
+    """Load embeddings from the DGL-KE outputs given by environment variables."""
+    embeddings_file_names = [
+        Path(os.environ.get("ENTITY_EMBEDDING_PATH")).name,
+        Path(os.environ.get("RELATION_EMBEDDING_PATH")).name,
+    ]
+
+    assert (
+        Path(os.environ.get("ENTITY_EMBEDDING_PATH")).parent
+        == Path(os.environ.get("RELATION_EMBEDDING_PATH")).parent  # noqa: W503
+    )
+
+    embeddings_folder = os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        Path(os.environ.get("ENTITY_EMBEDDING_PATH")).parent,
+    )
+
+    mappings_file_names = [
+        Path(os.environ.get("ENTITY_MAPPING_PATH")).name,
+        Path(os.environ.get("RELATION_MAPPING_PATH")).name,
+    ]
+
+    assert (
+        Path(os.environ.get("ENTITY_MAPPING_PATH")).parent
+        == Path(os.environ.get("RELATION_MAPPING_PATH")).parent  # noqa: W503
+    )
+
+    mappings_folder = os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        Path(os.environ.get("ENTITY_MAPPING_PATH")).parent,
+    )
+
+    return KGEmbeddingStore.from_dglke(
+        embeddings_folder=embeddings_folder,
+        embeddings_file_names=embeddings_file_names,
+        mappings_folder=mappings_folder,
+        mappings_file_names=mappings_file_names,
+        mmap=EMBEDDINGS_MMAP,
+    )
+
+
+def load_from_dglke() -> FaissNearestNeighbours:
+    """Load embeddings from the DGL-KE outputs given by environment variables, and fit a new Faiss index on them."""
+    embedding_store = load_store_from_dglke()
+    # e.g. FAISS_INDEX_PARAMS='{"index_type": "hnsw", "ef_search": 128}'. See `FaissNearestNeighbours` for parameters.
+    faiss_index_params = json.loads(os.environ.get("FAISS_INDEX_PARAMS", "{}"))
+
+    return FaissNearestNeighbours(embedding_store, **faiss_index_params).fit("entities")
+
+
+def connect_to_shards() -> ShardedNearestNeighbours:
+    """Load embeddings from the DGL-KE outputs given by environment variables, and search them with the shards at
+    `SHARD_ADDRESSES` rather than fitting an index in this process.
+    """
+    # e.g. SHARD_ADDRESSES=shard-0:9000,shard-1:9000. Shards are served by `python -m src.cli.serve_shard`.
+    addresses = [
+        (host, int(port))
+        for host, port in (
+            address.strip().rsplit(":", 1)
+            for address in SHARD_ADDRESSES.split(",")
+            if address.strip()
+        )
+    ]
+
+    return ShardedNearestNeighbours(
+        load_store_from_dglke(),
+        addresses,
+        authkey=os.environ["SHARD_AUTHKEY"].encode(),
+        timeout=float(os.environ.get("SHARD_TIMEOUT_MS", 1000)) / 1000,
+    )
+
+
+def _load_neighbour_table(path: str, model_version: str) -> Optional[NeighbourTable]:
+    if not path or not os.path.exists(path):
+        return None
+
+    neighbour_table = NeighbourTable.load(path)
+
+    if neighbour_table.model_version != model_version:
+        logger.warning(
+            f"Neighbour table at {path} is for model version {neighbour_table.model_version}, not {model_version}. It won't be used."
+        )
+        return None
+
+    return neighbour_table
+
+
+def _create_link_predictor(
+    embedding_store: KGEmbeddingStore,
+) -> Optional[LinkPredictor]:
+    # The scoring function has to match the model the embeddings were trained with, named as in DGL-KE, e.g.
+    # LINK_PREDICTION_MODEL=TransE_l1.
+    try:
+        return LinkPredictor(
+            embedding_store,
+            model=os.environ.get("LINK_PREDICTION_MODEL", "RotatE"),
+            gamma=float(os.environ.get("LINK_PREDICTION_GAMMA", 12.0)),
+        )
+    except ValueError as e:
+        logger.warning(f"Link prediction won't be available: {e}")
+        return None
+
+
+def _load_entity_groups(embedding_store: KGEmbeddingStore) -> Optional[EntityGroups]:
+    # A folder of colour mappings made by notebooks/create_colour_mappings_for_vis.ipynb, e.g.
+    # ENTITY_GROUPS_PATH=./data/processed/embedding_colour_mappings_vanda
+    path = os.environ.get("ENTITY_GROUPS_PATH")
+
+    if not path or not os.path.isdir(path):
+        return None
+
+    entity_groups = EntityGroups.from_folder(path, embedding_store)
+    logger.info(f"Loaded group mappings {entity_groups.names} from {path}")
+
+    return entity_groups
+
+
+def _load_cluster_labels(
+    embedding_store: KGEmbeddingStore,
+) -> Optional[ClusterLabels]:
+    # Made by `python -m src.cli.cluster_embeddings`.
+    path = os.environ.get("CLUSTERS_PATH")
+
+    if not path or not os.path.isdir(path):
+        return None
+
+    cluster_labels = ClusterLabels.load(path)
+    num_entities = embedding_store.ent_embedding_matrix.shape[0]
+
+    if len(cluster_labels) != num_entities:
+        logger.warning(
+            f"Clusters at {path} are for {len(cluster_labels)} entities, not {num_entities}. They won't be used."
+        )
+        return None
+
+    return cluster_labels
+
+
+def load_model(bundle_path: str = None) -> ServingModel:
+    """Load the model to serve from an index bundle if `bundle_path` is given, and otherwise from the DGL-KE outputs
+    given by environment variables.
+    """
+    if bundle_path:
+        # Bundles are built with `python -m src.cli.build_index_bundle`.
+        faiss_index, bundle_manifest = load_bundle(
+            bundle_path,
+            mmap=EMBEDDINGS_MMAP,
+            verify_checksums=_env_flag("INDEX_BUNDLE_VERIFY_CHECKSUMS"),
+        )
+        logger.info(
+            f"Loaded bundle version {bundle_manifest['version']} of model {bundle_manifest['model_name']}"
+        )
+        model_version = bundle_manifest["version"]
+    else:
+        faiss_index = connect_to_shards() if SHARD_ADDRESSES else load_from_dglke()
+        model_version = "dglke-{}-{}".format(
+            Path(os.environ.get("ENTITY_EMBEDDING_PATH")).stem,
+            int(os.path.getmtime(os.environ.get("ENTITY_EMBEDDING_PATH"))),
+        )
+
+    # Built with `python -m src.cli.build_neighbour_table`. Defaults to the table inside the bundle, if there is one.
+    neighbour_table_path = os.environ.get("NEIGHBOUR_TABLE_PATH")
+    if not neighbour_table_path and bundle_path:
+        neighbour_table_path = os.path.join(bundle_path, "neighbour_table")
+
+    neighbour_table = _load_neighbour_table(neighbour_table_path, model_version)
+
+    return ServingModel(
+        faiss_index,
+        model_version,
+        neighbour_table=neighbour_table,
+        link_predictor=_create_link_predictor(faiss_index.embedding_store),
+        source=bundle_path,
+        entity_groups=_load_entity_groups(faiss_index.embedding_store),
+        cluster_labels=_load_cluster_labels(faiss_index.embedding_store),
+        # Concurrent Faiss searches are batched together and run off the event loop.
+        max_batch_size=int(os.environ.get("SEARCH_BATCH_MAX_SIZE", 64)),
+        max_wait_ms=float(os.environ.get("SEARCH_BATCH_MAX_WAIT_MS", 2.0)),
+    )
 
-assert (
-    Path(os.environ.get("ENTITY_MAPPING_PATH")).parent
-    == Path(os.environ.get("RELATION_MAPPING_PATH")).parent  # noqa: W503
+
+def _dglke_fingerprint() -> Tuple[str, float]:
+    return os.environ.get("ENTITY_EMBEDDING_PATH"), os.path.getmtime(
+        os.environ.get("ENTITY_EMBEDDING_PATH")
+    )
+
+
+# The served model can be replaced without a restart, by `POST /admin/reload` or by watching the model files.
+model_manager = ModelManager(load_model, INDEX_BUNDLE_PATH)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+MODEL_WATCH_INTERVAL = os.environ.get("MODEL_WATCH_INTERVAL")
+
+if MODEL_WATCH_INTERVAL:
+    model_manager.watch(
+        (
+            partial(bundle_fingerprint, INDEX_BUNDLE_PATH)
+            if INDEX_BUNDLE_PATH
+            else _dglke_fingerprint
+        ),
+        source=INDEX_BUNDLE_PATH,
+        interval=float(MODEL_WATCH_INTERVAL),
+    )
+
+# Largest number of results a request can ask for with `k`.
+MAX_K = int(os.environ.get("MAX_K", 1_000))
+# Largest number of distances (len(entities_a) * len(entities_b)) a `/distance_matrix` request can ask for.
+MAX_DISTANCE_MATRIX_SIZE = int(os.environ.get("MAX_DISTANCE_MATRIX_SIZE", 1_000_000))
+
+neighbours_cache = NeighboursCache(
+    max_size=int(os.environ.get("NEIGHBOURS_CACHE_SIZE", 10_000)),
+    ttl=(
+        float(os.environ["NEIGHBOURS_CACHE_TTL"])
+        if os.environ.get("NEIGHBOURS_CACHE_TTL")
+        else None
+    ),
 )
 
-MAPPINGS_FOLDER = os.path.join(
-    os.path.dirname(__file__), "..", Path(os.environ.get("ENTITY_MAPPING_PATH")).parent
+
+class TimedJSONResponse(ORJSONResponse):
+    """JSON response, rendered with orjson, whose rendering is timed as the "serialize" stage."""
+
+    def render(self, content) -> bytes:
+        with timed_stage("serialize"):
+            return super().render(content)
+
+
+app = FastAPI(default_response_class=TimedJSONResponse)
+
+# Requests slower than this are logged with a breakdown of the time spent in each stage.
+SLOW_REQUEST_MS = (
+    float(os.environ["SLOW_REQUEST_MS"]) if os.environ.get("SLOW_REQUEST_MS") else None
 )
 
-embedding_store = KGEmbeddingStore.from_dglke(
-    embeddings_folder=EMBEDDINGS_FOLDER,
-    embeddings_file_names=EMBEDDINGS_FILE_NAMES,
-    mappings_folder=MAPPINGS_FOLDER,
-    mappings_file_names=MAPPINGS_FILE_NAMES,
+REQUESTS = REGISTRY.counter(
+    "requests_total", "Number of requests.", labelnames=("method", "path", "status")
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "request_seconds",
+    "Time taken to respond to requests.",
+    labelnames=("method", "path"),
+)
+NEIGHBOURS_REQUEST_ENTITIES = REGISTRY.histogram(
+    "neighbours_request_entities",
+    "Number of entities in each /neighbours request.",
+    buckets=SIZE_BUCKETS,
+)
+REGISTRY.gauge(
+    "model_info",
+    "Version of the model being served.",
+    lambda: {(model_manager.current.version, model_manager.current.source or ""): 1},
+    labelnames=("version", "source"),
+)
+REGISTRY.gauge(
+    "model_reloads",
+    "Number of times the model has been reloaded.",
+    lambda: {(): model_manager.num_reloads},
 )
-faiss_index = FaissNearestNeighbours(embedding_store).fit("entities")
+REGISTRY.gauge(
+    "embeddings_bytes",
+    "Size of the embeddings matrices being served (memory-mapped or compressed matrices may use less RAM).",
+    lambda: {
+        ("entity",): model_manager.current.embedding_store.ent_embedding_matrix.nbytes,
+        (
+            "relation",
+        ): model_manager.current.embedding_store.rel_embedding_matrix.nbytes,
+    },
+    labelnames=("matrix",),
+)
+REGISTRY.gauge(
+    "process_resident_memory_bytes",
+    "Resident set size of the API process.",
+    lambda: {(): process_rss_bytes()},
+)
+REGISTRY.gauge(
+    "neighbours_cache",
+    "Statistics of the neighbours cache. See `GET /cache`.",
+    lambda: {
+        (stat,): value
+        for stat, value in neighbours_cache.stats().items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    },
+    labelnames=("stat",),
+)
+REGISTRY.gauge(
+    "search_batcher",
+    "Statistics of the current model's search batcher. See `GET /batching`.",
+    lambda: {
+        (stat,): value
+        for stat, value in model_manager.current.search_batcher.stats().items()
+    },
+    labelnames=("stat",),
+)
+
 
-app = FastAPI()
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    stages = track_request()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    # The route's path template rather than the requested path, so that the number of label values is bounded.
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    REQUESTS.inc(method=request.method, path=path, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, method=request.method, path=path)
+
+    if SLOW_REQUEST_MS is not None and elapsed * 1000 > SLOW_REQUEST_MS:
+        # Time not spent in any timed stage, e.g. parsing and validating the request.
+        stages["other"] = elapsed - sum(stages.values())
+        breakdown = ", ".join(
+            f"{stage}={1000 * seconds:.1f}ms" for stage, seconds in stages.items()
+        )
+        logger.warning(
+            f"Slow request {request.method} {request.url.path} took {1000 * elapsed:.1f}ms: {breakdown}"
+        )
+
+    return response
+
+
+def serving_model(response: Response) -> ServingModel:
+    """Dependency giving the model to use for the whole of a request, whose version is reported in the response's
+    `X-Model-Version` header.
+    """
+    model = model_manager.current
+    response.headers["X-Model-Version"] = model.version
+
+    return model
 
 
 class NeighboursRequest(BaseModel):
     entities: List[str]
-    k: int
+    k: conint(ge=1, le=MAX_K)
+    # Only return neighbours whose values start with `namespace`, and which are in one of the listed groups of each
+    # group mapping in `groups`, e.g. {"collection_category": ["Category - Photographs"]}. See `GET /groups`.
+    namespace: Optional[str] = None
+    groups: Optional[Dict[str, List[str]]] = None
 
 
 @app.post("/neighbours")
-async def get_nearest_neighbours(request: NeighboursRequest):
-    neighbours, distances = faiss_index.search(request.entities, request.k + 1)
+async def get_nearest_neighbours(
+    request: NeighboursRequest,
+    model: ServingModel = Depends(serving_model),
+    accept: Optional[str] = Header(None),
+):
+    """Nearest neighbours of each entity, as `{entity: [[neighbour, distance], ...]}` in JSON. Clients can ask for
+    msgpack or Arrow instead with the `Accept` header (see `src.response_formats`).
+    """
+    media_type = negotiate_media_type(accept)
+    NEIGHBOURS_REQUEST_ENTITIES.observe(len(request.entities))
 
     response = {}
+    uncached_entities = []
+    row_filter = None
+
+    if request.namespace is not None or request.groups:
+        # Filtered results aren't cached, as the cache is keyed by model version and entity only.
+        try:
+            row_filter = model.row_filters.get(request.namespace, request.groups)
+        except UnknownGroupsError as e:
+            raise HTTPException(status_code=422, detail=e.args[0])
+
+        uncached_entities = list(request.entities)
+    else:
+        for ent in request.entities:
+            cached = neighbours_cache.get(model.version, ent, request.k)
+            if cached is None:
+                uncached_entities.append(ent)
+            else:
+                response[ent] = cached
 
-    for idx, ent in enumerate(request.entities):
-        if ent != neighbours[idx][0]:
+    if uncached_entities:
+        try:
+            neighbours, distances = await model.search_neighbours(
+                uncached_entities, request.k + 1, row_filter=row_filter
+            )
+        except UnknownValuesError as e:
             raise HTTPException(
-                status_code=404,
-                detail=f"It looks like there's a mismatch between a request entity and its nearest neighbour. Problem entity: {ent}",
+                status_code=404, detail=f"Entities not found: {e.values}"
             )
+        except NotImplementedError as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        except ShardError as e:
+            raise HTTPException(status_code=503, detail=str(e))
 
-        response.update(
-            {ent: list(zip(neighbours[idx][1:], distances[idx][1:].tolist()))}
-        )
+        for idx, ent in enumerate(uncached_entities):
+            if row_filter is not None:
+                # The entity itself is only among its neighbours if it matches the filter.
+                keep = [
+                    position
+                    for position, neighbour in enumerate(neighbours[idx])
+                    if neighbour is not None and neighbour != ent
+                ][: request.k]
+                response[ent] = (
+                    [neighbours[idx][position] for position in keep],
+                    distances[idx][keep],
+                )
+                continue
 
-    return response
+            if ent != neighbours[idx][0]:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"It looks like there's a mismatch between a request entity and its nearest neighbour. Problem entity: {ent}",
+                )
+
+            # Copied so that the cache doesn't keep the whole batch's distances alive.
+            response[ent] = (neighbours[idx][1:], distances[idx][1:].copy())
+            neighbours_cache.put(model.version, ent, request.k, response[ent])
+
+    try:
+        with timed_stage("serialize"):
+            rendered = render_neighbours(
+                response, request.entities, request.k, media_type
+            )
+    except UnsupportedFormatError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+    # Returned directly rather than through the `serving_model` dependency's response.
+    rendered.headers["X-Model-Version"] = model.version
+
+    return rendered
+
+
+@app.get("/groups")
+async def get_groups(model: ServingModel = Depends(serving_model)):
+    """The groups in each group mapping that `/neighbours` results can be filtered by."""
+    entity_groups = model.row_filters.entity_groups
+
+    if entity_groups is None:
+        return {}
+
+    return {name: entity_groups.categories(name) for name in entity_groups.names}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Metrics in the Prometheus text format."""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/cache")
+async def get_cache_stats():
+    return neighbours_cache.stats()
+
+
+@app.get("/batching")
+async def get_batching_stats(model: ServingModel = Depends(serving_model)):
+    return model.search_batcher.stats()
 
 
 class DistanceRequest(BaseModel):
@@ -86,13 +510,247 @@ class DistanceRequest(BaseModel):
 
 
 @app.post("/distance")
-async def get_distance(request: DistanceRequest):
+async def get_distance(
+    request: DistanceRequest, model: ServingModel = Depends(serving_model)
+):
     logger.debug(f"DISTANCES: ent_a {request.entity_a}, ent_b {request.entity_b}")
 
     if request.entity_a == request.entity_b:
         return 0
 
-    return embedding_store.get_entity_distance([request.entity_a, request.entity_b])
+    try:
+        return model.embedding_store.get_entity_distance(
+            [request.entity_a, request.entity_b]
+        )
+    except UnknownValuesError as e:
+        raise HTTPException(status_code=404, detail=f"Entities not found: {e.values}")
+
+
+class DistancesRequest(BaseModel):
+    pairs: List[Tuple[str, str]]
+    metric: Literal["squared_l2", "cosine"] = "squared_l2"
+
+
+# The batch distance endpoints are CPU-bound, so they're defined without `async` to run in FastAPI's threadpool
+# rather than blocking the event loop.
+@app.post("/distances")
+def get_distances(
+    request: DistancesRequest, model: ServingModel = Depends(serving_model)
+) -> List[float]:
+    """Distance between each pair of entities, in the order of `pairs`."""
+    if not request.pairs:
+        return []
+
+    entities_a, entities_b = zip(*request.pairs)
+
+    try:
+        return model.embedding_store.get_entity_distances(
+            list(entities_a), list(entities_b), metric=request.metric
+        ).tolist()
+    except UnknownValuesError as e:
+        raise HTTPException(status_code=404, detail=f"Entities not found: {e.values}")
+
+
+class DistanceMatrixRequest(BaseModel):
+    entities_a: List[str]
+    entities_b: List[str]
+    metric: Literal["squared_l2", "cosine"] = "squared_l2"
+
+
+@app.post("/distance_matrix")
+def get_distance_matrix(
+    request: DistanceMatrixRequest, model: ServingModel = Depends(serving_model)
+) -> List[List[float]]:
+    """Distances between every entity in `entities_a` (rows) and every entity in `entities_b` (columns)."""
+    if not request.entities_a or not request.entities_b:
+        raise HTTPException(
+            status_code=422, detail="entities_a and entities_b must not be empty"
+        )
+
+    if len(request.entities_a) * len(request.entities_b) > MAX_DISTANCE_MATRIX_SIZE:
+        raise HTTPException(
+            status_code=422,
+            detail=f"The distance matrix would have more than {MAX_DISTANCE_MATRIX_SIZE:,} distances",
+        )
+
+    try:
+        return model.embedding_store.get_entity_distance_matrix(
+            request.entities_a, request.entities_b, metric=request.metric
+        ).tolist()
+    except UnknownValuesError as e:
+        raise HTTPException(status_code=404, detail=f"Entities not found: {e.values}")
+
+
+class PredictRequest(BaseModel):
+    relation: str
+    head: Optional[str] = None
+    tail: Optional[str] = None
+    k: conint(ge=1, le=MAX_K) = 10
+
+
+@app.post("/predict")
+def predict_links(
+    request: PredictRequest, model: ServingModel = Depends(serving_model)
+) -> List[Tuple[str, float]]:
+    """The `k` highest scoring tails for (`head`, `relation`, ?) if `head` is given, or heads for
+    (?, `relation`, `tail`) if `tail` is given, with their scores.
+    """
+    if (request.head is None) == (request.tail is None):
+        raise HTTPException(
+            status_code=422, detail="Exactly one of `head` and `tail` must be given"
+        )
+
+    if model.link_predictor is None:
+        raise HTTPException(
+            status_code=501, detail="Link prediction isn't available for this model"
+        )
+
+    try:
+        if request.head is not None:
+            entities, scores = model.link_predictor.predict_tails(
+                [request.head], [request.relation], request.k
+            )
+        else:
+            entities, scores = model.link_predictor.predict_heads(
+                [request.relation], [request.tail], request.k
+            )
+    except UnknownValuesError as e:
+        raise HTTPException(
+            status_code=404, detail=f"Entities or relations not found: {e.values}"
+        )
+
+    return list(zip(entities[0], scores[0].tolist()))
+
+
+class ClustersRequest(BaseModel):
+    entities: List[str]
+
+
+def _get_cluster_labels(model: ServingModel) -> ClusterLabels:
+    if model.cluster_labels is None:
+        raise HTTPException(
+            status_code=501, detail="Clusters aren't available for this model"
+        )
+
+    return model.cluster_labels
+
+
+@app.post("/clusters")
+def get_clusters(
+    request: ClustersRequest, model: ServingModel = Depends(serving_model)
+) -> Dict[str, int]:
+    """Cluster of each entity, or -1 for entities labelled as noise."""
+    cluster_labels = _get_cluster_labels(model)
+
+    try:
+        rows = model.embedding_store.entities_to_idxs(request.entities)
+    except UnknownValuesError as e:
+        raise HTTPException(status_code=404, detail=f"Entities not found: {e.values}")
+
+    return dict(zip(request.entities, cluster_labels.labels[rows].tolist()))
+
+
+@app.get("/clusters/{cluster}")
+def get_cluster_members(
+    cluster: int,
+    limit: conint(ge=1, le=MAX_K) = 100,
+    offset: conint(ge=0) = 0,
+    model: ServingModel = Depends(serving_model),
+):
+    """Entities in a cluster, `limit` (at most `MAX_K`) at a time from `offset`."""
+    cluster_labels = _get_cluster_labels(model)
+
+    if not -1 <= cluster < cluster_labels.num_clusters:
+        raise HTTPException(status_code=404, detail=f"Cluster not found: {cluster}")
+
+    rows = cluster_labels.members(cluster)
+
+    return {
+        "cluster": cluster,
+        "size": len(rows),
+        "entities": model.embedding_store.idxs_to_entities(
+            rows[slice(offset, offset + limit)]
+        ),
+    }
+
+
+class ExportRequest(BaseModel):
+    entities: Optional[List[str]] = None
+    prefix: Optional[str] = None
+    chunk_size: int = 10_000
+
+
+@app.post("/embeddings/export")
+def export_embeddings(
+    request: ExportRequest, model: ServingModel = Depends(serving_model)
+):
+    """Stream the embeddings of `entities`, of entities whose values start with `prefix`, or of every entity if
+    neither is given, as an Arrow IPC stream with one record batch per `chunk_size` entities (see
+    `src.embedding_export`).
+    """
+    if request.entities is not None and request.prefix is not None:
+        raise HTTPException(
+            status_code=422,
+            detail="At most one of `entities` and `prefix` can be given",
+        )
+
+    if request.chunk_size < 1:
+        raise HTTPException(status_code=422, detail="`chunk_size` must be positive")
+
+    if importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(
+            status_code=501, detail="Exporting embeddings needs pyarrow installed"
+        )
+
+    store = model.embedding_store
+
+    if request.entities is not None:
+        try:
+            rows = store.entities_to_idxs(request.entities)
+        except UnknownValuesError as e:
+            raise HTTPException(
+                status_code=404, detail=f"Entities not found: {e.values}"
+            )
+    else:
+        rows = store.entity_idxs_with_prefix(request.prefix)
+
+    # The stream keeps a reference to the store, so it finishes from the same model if the model is swapped.
+    return StreamingResponse(
+        iter_embeddings_arrow(store, rows, request.chunk_size, model.version),
+        media_type=ARROW_MEDIA_TYPE,
+        headers={"X-Model-Version": model.version, "X-Num-Entities": str(len(rows))},
+    )
+
+
+class ReloadRequest(BaseModel):
+    bundle_path: Optional[str] = None
+
+
+def check_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints are only enabled when `ADMIN_TOKEN` is set, and need it in the `X-Admin-Token` header."""
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Not allowed")
+
+
+@app.get("/admin/model", dependencies=[Depends(check_admin_token)])
+async def get_model_status():
+    return model_manager.status()
+
+
+@app.post("/admin/reload", status_code=202, dependencies=[Depends(check_admin_token)])
+async def reload_model(request: ReloadRequest = None):
+    """Load a model in the background and swap it in once it's ready, from `bundle_path` if given and otherwise from
+    wherever the current model was loaded from. Poll `GET /admin/model` for progress.
+    """
+    bundle_path = request.bundle_path if request else None
+
+    if bundle_path and not os.path.isdir(bundle_path):
+        raise HTTPException(status_code=404, detail=f"Bundle not found: {bundle_path}")
+
+    if not model_manager.reload(bundle_path):
+        raise HTTPException(status_code=409, detail="A reload is already in progress")
+
+    return {"reloading": True, "serving_version": model_manager.current.version}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""
+Submodule for batching concurrent nearest neighbour searches in the API.
+"""
+
+import asyncio
+from concurrent.futures import Executor
+import threading
+import time
+from typing import Callable, Optional, Tuple
+import numpy as np
+from src.metrics import REGISTRY, SIZE_BUCKETS
+
+SEARCH_BATCH_QUERIES = REGISTRY.histogram(
+    "search_batch_queries",
+    "Number of query vectors in each batch of Faiss searches.",
+    buckets=SIZE_BUCKETS,
+)
+SEARCH_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "search_queue_wait_seconds",
+    "Time searches waited to be run as part of a batch.",
+)
+
+
+class SearchBatcher:
+    def __init__(
+        self,
+        search_fn: Callable[[np.ndarray, int], Tuple[np.ndarray, np.ndarray]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 2.0,
+        executor: Executor = None,
+        idle_timeout: float = 30.0,
+    ):
+        """Collect searches made concurrently from async code into batches, and run each batch as one call to
+        `search_fn` in an executor so that the event loop isn't blocked.
+
+        A batch is run when it reaches `max_batch_size` query vectors, or `max_wait_ms` after its first search arrived.
+        Searches that arrive while a batch is running are collected into the next batch, so batches grow with load.
+        The worker task that runs batches is started by the first search and stops after `idle_timeout` seconds without
+        any, so a batcher that's no longer used (e.g. for a model that has been swapped out) doesn't keep `search_fn`
+        alive.
+
+        Args:
+            search_fn (Callable[[np.ndarray, int], Tuple[np.ndarray, np.ndarray]]): function taking a matrix of query
+                vectors and k and returning distances and idxs, e.g. `FaissNearestNeighbours.search_vectors`
+            max_batch_size (int, optional): maximum number of query vectors in a batch. Defaults to 64.
+            max_wait_ms (float, optional): maximum time to wait for a batch to fill. Defaults to 2.0.
+            executor (Executor, optional): executor to run searches in. Defaults to None (the event loop's default executor).
+            idle_timeout (float, optional): number of seconds without searches after which the worker stops. It's
+                restarted by the next search. Defaults to 30.0.
+        """
+        self.search_fn = search_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.idle_timeout = idle_timeout
+
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+        self._stats_lock = threading.Lock()
+        self.num_batches = 0
+        self.num_searches = 0
+        self.num_queries = 0
+        self.max_batch_queries = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.last_batch_queries = 0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def search(self, xq: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the `k` nearest neighbours of each row of `xq` as part of the next batch.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: distances, idxs, as returned by `search_fn`
+        """
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((xq, k, future, time.perf_counter()))
+
+        return await future
+
+    async def _collect_batch(self) -> Optional[list]:
+        while True:
+            try:
+                batch = [await asyncio.wait_for(self._queue.get(), self.idle_timeout)]
+                break
+            except asyncio.TimeoutError:
+                # The worker finishes without yielding to the event loop after this check, so a search can't be
+                # queued without either being collected here or starting a new worker.
+                if self._queue.empty():
+                    return None
+
+        num_queries = batch[0][0].shape[0]
+        deadline = self._loop.time() + self.max_wait_ms / 1000
+
+        while num_queries < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+            batch.append(item)
+            num_queries += item[0].shape[0]
+
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            if batch is None:
+                return
+
+            start = time.perf_counter()
+            self._record_batch(batch, start)
+
+            xq = np.concatenate([item[0] for item in batch])
+            k = max(item[1] for item in batch)
+
+            try:
+                distances, idxs = await self._loop.run_in_executor(
+                    self.executor, self.search_fn, xq, k
+                )
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            row = 0
+            for item_xq, item_k, future, _ in batch:
+                rows = slice(row, row + item_xq.shape[0])
+                if not future.done():
+                    future.set_result((distances[rows, :item_k], idxs[rows, :item_k]))
+                row += item_xq.shape[0]
+
+    def _record_batch(self, batch: list, start: float):
+        queue_waits = [start - item[3] for item in batch]
+        num_queries = sum(item[0].shape[0] for item in batch)
+        SEARCH_BATCH_QUERIES.observe(num_queries)
+        for queue_wait in queue_waits:
+            SEARCH_QUEUE_WAIT_SECONDS.observe(queue_wait)
+
+        with self._stats_lock:
+            self.num_batches += 1
+            self.num_searches += len(batch)
+            self.num_queries += num_queries
+            self.last_batch_queries = num_queries
+            self.max_batch_queries = max(self.max_batch_queries, num_queries)
+            self.total_queue_wait += sum(queue_waits)
+            self.max_queue_wait = max(self.max_queue_wait, max(queue_waits))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "batches": self.num_batches,
+                "searches": self.num_searches,
+                "queries": self.num_queries,
+                "mean_batch_queries": (
+                    self.num_queries / self.num_batches if self.num_batches else 0
+                ),
+                "max_batch_queries": self.max_batch_queries,
+                "last_batch_queries": self.last_batch_queries,
+                "mean_queue_wait_ms": (
+                    1000 * self.total_queue_wait / self.num_searches
+                    if self.num_searches
+                    else 0
+                ),
+                "max_queue_wait_ms": 1000 * self.max_queue_wait,
+            }
@@ -0,0 +1,114 @@
+"""
+Submodule for caching nearest neighbour results in the API.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+from typing import Hashable, List, Optional, Tuple
+import numpy as np
+
+
+class NeighboursCache:
+    def __init__(self, max_size: int = 10_000, ttl: float = None):
+        """In-process LRU cache of nearest neighbour results, keyed by model version and entity.
+
+        Each entity stores the result for the largest k it has been requested with, so requests with a smaller k are
+        served from the same entry. Keying by model version means a request that finishes on an old model after the
+        model is swapped can't cache its results for the new one. Entries for old versions are never read again, and
+        are evicted as the least recently used.
+
+        Args:
+            max_size (int, optional): maximum number of entities to store results for. The least recently used entity is
+                evicted when this is exceeded. 0 disables the cache. Defaults to 10_000.
+            ttl (float, optional): number of seconds after which an entry expires. Defaults to None (entries don't expire).
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # (model version, entity) -> (k, results, expiry time)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _is_expired(entry: tuple) -> bool:
+        return entry[2] is not None and entry[2] < time.monotonic()
+
+    def get(
+        self, model_version: Hashable, entity: str, k: int
+    ) -> Optional[Tuple[List[str], np.ndarray]]:
+        """Get the `k` cached nearest neighbours of `entity` from model `model_version` and their distances, or None if
+        no result for at least `k` neighbours is cached.
+        """
+        key = (model_version, entity)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and self._is_expired(entry):
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None or entry[0] < k:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            neighbours, distances = entry[1]
+
+            return neighbours[:k], distances[:k]
+
+    def put(
+        self,
+        model_version: Hashable,
+        entity: str,
+        k: int,
+        results: Tuple[List[str], np.ndarray],
+    ):
+        """Cache the `k` nearest neighbours of `entity` from model `model_version` and their distances, as
+        `(neighbours, distances)`. Doesn't replace a live entry for a larger k.
+        """
+        if self.max_size <= 0:
+            return
+
+        key = (model_version, entity)
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > k and not self._is_expired(entry):
+                self._entries.move_to_end(key)
+                return
+
+            self._entries[key] = (k, results, expiry)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
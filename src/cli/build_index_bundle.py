@@ -0,0 +1,65 @@
+"""
+Build an index bundle for the API (see `src.index_bundle`), so that the Faiss index doesn't have to be rebuilt each
+time the API starts.
+
+Run from the repository root, e.g.:
+python -m src.cli.build_index_bundle -n heritageconnector_RotatE -o ./data/processed/bundles/heritageconnector_RotatE
+"""
+
+import json
+import click
+from src.cli.log import get_logger
+from src.cli.store_options import embedding_store_options, load_embedding_store
+from src.index_bundle import build_bundle
+from src.nearest_neighbours import FaissNearestNeighbours
+
+logger = get_logger(__name__)
+
+
+@click.command()
+@click.option("-n", "--model_name", type=str, required=True)
+@click.option(
+    "-o",
+    "--output_path",
+    type=click.Path(dir_okay=True, file_okay=False),
+    required=True,
+    help="Folder to write the bundle to. Created if it does not already exist.",
+)
+@click.option(
+    "-p",
+    "--index_params",
+    type=str,
+    envvar="FAISS_INDEX_PARAMS",
+    default="{}",
+    help="JSON of `FaissNearestNeighbours` parameters. Defaults to $FAISS_INDEX_PARAMS, or an exact index if that isn't set.",
+)
+@embedding_store_options
+def main(
+    model_name,
+    output_path,
+    index_params,
+    entity_embedding_path,
+    relation_embedding_path,
+    entity_mapping_path,
+    relation_mapping_path,
+):
+    embedding_store = load_embedding_store(
+        entity_embedding_path,
+        relation_embedding_path,
+        entity_mapping_path,
+        relation_mapping_path,
+    )
+
+    logger.info(f"Fitting index with parameters {index_params}")
+    nearest_neighbours = FaissNearestNeighbours(
+        embedding_store, **json.loads(index_params)
+    ).fit("entities")
+
+    manifest = build_bundle(nearest_neighbours, output_path, model_name)
+    logger.info(
+        f"Bundle version {manifest['version']} for model {model_name} saved to {output_path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Precompute the nearest neighbours of every entity in an index bundle (see `src.neighbour_table`). Rerunning the same
+command after an interruption resumes the build.
+
+Run from the repository root, e.g.:
+python -m src.cli.build_neighbour_table -b ./data/processed/bundles/heritageconnector_RotatE -k 100
+"""
+
+import os
+import click
+from src.cli.log import get_logger
+from src.embedding_store import load_embeddings_matrix
+from src.index_bundle import read_manifest
+from src.neighbour_table import build_neighbour_table
+
+logger = get_logger(__name__)
+
+
+@click.command()
+@click.option(
+    "-b",
+    "--bundle_path",
+    type=click.Path(exists=True, file_okay=False),
+    required=True,
+    help="Index bundle to compute neighbours for.",
+)
+@click.option(
+    "-o",
+    "--output_path",
+    type=click.Path(file_okay=False),
+    required=False,
+    help="Folder to write the table to. Defaults to a `neighbour_table` folder inside the bundle.",
+)
+@click.option(
+    "-k",
+    type=int,
+    required=True,
+    help="Maximum number of neighbours that will be requested for an entity.",
+)
+@click.option("--block_size", type=int, default=10_000)
+@click.option(
+    "-t",
+    "--num_threads",
+    type=int,
+    default=None,
+    help="Number of threads to use. Defaults to all cores.",
+)
+def main(bundle_path, output_path, k, block_size, num_threads):
+    manifest = read_manifest(bundle_path)
+    output_path = output_path or os.path.join(bundle_path, "neighbour_table")
+
+    embeddings = load_embeddings_matrix(
+        os.path.join(bundle_path, manifest["files"]["entity_embeddings"]["file_name"]),
+        mmap=True,
+    )
+
+    # The nearest neighbour of each entity is itself, so one extra neighbour is stored.
+    table = build_neighbour_table(
+        embeddings,
+        output_path,
+        k + 1,
+        block_size=block_size,
+        num_threads=num_threads,
+        model_version=manifest["version"],
+    )
+    logger.info(
+        f"Neighbour table of {table.width - 1} neighbours for {table.neighbours.shape[0]:,} entities saved to {output_path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Partition the entity embeddings into shards, each with its own Faiss index, for serving with
+`python -m src.cli.serve_shard` (see `src.sharding`).
+
+Run from the repository root, e.g.:
+python -m src.cli.build_shards -n heritageconnector_RotatE -s 4 -o ./data/processed/shards/heritageconnector_RotatE
+"""
+
+import json
+import click
+from src.cli.log import get_logger
+from src.cli.store_options import embedding_store_options, load_embedding_store
+from src.sharding import build_shards
+
+logger = get_logger(__name__)
+
+
+@click.command()
+@click.option("-n", "--model_name", type=str, required=True)
+@click.option("-s", "--num_shards", type=int, required=True)
+@click.option(
+    "-o",
+    "--output_path",
+    type=click.Path(dir_okay=True, file_okay=False),
+    required=True,
+    help="Folder to write the shards to, as `{output_path}/shard_{i}`. Created if it does not already exist.",
+)
+@click.option(
+    "-p",
+    "--index_params",
+    type=str,
+    envvar="FAISS_INDEX_PARAMS",
+    default="{}",
+    help="JSON of `FaissNearestNeighbours` parameters for each shard's index. Defaults to $FAISS_INDEX_PARAMS, or an exact index if that isn't set.",
+)
+@embedding_store_options
+def main(
+    model_name,
+    num_shards,
+    output_path,
+    index_params,
+    entity_embedding_path,
+    relation_embedding_path,
+    entity_mapping_path,
+    relation_mapping_path,
+):
+    embedding_store = load_embedding_store(
+        entity_embedding_path,
+        relation_embedding_path,
+        entity_mapping_path,
+        relation_mapping_path,
+    )
+
+    shard_folders = build_shards(
+        embedding_store,
+        output_path,
+        num_shards,
+        model_name,
+        **json.loads(index_params),
+    )
+    logger.info(f"{len(shard_folders)} shards of {model_name} saved to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Cluster the entity embeddings on CPU (see `src.clustering`): train k-means on a sample, assign every entity to a
+cluster, and optionally merge density-connected clusters and label outliers as noise.
+
+Run from the repository root, e.g.:
+python -m src.cli.cluster_embeddings -n 1000 -o ./data/processed/clusters/kmeans_1000 --merge_eps 0.5 --noise_quantile 0.99
+
+Setting `CLUSTERS_PATH` to the output folder makes the API serve cluster lookups.
+"""
+
+import os
+import time
+import click
+from src.cli.log import get_logger
+from src.cli.store_options import embedding_store_options, load_embedding_store
+from src.clustering import (
+    assign_to_centroids,
+    mark_outliers,
+    merge_clusters,
+    save_clusters,
+    train_kmeans,
+    write_group_mapping,
+)
+
+logger = get_logger(__name__)
+
+
+@click.command()
+@click.option("-n", "--n_clusters", type=int, required=True)
+@click.option(
+    "-o",
+    "--output_path",
+    type=click.Path(file_okay=False),
+    required=True,
+    help="Folder to save labels, centroids and clusters.json to. Created if it does not already exist.",
+)
+@click.option(
+    "-s",
+    "--sample_size",
+    type=int,
+    default=1_000_000,
+    help="Number of entities to train k-means on.",
+)
+@click.option("--niter", type=int, default=20, help="Number of k-means iterations.")
+@click.option(
+    "--merge_eps",
+    type=float,
+    required=False,
+    help="Merge clusters whose centroids are density-connected within this L2 distance.",
+)
+@click.option(
+    "--noise_quantile",
+    type=float,
+    required=False,
+    help="Label entities further from their centroid than this quantile of their cluster's distances as noise (-1).",
+)
+@click.option(
+    "-m",
+    "--mapping_path",
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="Also write labels as a group mapping TSV, e.g. {ENTITY_GROUPS_PATH}/mapping_cluster.tsv, so the API can filter by cluster.",
+)
+@click.option("-b", "--block_size", type=int, default=100_000)
+@click.option(
+    "-t",
+    "--num_threads",
+    type=int,
+    required=False,
+    help="Number of threads to assign entities with. Defaults to one per core.",
+)
+@click.option("--random_state", type=int, default=42)
+@embedding_store_options
+def main(
+    n_clusters,
+    output_path,
+    sample_size,
+    niter,
+    merge_eps,
+    noise_quantile,
+    mapping_path,
+    block_size,
+    num_threads,
+    random_state,
+    entity_embedding_path,
+    relation_embedding_path,
+    entity_mapping_path,
+    relation_mapping_path,
+):
+    embedding_store = load_embedding_store(
+        entity_embedding_path,
+        relation_embedding_path,
+        entity_mapping_path,
+        relation_mapping_path,
+    )
+    matrix = embedding_store.ent_embedding_matrix
+
+    start = time.perf_counter()
+    logger.info(
+        f"Training k-means with {n_clusters} clusters on {min(sample_size, matrix.shape[0]):,} entities"
+    )
+    centroids = train_kmeans(
+        matrix,
+        n_clusters,
+        sample_size=sample_size,
+        niter=niter,
+        random_state=random_state,
+    )
+    train_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    logger.info(f"Assigning {matrix.shape[0]:,} entities to clusters")
+    labels, distances = assign_to_centroids(
+        matrix, centroids, block_size=block_size, num_threads=num_threads
+    )
+    assign_time = time.perf_counter() - start
+
+    if merge_eps is not None:
+        merged = merge_clusters(centroids, merge_eps)
+        labels = merged[labels]
+        logger.info(
+            f"Merged {n_clusters} clusters into {merged.max() + 1} with eps={merge_eps}"
+        )
+
+    if noise_quantile is not None:
+        labels = mark_outliers(labels, distances, noise_quantile)
+
+    info = save_clusters(
+        output_path,
+        labels,
+        centroids,
+        {
+            "entity_embedding_path": os.path.abspath(entity_embedding_path),
+            "n_clusters": n_clusters,
+            "sample_size": sample_size,
+            "niter": niter,
+            "merge_eps": merge_eps,
+            "noise_quantile": noise_quantile,
+            "random_state": random_state,
+            "train_time_s": train_time,
+            "assign_time_s": assign_time,
+        },
+    )
+    logger.info(
+        f"{info['num_clusters']} clusters ({info['num_noise']:,} noise entities) saved to {output_path}"
+    )
+
+    if mapping_path:
+        write_group_mapping(mapping_path, embedding_store, labels)
+        logger.info(f"Group mapping saved to {mapping_path}")
+
+
+if __name__ == "__main__":
+    main()
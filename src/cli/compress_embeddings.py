@@ -0,0 +1,172 @@
+"""
+Compress an entity embeddings matrix (see `src.compressed_embeddings`) and compare the nearest neighbours and
+distances of each compression method against the float32 matrix.
+
+Run from the repository root, e.g.:
+python -m src.cli.compress_embeddings -m float16 -m int8 -m pq -o ./data/processed/final_model_dglke_vanda -r ./data/interim/compression_report.csv
+
+Setting `ENTITY_EMBEDDING_PATH` to one of the saved folders makes the API serve the compressed matrix.
+"""
+
+import os
+import time
+import click
+import faiss
+import numpy as np
+import pandas as pd
+from src.cli.evaluate_ann_indexes import recall_at_k
+from src.cli.log import get_logger
+from src.compressed_embeddings import COMPRESSION_METHODS, compress_embeddings
+from src.embedding_store import load_embeddings_matrix
+
+logger = get_logger(__name__)
+
+
+def compare_compression_methods(
+    matrix: np.ndarray,
+    methods: list,
+    k: int = 10,
+    n_queries: int = 1000,
+    n_pairs: int = 100_000,
+    random_state: int = 42,
+    output_prefix: str = None,
+    **compression_kwargs,
+) -> pd.DataFrame:
+    """Compress `matrix` with each of `methods`, and measure how much the nearest neighbours of a random sample of
+    rows and the squared L2 distances between random pairs of rows change from the float32 matrix.
+
+    Args:
+        matrix (np.ndarray): float32 embeddings matrix
+        methods (list): compression methods. See `COMPRESSION_METHODS`.
+        k (int, optional): number of neighbours to compare. Defaults to 10.
+        n_queries (int, optional): number of rows to compare neighbours for. Defaults to 1000.
+        n_pairs (int, optional): number of pairs of rows to compare distances for. Defaults to 100_000.
+        random_state (int, optional): seed for sampling rows. Defaults to 42.
+        output_prefix (str, optional): save each compressed matrix to the folder `{output_prefix}.{method}`. Defaults
+            to None.
+        **compression_kwargs: passed to `compress_embeddings`, e.g. `m` for "pq"
+
+    Returns:
+        pd.DataFrame: one row per method, including float32
+    """
+    rnd = np.random.RandomState(random_state)
+    num_rows = matrix.shape[0]
+    query_rows = np.sort(rnd.choice(num_rows, min(n_queries, num_rows), replace=False))
+    pairs = rnd.randint(0, num_rows, size=(n_pairs, 2))
+
+    def _distances(x: np.ndarray) -> np.ndarray:
+        diffs = x[pairs[:, 0]].astype(np.float64) - x[pairs[:, 1]]
+        return np.einsum("ij,ij->i", diffs, diffs)
+
+    xb = np.ascontiguousarray(matrix, dtype=np.float32)
+    true_distances = _distances(xb)
+    _, true_idxs = faiss.knn(xb[query_rows], xb, k)
+    results = [{"method": "float32", "bytes": xb.nbytes, f"recall_at_{k}": 1.0}]
+
+    for method in methods:
+        kwargs = compression_kwargs if method == "pq" else {}
+        start = time.perf_counter()
+        compressed = compress_embeddings(matrix, method, **kwargs)
+        encode_time = time.perf_counter() - start
+
+        decoded = compressed.decode_blocks()
+        # Both queries and indexed vectors are decoded, as they are when the API serves a compressed matrix.
+        _, idxs = faiss.knn(decoded[query_rows], decoded, k)
+        distances = _distances(decoded)
+        abs_errors = np.abs(distances - true_distances)
+
+        results.append(
+            {
+                "method": method,
+                "bytes": compressed.nbytes,
+                "compression_ratio": xb.nbytes / compressed.nbytes,
+                f"recall_at_{k}": recall_at_k(true_idxs, idxs),
+                "distance_mean_abs_error": abs_errors.mean(),
+                "distance_mean_rel_error": (
+                    abs_errors / np.maximum(true_distances, np.finfo(np.float64).eps)
+                ).mean(),
+                "reconstruction_rmse": float(np.sqrt(np.mean((decoded - xb) ** 2))),
+                "encode_time_s": encode_time,
+            }
+        )
+        logger.info(
+            f"{method}: {results[-1]['compression_ratio']:.1f}x smaller, recall@{k}={results[-1][f'recall_at_{k}']:.3f}, mean relative distance error {results[-1]['distance_mean_rel_error']:.4f}"
+        )
+
+        if output_prefix:
+            compressed.save(f"{output_prefix}.{method}")
+
+        del decoded
+
+    return pd.DataFrame(results)
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--entity_embedding_path",
+    type=click.Path(exists=True, dir_okay=False),
+    envvar="ENTITY_EMBEDDING_PATH",
+    required=True,
+    help="Defaults to $ENTITY_EMBEDDING_PATH.",
+)
+@click.option(
+    "-m",
+    "--method",
+    "methods",
+    type=click.Choice(COMPRESSION_METHODS),
+    multiple=True,
+    default=COMPRESSION_METHODS,
+    help="Compression method to compare. Can be given more than once. Defaults to all methods.",
+)
+@click.option(
+    "-o",
+    "--output_path",
+    type=click.Path(file_okay=False),
+    required=False,
+    help="Folder to save each compressed matrix to, as `{output_path}/{entity embeddings file name}.{method}`.",
+)
+@click.option("-r", "--report_path", type=click.Path(dir_okay=False), required=True)
+@click.option(
+    "--pq_m",
+    type=int,
+    default=16,
+    help="Number of bytes per row for product quantization.",
+)
+@click.option("-k", type=int, default=10, help="Number of neighbours to compare.")
+@click.option("-n", "--n_queries", type=int, default=1000)
+@click.option("--random_state", type=int, default=42)
+def main(
+    entity_embedding_path,
+    methods,
+    output_path,
+    report_path,
+    pq_m,
+    k,
+    n_queries,
+    random_state,
+):
+    matrix = load_embeddings_matrix(entity_embedding_path, mmap=True)
+    output_prefix = None
+
+    if output_path:
+        # e.g. heritageconnector_RotatE_entity.npy -> heritageconnector_RotatE_entity.int8
+        output_prefix = os.path.join(
+            output_path, os.path.splitext(os.path.basename(entity_embedding_path))[0]
+        )
+
+    report = compare_compression_methods(
+        matrix,
+        list(methods),
+        k=k,
+        n_queries=n_queries,
+        random_state=random_state,
+        output_prefix=output_prefix,
+        m=pq_m,
+    )
+    report.to_csv(report_path, index=False)
+    logger.info(f"Report for {len(methods)} compression methods saved to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import click
+from log import get_logger
+from encoded_triples import EncodedTriples
+
+logger = get_logger(__name__)
+
+
+@click.command()
+@click.option(
+    "-i", "--input_path", type=click.Path(dir_okay=False, exists=True), required=True
+)
+@click.option(
+    "-o",
+    "--output_path",
+    type=click.Path(file_okay=False),
+    required=True,
+    help="Folder to save the encoded triples to. Created if it does not already exist.",
+)
+@click.option(
+    "-c",
+    "--chunksize",
+    type=int,
+    default=1_000_000,
+    help="Number of triples to read and encode at a time.",
+)
+def encode_triples(input_path: str, output_path: str, chunksize: int):
+    """
+    Convert a TSV of triples into integer subject/predicate/object IDs and entity/relation vocabularies, which the other
+    CLI steps can read in place of the TSV without having to parse it again.
+    """
+
+    encoded = EncodedTriples.from_tsv(input_path, chunksize=chunksize)
+    encoded.save(output_path)
+
+    logger.info(
+        f"Encoded {len(encoded):,} triples ({len(encoded.entities):,} entities, {len(encoded.relations):,} relations) to {output_path}."
+    )
+
+
+if __name__ == "__main__":
+    encode_triples()
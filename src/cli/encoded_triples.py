@@ -0,0 +1,192 @@
+import json
+import os
+from typing import Dict
+import numpy as np
+import pandas as pd
+import torch
+from pykeen.triples import TriplesFactory
+from utils import iter_triples_from_tsv, triplesfactory_from_tsv
+
+TRIPLES_FILE_NAME = "triples.npy"
+ENTITIES_FILE_NAME = "entities.json"
+RELATIONS_FILE_NAME = "relations.json"
+
+
+def _encode(values: pd.Series, vocab: Dict[str, int]) -> np.ndarray:
+    """Convert labels to integer IDs, adding any labels not already in `vocab` to it."""
+    codes, uniques = pd.factorize(values)
+    unique_ids = np.fromiter(
+        (vocab.setdefault(label, len(vocab)) for label in uniques),
+        dtype=np.int32,
+        count=len(uniques),
+    )
+
+    return unique_ids[codes]
+
+
+def is_encoded_triples(path: str) -> bool:
+    """Whether `path` is a folder of triples saved by `EncodedTriples.save`."""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, TRIPLES_FILE_NAME))
+
+
+class EncodedTriples:
+    def __init__(
+        self, triples: np.ndarray, entities: np.ndarray, relations: np.ndarray
+    ):
+        """Triples stored as integer IDs, with the entity and relation labels that the IDs refer to.
+
+        Args:
+            triples (np.ndarray): int32 matrix with columns subject, predicate, object
+            entities (np.ndarray): entity labels, where the label of entity ID i is `entities[i]`
+            relations (np.ndarray): relation labels, where the label of relation ID i is `relations[i]`
+        """
+        self.triples = triples
+        self.entities = entities
+        self.relations = relations
+
+    def __len__(self):
+        return self.triples.shape[0]
+
+    @property
+    def subjects(self) -> np.ndarray:
+        return self.triples[:, 0]
+
+    @property
+    def predicates(self) -> np.ndarray:
+        return self.triples[:, 1]
+
+    @property
+    def objects(self) -> np.ndarray:
+        return self.triples[:, 2]
+
+    @classmethod
+    def from_tsv(cls, input_path: str, chunksize: int = 1_000_000) -> "EncodedTriples":
+        """Encode a TSV of triples, reading it `chunksize` triples at a time. See `utils.load_triples_from_tsv`."""
+        entity_to_id = {}
+        relation_to_id = {}
+        encoded_chunks = []
+
+        for chunk in iter_triples_from_tsv(input_path, chunksize=chunksize):
+            encoded_chunks.append(
+                np.column_stack(
+                    [
+                        _encode(chunk["subject"], entity_to_id),
+                        _encode(chunk["predicate"], relation_to_id),
+                        _encode(chunk["object"], entity_to_id),
+                    ]
+                )
+            )
+
+        triples = (
+            np.concatenate(encoded_chunks)
+            if encoded_chunks
+            else np.empty((0, 3), dtype=np.int32)
+        )
+
+        return cls(
+            triples,
+            np.array(list(entity_to_id), dtype=object),
+            np.array(list(relation_to_id), dtype=object),
+        )
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = True) -> "EncodedTriples":
+        """Load triples saved with `EncodedTriples.save`. With `mmap=True` the triples matrix is memory-mapped read-only."""
+        triples = np.load(
+            os.path.join(folder, TRIPLES_FILE_NAME), mmap_mode="r" if mmap else None
+        )
+
+        with open(os.path.join(folder, ENTITIES_FILE_NAME), "r") as f:
+            entities = np.array(json.load(f), dtype=object)
+
+        with open(os.path.join(folder, RELATIONS_FILE_NAME), "r") as f:
+            relations = np.array(json.load(f), dtype=object)
+
+        return cls(triples, entities, relations)
+
+    def save(self, folder: str):
+        """Save to `folder` (created if it doesn't exist) as an .npy triples matrix and JSON lists of labels."""
+        os.makedirs(folder, exist_ok=True)
+        np.save(
+            os.path.join(folder, TRIPLES_FILE_NAME),
+            np.ascontiguousarray(self.triples, dtype=np.int32),
+        )
+
+        with open(os.path.join(folder, ENTITIES_FILE_NAME), "w") as f:
+            json.dump(self.entities.tolist(), f)
+
+        with open(os.path.join(folder, RELATIONS_FILE_NAME), "w") as f:
+            json.dump(self.relations.tolist(), f)
+
+    def subset(self, mask: np.ndarray) -> "EncodedTriples":
+        """Select triples by a boolean mask or array of row numbers, keeping the same entity and relation IDs."""
+        return EncodedTriples(self.triples[mask], self.entities, self.relations)
+
+    def compact(self) -> "EncodedTriples":
+        """Drop entities and relations which aren't used by any triple, renumbering IDs to be contiguous."""
+        triples = np.empty(self.triples.shape, dtype=np.int32)
+
+        used_entities = np.unique(np.concatenate([self.subjects, self.objects]))
+        entity_id_map = np.full(len(self.entities), -1, dtype=np.int32)
+        entity_id_map[used_entities] = np.arange(len(used_entities), dtype=np.int32)
+
+        used_relations = np.unique(self.predicates)
+        relation_id_map = np.full(len(self.relations), -1, dtype=np.int32)
+        relation_id_map[used_relations] = np.arange(len(used_relations), dtype=np.int32)
+
+        triples[:, 0] = entity_id_map[self.subjects]
+        triples[:, 1] = relation_id_map[self.predicates]
+        triples[:, 2] = entity_id_map[self.objects]
+
+        return EncodedTriples(
+            triples, self.entities[used_entities], self.relations[used_relations]
+        )
+
+    def to_dataframe(self, rows: slice = slice(None)) -> pd.DataFrame:
+        """Decode (a slice of) the triples to a DataFrame of labels, as returned by `utils.load_triples_from_tsv`."""
+        triples = self.triples[rows]
+
+        return pd.DataFrame(
+            {
+                "subject": self.entities[triples[:, 0]],
+                "predicate": self.relations[triples[:, 1]],
+                "object": self.entities[triples[:, 2]],
+            }
+        )
+
+    def to_tsv(self, output_path: str, chunksize: int = 1_000_000):
+        """Decode the triples and write them to a TSV, `chunksize` triples at a time."""
+        with open(output_path, "w") as f:
+            for start in range(0, len(self), chunksize):
+                self.to_dataframe(slice(start, start + chunksize)).to_csv(
+                    f, sep="\t", index=False, header=False
+                )
+
+    def to_triplesfactory(self, **triplesfactory_kwargs) -> TriplesFactory:
+        """Create a `pykeen.triples.TriplesFactory` directly from the IDs, without re-deriving them from labels.
+        Unused entities and relations are dropped first, as they would be by `TriplesFactory.from_labeled_triples`.
+        """
+        compacted = self.compact()
+
+        return TriplesFactory(
+            mapped_triples=torch.from_numpy(compacted.triples.astype(np.int64)),
+            entity_to_id={
+                label: idx for idx, label in enumerate(compacted.entities.tolist())
+            },
+            relation_to_id={
+                label: idx for idx, label in enumerate(compacted.relations.tolist())
+            },
+            **triplesfactory_kwargs,
+        )
+
+
+def load_triplesfactory(input_path: str, **triplesfactory_kwargs) -> TriplesFactory:
+    """
+    Create a `pykeen.triples.TriplesFactory` from either a folder of encoded triples (see `EncodedTriples`) or a TSV.
+    """
+    if is_encoded_triples(input_path):
+        return EncodedTriples.load(input_path).to_triplesfactory(
+            **triplesfactory_kwargs
+        )
+
+    return triplesfactory_from_tsv(input_path, **triplesfactory_kwargs)
@@ -0,0 +1,178 @@
+"""
+Compare the recall and throughput of approximate Faiss indexes against an exact (flat) index.
+
+Run from the repository root, e.g.:
+python -m src.cli.evaluate_ann_indexes -c ./config/ann_index_configs.json -o ./data/interim/ann_evaluation.csv
+"""
+
+import itertools
+import json
+import time
+import click
+import numpy as np
+import pandas as pd
+from src.cli.log import get_logger
+from src.cli.store_options import embedding_store_options, load_embedding_store
+from src.embedding_store import KGEmbeddingStore
+from src.nearest_neighbours import FaissNearestNeighbours
+
+logger = get_logger(__name__)
+
+# Search-time parameters which can be given as lists in a config, to be evaluated without rebuilding the index.
+SEARCH_PARAMS = ("nprobe", "ef_search")
+
+
+def recall_at_k(true_idxs: np.ndarray, approx_idxs: np.ndarray) -> float:
+    """Mean proportion of the true k nearest neighbours of each query that were returned by the approximate search."""
+    k = true_idxs.shape[1]
+    hits = sum(
+        len(np.intersect1d(true_row, approx_row[approx_row >= 0]))
+        for true_row, approx_row in zip(true_idxs, approx_idxs)
+    )
+
+    return hits / (k * true_idxs.shape[0])
+
+
+def _timed_search(nn: FaissNearestNeighbours, xq: np.ndarray, k: int, batch_size: int):
+    idxs = []
+    start = time.perf_counter()
+    for batch_start in range(0, xq.shape[0], batch_size):
+        batch = slice(batch_start, batch_start + batch_size)
+        _, batch_idxs = nn.search_vectors(xq[batch], k)
+        idxs.append(batch_idxs)
+    elapsed = time.perf_counter() - start
+
+    return np.concatenate(idxs), elapsed
+
+
+def evaluate_index_configs(
+    embedding_store: KGEmbeddingStore,
+    configs: list,
+    k: int = 10,
+    n_queries: int = 1000,
+    batch_size: int = 1,
+    random_state: int = 42,
+) -> pd.DataFrame:
+    """Measure recall@k and queries per second of each Faiss index config against an exact flat index, using a random
+    sample of entities as queries.
+
+    Args:
+        embedding_store (KGEmbeddingStore): store containing the entity embeddings to index
+        configs (list): list of dicts of `FaissNearestNeighbours` arguments, each with an optional "name". `nprobe` and
+            `ef_search` can be lists, in which case each value is evaluated on the same index.
+        k (int, optional): number of neighbours to retrieve. Defaults to 10.
+        n_queries (int, optional): number of entities to sample as queries. Defaults to 1000.
+        batch_size (int, optional): number of queries per search call. Defaults to 1.
+        random_state (int, optional): seed for sampling queries. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: one row per (config, search params) combination
+    """
+    X = embedding_store.ent_embedding_matrix
+    rnd = np.random.RandomState(random_state)
+    query_rows = np.sort(
+        rnd.choice(X.shape[0], min(n_queries, X.shape[0]), replace=False)
+    )
+    xq = np.ascontiguousarray(X[query_rows], dtype="float32")
+
+    logger.info(f"Computing exact neighbours for {len(query_rows):,} queries")
+    flat = FaissNearestNeighbours(embedding_store, index_type="flat").fit("entities")
+    true_idxs, flat_time = _timed_search(flat, xq, k, batch_size)
+    flat_qps = len(query_rows) / flat_time
+    del flat
+
+    results = []
+
+    for config in configs:
+        config = dict(config)
+        name = config.pop("name", config.get("index_type", "flat"))
+        search_param_values = {
+            param: (
+                config.pop(param)
+                if isinstance(config.get(param), list)
+                else [config.get(param)]
+            )
+            for param in SEARCH_PARAMS
+        }
+
+        logger.info(f"Building index {name}")
+        start = time.perf_counter()
+        nn = FaissNearestNeighbours(embedding_store, **config).fit("entities")
+        build_time = time.perf_counter() - start
+
+        for nprobe, ef_search in itertools.product(
+            *[search_param_values[param] for param in SEARCH_PARAMS]
+        ):
+            nn.set_search_params(nprobe=nprobe, ef_search=ef_search)
+            approx_idxs, search_time = _timed_search(nn, xq, k, batch_size)
+            qps = len(query_rows) / search_time
+
+            results.append(
+                {
+                    "name": name,
+                    **nn.get_params(),
+                    f"recall_at_{k}": recall_at_k(true_idxs, approx_idxs),
+                    "qps": qps,
+                    "speedup_vs_flat": qps / flat_qps,
+                    "build_time_s": build_time,
+                }
+            )
+            logger.info(
+                f"{name} (nprobe={nn.nprobe}, ef_search={nn.ef_search}): recall@{k}={results[-1][f'recall_at_{k}']:.3f}, {qps:,.0f} QPS ({qps / flat_qps:.1f}x flat)"
+            )
+
+        del nn
+
+    return pd.DataFrame(results)
+
+
+@click.command()
+@click.option(
+    "-c",
+    "--config_path",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="JSON list of index configs. See `evaluate_index_configs`.",
+)
+@click.option("-o", "--output_path", type=click.Path(dir_okay=False), required=True)
+@embedding_store_options
+@click.option("-k", type=int, default=10, help="Number of neighbours to retrieve.")
+@click.option("-n", "--n_queries", type=int, default=1000)
+@click.option("-b", "--batch_size", type=int, default=1)
+@click.option("-r", "--random_state", type=int, default=42)
+def main(
+    config_path,
+    output_path,
+    entity_embedding_path,
+    relation_embedding_path,
+    entity_mapping_path,
+    relation_mapping_path,
+    k,
+    n_queries,
+    batch_size,
+    random_state,
+):
+    with open(config_path, "r") as f:
+        configs = json.load(f)
+
+    embedding_store = load_embedding_store(
+        entity_embedding_path,
+        relation_embedding_path,
+        entity_mapping_path,
+        relation_mapping_path,
+    )
+
+    results = evaluate_index_configs(
+        embedding_store,
+        configs,
+        k=k,
+        n_queries=n_queries,
+        batch_size=batch_size,
+        random_state=random_state,
+    )
+    results.to_csv(output_path, index=False)
+    logger.info(f"Results for {len(results)} configurations saved to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
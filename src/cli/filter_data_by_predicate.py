@@ -1,7 +1,9 @@
+import numpy as np
 import pandas as pd
 import click
 from log import get_logger
-from utils import load_triples_from_tsv
+from utils import iter_triples_from_tsv
+from encoded_triples import EncodedTriples, is_encoded_triples
 
 logger = get_logger(__name__)
 
@@ -10,19 +12,51 @@ logger = get_logger(__name__)
 @click.option("-i", "--input_path", required=True)
 @click.option("-o", "--output_path", required=True)
 @click.option("-p", "--predicate_filter_path", required=True)
+@click.option(
+    "-c",
+    "--chunksize",
+    type=int,
+    default=1_000_000,
+    help="Number of triples to read and filter at a time.",
+)
 def filter_triples_tsv_by_predicates(
-    input_path: str, output_path: str, predicate_filter_path: str
+    input_path: str, output_path: str, predicate_filter_path: str, chunksize: int
 ):
-    triples = load_triples_from_tsv(input_path)
+    """
+    Keep only triples whose predicate has `keep` set to 1 in the predicate filter CSV. If `input_path` is a folder of
+    encoded triples (see `encode_triples.py`) the output is saved as encoded triples to the folder `output_path`;
+    otherwise the input TSV is filtered a chunk at a time into the TSV `output_path`.
+    """
     predicate_filter = pd.read_csv(predicate_filter_path)
     predicates_keep = predicate_filter.loc[
         predicate_filter["keep"] == 1, "predicate"
     ].tolist()
 
-    filtered_triples = triples[triples["predicate"].isin(predicates_keep)]
-    filtered_triples.to_csv(output_path, sep="\t", index=False, header=False)
+    if is_encoded_triples(input_path):
+        triples = EncodedTriples.load(input_path)
+        keep_relation = np.isin(triples.relations, predicates_keep)
+        filtered_triples = triples.subset(keep_relation[triples.predicates])
+        filtered_triples.save(output_path)
+
+        logger.info(
+            f"Input no triples: {len(triples):,}. No predicates kept: {len(predicates_keep):,}/{len(predicate_filter):,}. Output no triples: {len(filtered_triples):,}."
+        )
+        return
+
+    # Triples are filtered a chunk at a time and appended to the output, so only one chunk is in memory at once.
+    num_triples = 0
+    num_filtered_triples = 0
+
+    with open(output_path, "w") as f:
+        for triples in iter_triples_from_tsv(input_path, chunksize=chunksize):
+            filtered_triples = triples[triples["predicate"].isin(predicates_keep)]
+            filtered_triples.to_csv(f, sep="\t", index=False, header=False)
+
+            num_triples += len(triples)
+            num_filtered_triples += len(filtered_triples)
+
     logger.info(
-        f"Input no triples: {len(triples):,}. No predicates kept: {len(predicates_keep):,}/{len(predicate_filter):,}. Output no triples: {len(filtered_triples):,}."
+        f"Input no triples: {num_triples:,}. No predicates kept: {len(predicates_keep):,}/{len(predicate_filter):,}. Output no triples: {num_filtered_triples:,}."
     )
 
 
@@ -0,0 +1,167 @@
+from typing import Tuple
+import numpy as np
+import pandas as pd
+from encoded_triples import EncodedTriples
+
+
+def _build_csr(nodes: np.ndarray, num_nodes: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Group triple rows by node: the rows of triples with node i are `rows[indptr[i]:indptr[i + 1]]`."""
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nodes, minlength=num_nodes), out=indptr[1:])
+    rows = np.argsort(nodes, kind="stable")
+
+    return indptr, rows
+
+
+def _gather(indptr: np.ndarray, rows: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """Get the triple rows of all of `nodes` from a CSR structure in one vectorised operation."""
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+    return rows[offsets + np.arange(lengths.sum())]
+
+
+class GraphSampler:
+    def __init__(self, triples: EncodedTriples):
+        """Sample subgraphs of a graph of encoded triples, using CSR indexes of each entity's outgoing and incoming triples.
+
+        Args:
+            triples (EncodedTriples): the graph
+        """
+        self.triples = triples
+        num_entities = len(triples.entities)
+        subjects = np.asarray(triples.subjects)
+        objects = np.asarray(triples.objects)
+
+        self._subjects = subjects
+        self._objects = objects
+        self._out_indptr, self._out_rows = _build_csr(subjects, num_entities)
+        self._in_indptr, self._in_rows = _build_csr(objects, num_entities)
+
+    def entities_in_namespace(self, namespace: str) -> np.ndarray:
+        """Boolean mask over entity IDs of entities whose label contains `namespace`, e.g. "sciencemuseum"."""
+        return (
+            pd.Series(self.triples.entities).str.contains(namespace, regex=False).values
+        )
+
+    def sample_seeds(
+        self,
+        proportion: float,
+        namespace: str = None,
+        random_state: int = 100,
+    ) -> np.ndarray:
+        """Sample a proportion of the entities which are the subject of at least one triple, without replacement.
+
+        Args:
+            proportion (float): proportion of candidate entities to sample, between 0 and 1
+            namespace (str, optional): only sample entities whose label contains this. Defaults to None.
+            random_state (int, optional): Defaults to 100.
+
+        Returns:
+            np.ndarray: sorted entity IDs
+        """
+        is_candidate = np.diff(self._out_indptr) > 0
+        if namespace:
+            is_candidate &= self.entities_in_namespace(namespace)
+
+        candidates = np.flatnonzero(is_candidate)
+        rnd = np.random.RandomState(random_state)
+
+        return np.sort(
+            rnd.choice(candidates, int(proportion * len(candidates)), replace=False)
+        )
+
+    def sample(
+        self,
+        seeds: np.ndarray,
+        hops: int = 1,
+        out_hops: int = 0,
+        out_hop_mask: np.ndarray = None,
+        max_nodes: int = None,
+        max_edges: int = None,
+        random_state: int = 100,
+    ) -> np.ndarray:
+        """Sample the neighbourhood of `seeds` by breadth-first search.
+
+        Each of the first `hops` hops follows both the outgoing and incoming triples of the newly reached entities. The
+        `out_hops` hops after that only follow outgoing triples of the entities newly reached as objects, e.g. to add
+        the descriptions of entities the neighbourhood refers to, but not of entities which only refer to it.
+
+        When following a hop would take the sample over `max_nodes` entities or `max_edges` triples, a random subset
+        of the new entities or triples is kept to meet the budget, and sampling stops.
+
+        Args:
+            seeds (np.ndarray): entity IDs to start from
+            hops (int, optional): number of hops following triples in both directions. Defaults to 1.
+            out_hops (int, optional): number of further hops following outgoing triples only. Defaults to 0.
+            out_hop_mask (np.ndarray, optional): boolean mask over entity IDs of the entities that outgoing-only hops
+                are followed from. Defaults to None (all entities).
+            max_nodes (int, optional): maximum number of entities in the sample, including seeds. Defaults to None.
+            max_edges (int, optional): maximum number of triples in the sample. Defaults to None.
+            random_state (int, optional): seed used to meet budgets. Defaults to 100.
+
+        Returns:
+            np.ndarray: sorted rows of the triples in the sample
+        """
+        rnd = np.random.RandomState(random_state)
+        visited = np.zeros(len(self.triples.entities), dtype=bool)
+        visited[seeds] = True
+        num_visited = int(visited.sum())
+        selected = np.zeros(len(self.triples), dtype=bool)
+        num_selected = 0
+        frontier = np.flatnonzero(visited)
+
+        for hop in range(hops + out_hops):
+            if len(frontier) == 0:
+                break
+
+            if hop < hops:
+                rows = np.concatenate(
+                    [
+                        _gather(self._out_indptr, self._out_rows, frontier),
+                        _gather(self._in_indptr, self._in_rows, frontier),
+                    ]
+                )
+            else:
+                if out_hop_mask is not None:
+                    frontier = frontier[out_hop_mask[frontier]]
+                rows = _gather(self._out_indptr, self._out_rows, frontier)
+
+            rows = np.unique(rows)
+            rows = rows[~selected[rows]]
+            budget_reached = False
+
+            if max_edges is not None and num_selected + len(rows) > max_edges:
+                rows = np.sort(
+                    rnd.choice(rows, max_edges - num_selected, replace=False)
+                )
+                budget_reached = True
+
+            new_nodes = np.unique(
+                np.concatenate([self._subjects[rows], self._objects[rows]])
+            )
+            new_nodes = new_nodes[~visited[new_nodes]]
+
+            if max_nodes is not None and num_visited + len(new_nodes) > max_nodes:
+                new_nodes = rnd.choice(
+                    new_nodes, max(max_nodes - num_visited, 0), replace=False
+                )
+                budget_reached = True
+
+            visited[new_nodes] = True
+            num_visited += len(new_nodes)
+            # Only keep triples whose entities are both in the sample, which may not be the case if a budget was met.
+            rows = rows[visited[self._subjects[rows]] & visited[self._objects[rows]]]
+            selected[rows] = True
+            num_selected += len(rows)
+
+            if hop + 1 < hops:
+                frontier = np.sort(new_nodes)
+            else:
+                frontier = np.intersect1d(new_nodes, self._objects[rows])
+
+            if budget_reached:
+                break
+
+        return np.flatnonzero(selected)
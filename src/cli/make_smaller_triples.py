@@ -1,70 +1,99 @@
 import click
-import numpy as np
-import pandas as pd
 from log import get_logger
-from utils import load_triples_from_tsv
+from encoded_triples import EncodedTriples, is_encoded_triples
+from graph_sampler import GraphSampler
 
 logger = get_logger(__name__)
 
 
 @click.command()
-@click.option(
-    "-i", "--input_path", type=click.Path(dir_okay=False, exists=True), required=True
-)
-@click.option("-o", "--output_path", type=click.Path(dir_okay=False), required=True)
+@click.option("-i", "--input_path", type=click.Path(exists=True), required=True)
+@click.option("-o", "--output_path", type=click.Path(), required=True)
 @click.option("-k", "--keep_subjects_proportion", type=float, required=True)
 @click.option("-r", "--random_state", type=int, default=100)
+@click.option(
+    "-n",
+    "--seed_namespace",
+    type=str,
+    default="sciencemuseum",
+    help="Only sample seed subjects whose URI contains this. Pass an empty string to sample from all subjects.",
+)
+@click.option(
+    "--hops",
+    type=int,
+    default=1,
+    help="Number of hops from the seeds following triples in both directions.",
+)
+@click.option(
+    "--out_hops",
+    type=int,
+    default=1,
+    help="Number of further hops following only outgoing triples of entities outside the seed namespace (e.g. the Wikidata cache).",
+)
+@click.option(
+    "--max_nodes", type=int, default=None, help="Maximum number of entities to keep."
+)
+@click.option(
+    "--max_edges", type=int, default=None, help="Maximum number of triples to keep."
+)
 def make_smaller_triples(
     input_path: str,
     output_path: str,
     keep_subjects_proportion: float,
     random_state: int,
+    seed_namespace: str,
+    hops: int,
+    out_hops: int,
+    max_nodes: int,
+    max_edges: int,
 ):
     """
-    Make smaller triples file for testing, by keeping triples only from a subset of subjects (i.e. SMG records).
+    Make smaller triples file for testing, by keeping triples only from the neighbourhood of a subset of subjects (i.e. SMG records).
     The value of `keep_subjects_proportion` must be under 1, e.g. .3 keeps 30%.
-    """
-
-    triples = load_triples_from_tsv(input_path)
-
-    # Split the triples into those with subject from SMG (main graph), and those with subject from Wikidata
-    # (Wikidata cache).
-    smg_triples = triples[triples["subject"].str.contains("sciencemuseum")]
-    wikidata_triples = triples[triples["subject"].str.contains("wikidata")]
+    If `input_path` is a folder of encoded triples (see `encode_triples.py`), the output is saved as encoded triples too.
 
-    assert len(wikidata_triples) + len(smg_triples) == len(triples)
+    With the default options, this keeps every triple which has one of the sampled subjects as its subject or object,
+    and the triples whose subject is an entity outside the seed namespace (i.e. Wikidata) that those triples refer to.
+    """
 
-    # Get a random sample of subjects from SMG
-    unique_subjects = smg_triples["subject"].unique()
-    rnd = np.random.RandomState(random_state)
-    unique_subjects_small = rnd.choice(
-        unique_subjects, int(keep_subjects_proportion * len(unique_subjects))
+    input_is_encoded = is_encoded_triples(input_path)
+    triples = (
+        EncodedTriples.load(input_path)
+        if input_is_encoded
+        else EncodedTriples.from_tsv(input_path)
     )
 
-    # Get all the triples from the graph which either have one of the selected SMG entities as subject or object.
-    smg_triples_small = triples[
-        triples["subject"].isin(unique_subjects_small)
-        | triples["object"].isin(unique_subjects_small)  # noqa: W503
-    ]
-
-    # Join this with the relevant part of the Wikidata cache: the triples whose subject is an object in the above set.
-    relevant_wikidata_cache = wikidata_triples[
-        wikidata_triples["subject"].isin(smg_triples_small["object"].unique().tolist())
-    ]
-    smaller_triples = pd.concat(
-        [smg_triples_small, relevant_wikidata_cache], axis=0, ignore_index=True
+    sampler = GraphSampler(triples)
+    seeds = sampler.sample_seeds(
+        keep_subjects_proportion,
+        namespace=seed_namespace,
+        random_state=random_state,
+    )
+    out_hop_mask = (
+        ~sampler.entities_in_namespace(seed_namespace) if seed_namespace else None
     )
+    rows = sampler.sample(
+        seeds,
+        hops=hops,
+        out_hops=out_hops,
+        out_hop_mask=out_hop_mask,
+        max_nodes=max_nodes,
+        max_edges=max_edges,
+        random_state=random_state,
+    )
+    smaller_triples = triples.subset(rows)
 
-    smaller_triples.to_csv(output_path, sep="\t", index=False, header=False)
+    if input_is_encoded:
+        smaller_triples.save(output_path)
+    else:
+        smaller_triples.to_tsv(output_path)
 
     # Calculate and display some stats
     stats_triples_perc = round(len(smaller_triples) / len(triples) * 100, 2)
-    stats_entities_perc = round(
-        len(unique_subjects_small) / len(unique_subjects) * 100, 2
-    )
+    num_entities = len(smaller_triples.compact().entities)
 
     logger.info(
-        f"{len(smaller_triples):,} ({stats_triples_perc}%) triples for {len(unique_subjects_small):,} ({stats_entities_perc}%) entities saved to {output_path}."
+        f"{len(smaller_triples):,} ({stats_triples_perc}%) triples with {num_entities:,} entities from {len(seeds):,} seed subjects saved to {output_path}."
     )
 
 
@@ -5,7 +5,86 @@ import numpy as np
 import os
 import json
 import pathlib
-from utils import get_timestamp, triplesfactory_from_tsv
+from utils import get_timestamp
+from encoded_triples import load_triplesfactory
+from warm_start import (
+    affected_triples_mask,
+    align_embeddings,
+    init_from_neighbours,
+    init_new_relations,
+    load_delta_entities,
+    load_previous_model,
+    sample_replay,
+    to_initializer,
+)
+
+
+def warm_start(tf, config, previous_model_path, delta_path, replay_ratio, random_seed):
+    """
+    Set up an incremental run from a previous model: add initializers for the previous embeddings to the model kwargs
+    in `config`, and return a triples factory of the triples to train on, with the same entity and relation IDs as
+    `tf` so that the trained model has an embedding for every entity in the new graph.
+    """
+    (
+        previous_entity_embeddings,
+        previous_entity_to_id,
+        previous_relation_embeddings,
+        previous_relation_to_id,
+    ) = load_previous_model(previous_model_path)
+
+    entity_embeddings, known_entities = align_embeddings(
+        previous_entity_embeddings, previous_entity_to_id, tf.entity_to_id
+    )
+    relation_embeddings, known_relations = align_embeddings(
+        previous_relation_embeddings, previous_relation_to_id, tf.relation_to_id
+    )
+    mapped_triples = tf.mapped_triples.numpy()
+
+    entity_embeddings = init_from_neighbours(
+        entity_embeddings, known_entities, mapped_triples, random_state=random_seed
+    )
+    relation_embeddings = init_new_relations(
+        relation_embeddings, known_relations, random_state=random_seed
+    )
+
+    model_kwargs = config["pipeline"].setdefault("model_kwargs", {})
+    embedding_dim = model_kwargs.get("embedding_dim")
+    if embedding_dim is not None and embedding_dim != entity_embeddings.shape[1]:
+        raise ValueError(
+            f"The config's embedding_dim ({embedding_dim}) doesn't match the previous model's ({entity_embeddings.shape[1]})"
+        )
+    model_kwargs["entity_initializer"] = to_initializer(entity_embeddings)
+    model_kwargs["relation_initializer"] = to_initializer(relation_embeddings)
+
+    # Train on the triples of new entities and of entities in the delta, plus a replay sample of the rest.
+    affected_entities = ~known_entities
+    if delta_path:
+        delta_ids = [
+            tf.entity_to_id[label]
+            for label in load_delta_entities(delta_path)
+            if label in tf.entity_to_id
+        ]
+        affected_entities[delta_ids] = True
+
+    affected = affected_triples_mask(mapped_triples, affected_entities)
+    train_mask = sample_replay(affected, replay_ratio, random_state=random_seed)
+
+    config["metadata"].update(
+        {
+            "previous_model_path": previous_model_path,
+            "delta_path": delta_path,
+            "replay_ratio": replay_ratio,
+            "num_new_entities": int((~known_entities).sum()),
+            "num_new_relations": int((~known_relations).sum()),
+            "num_affected_triples": int(affected.sum()),
+            "num_training_triples": int(train_mask.sum()),
+        }
+    )
+    print(
+        f"Training incrementally on {train_mask.sum():,} of {len(mapped_triples):,} triples ({affected.sum():,} affected), with {(~known_entities).sum():,} new entities and {(~known_relations).sum():,} new relations."
+    )
+
+    return tf.clone_and_exchange_triples(tf.mapped_triples[train_mask])
 
 
 @click.command()
@@ -15,7 +94,7 @@ from utils import get_timestamp, triplesfactory_from_tsv
     "input_data_path",
     type=click.Path(exists=True),
     required=True,
-    help="Path to input file (TSV of triples).",
+    help="Path to input file (TSV of triples), or folder of encoded triples.",
 )
 @click.option(
     "-o",
@@ -48,6 +127,26 @@ from utils import get_timestamp, triplesfactory_from_tsv
     help="Path to load a checkpoint from, and start training at that checkpoint. See https://pykeen.readthedocs.io/en/stable/tutorial/checkpoints.html.",
 )
 @click.option("--save_checkpoint/--no_save_checkpoint", is_flag=True, default=True)
+@click.option(
+    "--previous_model",
+    "previous_model_path",
+    type=click.Path(exists=True, file_okay=False),
+    required=False,
+    help="Train incrementally, starting from the embeddings saved by a previous run to this folder. Entities and relations in the previous model start from their previous embeddings, and new entities from the mean of their neighbours' embeddings.",
+)
+@click.option(
+    "--delta",
+    "delta_path",
+    type=click.Path(exists=True),
+    required=False,
+    help="With --previous_model, TSV of triples (or folder of encoded triples) added or changed since the previous model. Training uses only the triples of new entities and of entities in the delta, plus a replay sample of the others.",
+)
+@click.option(
+    "--replay_ratio",
+    type=float,
+    default=1.0,
+    help="With --previous_model, number of unaffected triples to train on as well, as a multiple of the number of affected triples.",
+)
 def main(
     input_data_path,
     output_path,
@@ -57,6 +156,9 @@ def main(
     random_seed,
     from_checkpoint,
     save_checkpoint,
+    previous_model_path,
+    delta_path,
+    replay_ratio,
 ):
 
     # Load config and add data paths and device to the metadata that are stored with the model
@@ -74,7 +176,7 @@ def main(
     )
 
     # Run model and save to output directory
-    tf = triplesfactory_from_tsv(input_data_path, create_inverse_triples=False)
+    tf = load_triplesfactory(input_data_path, create_inverse_triples=False)
 
     if save_checkpoint:
         checkpoint_dir = "./data/checkpoints"
@@ -98,9 +200,16 @@ def main(
                 "checkpoint_directory": checkpoint_dir,
             }
 
+    training_tf = tf
+
+    if previous_model_path:
+        training_tf = warm_start(
+            tf, config, previous_model_path, delta_path, replay_ratio, random_seed
+        )
+
     pipeline_kwargs = dict(
-        training=tf,
-        testing=tf,
+        training=training_tf,
+        testing=training_tf,
         device="gpu" if gpu else "cpu",
         random_seed=random_seed,
     )
@@ -116,7 +225,7 @@ def main(
         np.save(f, ent_representations[0](indices=None).detach().cpu().numpy())
 
     with open(os.path.join(output_path, "relation_embeddings.npy"), "wb") as f:
-        np.save(f, rel_representations[0](indices=None).detach().cpu()().numpy())
+        np.save(f, rel_representations[0](indices=None).detach().cpu().numpy())
 
     more_than_one_representation_message = (
         lambda ent_or_relation: f"There is more than one {ent_or_relation} representation for the trained model (see https://pykeen.readthedocs.io/en/stable/tutorial/first_steps.html?highlight=embedding#using-learned-embeddings). You may want to inspect the others by loading the PyTorch model using the model pickle."
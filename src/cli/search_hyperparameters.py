@@ -0,0 +1,425 @@
+"""
+Random search over PyKEEN pipeline configs (the `config/*.json` format used by `run_pykeen.py`), running trials
+concurrently on CPU.
+
+Each trial runs in a worker process pinned to its own set of cores, with PyTorch limited to that many threads. Trials
+are evaluated on the validation triples every `--eval_frequency` epochs: a trial stops early when its validation MRR
+stops improving, or is pruned when its MRR is below the `--prune_quantile` of the MRRs that earlier trials had at the
+same epoch. Every trial's config, metrics and wall time are appended to `{output_folder}/results.jsonl`. Trials
+already in it (except failed ones) are skipped, so an interrupted search can be resumed by running the same command
+again.
+
+Run from the repository root, e.g.:
+python src/cli/search_hyperparameters.py -i ./data/interim/train_test_split/train.csv \
+    -v ./data/interim/train_test_split/val.csv -s ./config/hpo_search_space.json -o ./data/hpo/transe -w 8
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import copy
+import dataclasses
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from typing import Dict, Iterator, List, Tuple
+import click
+import numpy as np
+import torch
+from pykeen.pipeline import pipeline_from_config
+from pykeen.stoppers import EarlyStopper
+from pykeen.triples import TriplesFactory
+from log import get_logger
+from utils import get_timestamp, load_triples_from_tsv
+from encoded_triples import EncodedTriples, is_encoded_triples, load_triplesfactory
+
+logger = get_logger(__name__)
+
+RESULTS_FILE_NAME = "results.jsonl"
+BEST_CONFIG_FILE_NAME = "best_config.json"
+
+# Number of trials which must have reached an epoch before later trials can be pruned at it.
+MIN_TRIALS_TO_PRUNE = 3
+
+
+@dataclasses.dataclass
+class PruningEarlyStopper(EarlyStopper):
+    """PyKEEN's `EarlyStopper`, which also stops a trial whose metric at an evaluation is below the threshold given
+    for that epoch in `prune_thresholds`, and records the metric at each evaluation.
+    """
+
+    prune_thresholds: Dict[int, float] = dataclasses.field(default_factory=dict)
+    history: List[Tuple[int, float]] = dataclasses.field(default_factory=list)
+    pruned: bool = False
+
+    def should_stop(self, epoch: int) -> bool:
+        stop = super().should_stop(epoch)
+        self.history.append((epoch, self.results[-1]))
+
+        threshold = self.prune_thresholds.get(epoch)
+        if not stop and threshold is not None and self.results[-1] < threshold:
+            self.pruned = True
+            self.stopped = True
+            stop = True
+
+        return stop
+
+
+def _set_nested(config: dict, path: str, value):
+    """Set e.g. "pipeline.optimizer_kwargs.lr" in `config`, creating dicts on the way."""
+    *parents, key = path.split(".")
+    for parent in parents:
+        config = config.setdefault(parent, {})
+
+    config[key] = value
+
+
+def sample_params(space: Dict[str, dict], rnd: np.random.RandomState) -> dict:
+    """Sample a value for each parameter of a search space. Each parameter is given by either `{"values": [...]}` to
+    choose one of a list, or `{"low": ..., "high": ...}` for a uniform range, sampled on a log scale with
+    `"log": true` and rounded with `"int": true`.
+    """
+    params = {}
+    for path, spec in space.items():
+        if "values" in spec:
+            value = spec["values"][rnd.randint(len(spec["values"]))]
+        elif spec.get("log"):
+            value = float(
+                np.exp(rnd.uniform(np.log(spec["low"]), np.log(spec["high"])))
+            )
+        else:
+            value = float(rnd.uniform(spec["low"], spec["high"]))
+
+        if spec.get("int"):
+            value = int(round(value))
+
+        params[path] = value
+
+    return params
+
+
+def iter_trials(search_space: dict, base_config: dict) -> Iterator[Tuple[str, dict]]:
+    """Generate the trials of a search space as (trial ID, config). Trials are sampled from `random_state`, so the
+    same search space always gives the same trials in the same order, and a trial's ID is a hash of its config.
+    """
+    rnd = np.random.RandomState(search_space.get("random_state", 42))
+
+    for _ in range(search_space["num_trials"]):
+        config = copy.deepcopy(base_config)
+        for path, value in sample_params(search_space["space"], rnd).items():
+            _set_nested(config, path, value)
+
+        trial_id = hashlib.sha1(
+            json.dumps(config, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:12]
+
+        yield trial_id, config
+
+
+def load_results(path: str) -> List[dict]:
+    """Load the trials recorded in a results JSONL file, if it exists."""
+    if not os.path.exists(path):
+        return []
+
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def prune_thresholds(results: List[dict], quantile: float) -> Dict[int, float]:
+    """The `quantile` of the validation MRRs that finished trials had at each evaluation epoch, for epochs reached
+    by at least `MIN_TRIALS_TO_PRUNE` trials.
+    """
+    mrrs_by_epoch = {}
+    for result in results:
+        for epoch, mrr in result.get("validation_history", []):
+            mrrs_by_epoch.setdefault(epoch, []).append(mrr)
+
+    return {
+        epoch: float(np.quantile(mrrs, quantile))
+        for epoch, mrrs in mrrs_by_epoch.items()
+        if len(mrrs) >= MIN_TRIALS_TO_PRUNE
+    }
+
+
+def _core_sets(num_workers: int, threads_per_trial: int) -> List[List[int]]:
+    """Split the cores this process may run on into a set of `threads_per_trial` cores for each worker."""
+    cores = (
+        sorted(os.sched_getaffinity(0))
+        if hasattr(os, "sched_getaffinity")
+        else list(range(os.cpu_count()))
+    )
+
+    return [
+        [
+            cores[(i * threads_per_trial + j) % len(cores)]
+            for j in range(threads_per_trial)
+        ]
+        for i in range(num_workers)
+    ]
+
+
+# Set in each worker process by `_init_worker`.
+_worker_state = {}
+
+
+def _init_worker(
+    core_queue, threads_per_trial: int, training_path: str, validation_path: str
+):
+    """Pin the worker to a set of cores, limit PyTorch to that many threads, and load the triples once per worker."""
+    cores = core_queue.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    torch.set_num_threads(threads_per_trial)
+
+    training = load_triplesfactory(training_path, create_inverse_triples=False)
+    validation_triples = (
+        EncodedTriples.load(validation_path).to_dataframe()
+        if is_encoded_triples(validation_path)
+        else load_triples_from_tsv(validation_path)
+    )
+    # Validation triples with entities or relations that aren't in the training triples are dropped.
+    validation = TriplesFactory.from_labeled_triples(
+        validation_triples.astype(str).values,
+        entity_to_id=training.entity_to_id,
+        relation_to_id=training.relation_to_id,
+    )
+
+    _worker_state.update(
+        {"cores": cores, "training": training, "validation": validation}
+    )
+
+
+def run_trial(
+    trial_id: str,
+    config: dict,
+    stopper_kwargs: dict,
+    thresholds: Dict[int, float],
+    random_seed: int,
+) -> dict:
+    """Train and evaluate one trial in a worker process, returning its record for the results file."""
+    start = time.perf_counter()
+    record = {
+        "trial_id": trial_id,
+        "config": config,
+        "cores": _worker_state["cores"],
+        "started": get_timestamp(),
+    }
+
+    try:
+        results = pipeline_from_config(
+            copy.deepcopy(config),
+            training=_worker_state["training"],
+            validation=_worker_state["validation"],
+            testing=_worker_state["validation"],
+            device="cpu",
+            random_seed=random_seed,
+            stopper=PruningEarlyStopper,
+            stopper_kwargs={**stopper_kwargs, "prune_thresholds": thresholds},
+        )
+        stopper = results.stopper
+        record.update(
+            {
+                "status": "pruned" if stopper.pruned else "completed",
+                "validation_mrr": float(
+                    results.metric_results.get_metric("mean_reciprocal_rank")
+                ),
+                "validation_hits_at_10": float(
+                    results.metric_results.get_metric("hits_at_10")
+                ),
+                "best_epoch": stopper.best_epoch,
+                "num_epochs": len(results.losses),
+                "validation_history": stopper.history,
+                "final_loss": results.losses[-1] if results.losses else None,
+            }
+        )
+    except Exception:
+        record.update({"status": "failed", "error": traceback.format_exc()})
+
+    record["wall_time_s"] = time.perf_counter() - start
+
+    return record
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input",
+    "training_path",
+    type=click.Path(exists=True),
+    required=True,
+    help="Training triples: a TSV, or folder of encoded triples.",
+)
+@click.option(
+    "-v",
+    "--validation",
+    "validation_path",
+    type=click.Path(exists=True),
+    required=True,
+    help="Validation triples to evaluate trials on: a TSV, or folder of encoded triples.",
+)
+@click.option(
+    "-s",
+    "--search_space",
+    "search_space_path",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="JSON with a `base_config` path (a config as used by run_pykeen.py), `num_trials`, `random_state` and `space`, the parameters to search as paths into the config, e.g. `pipeline.optimizer_kwargs.lr`.",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_path",
+    type=click.Path(file_okay=False),
+    required=True,
+    help="Folder for results.jsonl and best_config.json. Created if it does not already exist.",
+)
+@click.option(
+    "-w", "--num_workers", type=int, default=4, help="Number of trials to run at once."
+)
+@click.option(
+    "-t",
+    "--threads_per_trial",
+    type=int,
+    required=False,
+    help="Number of cores (and PyTorch threads) for each trial. Defaults to the number of cores divided by --num_workers.",
+)
+@click.option(
+    "--eval_frequency",
+    type=int,
+    default=10,
+    help="Evaluate on the validation triples every this many epochs.",
+)
+@click.option(
+    "--patience",
+    type=int,
+    default=2,
+    help="Stop a trial after this many evaluations without improving its validation MRR.",
+)
+@click.option(
+    "--relative_delta",
+    type=float,
+    default=0.01,
+    help="Relative improvement in validation MRR that counts as improving.",
+)
+@click.option(
+    "--prune_quantile",
+    type=float,
+    default=0.5,
+    help="Stop a trial whose validation MRR at an evaluation is below this quantile of earlier trials' MRRs at the same epoch. Pass 0 to disable pruning.",
+)
+@click.option("-r", "--random_seed", type=int, default=100)
+def main(
+    training_path,
+    validation_path,
+    search_space_path,
+    output_path,
+    num_workers,
+    threads_per_trial,
+    eval_frequency,
+    patience,
+    relative_delta,
+    prune_quantile,
+    random_seed,
+):
+    with open(search_space_path, "r") as f:
+        search_space = json.load(f)
+
+    with open(search_space["base_config"], "r") as f:
+        base_config = json.load(f)
+
+    base_config["metadata"].update(
+        {
+            "input_data_path": training_path,
+            "validation_data_path": validation_path,
+            "search_space_path": search_space_path,
+            "device": "cpu",
+            "random_seed": random_seed,
+        }
+    )
+
+    os.makedirs(output_path, exist_ok=True)
+    results_path = os.path.join(output_path, RESULTS_FILE_NAME)
+    results = load_results(results_path)
+    # Failed trials are run again.
+    done = {result["trial_id"] for result in results if result["status"] != "failed"}
+    trials = [
+        (trial_id, config)
+        for trial_id, config in iter_trials(search_space, base_config)
+        if trial_id not in done
+    ]
+    logger.info(
+        f"Running {len(trials)} trials ({len(done)} already in {results_path}) with {num_workers} workers"
+    )
+
+    threads_per_trial = threads_per_trial or max(1, os.cpu_count() // num_workers)
+    stopper_kwargs = {
+        "frequency": eval_frequency,
+        "patience": patience,
+        "relative_delta": relative_delta,
+        "metric": "mean_reciprocal_rank",
+    }
+
+    # Spawned rather than forked workers, so that each starts PyTorch with its own thread pool.
+    context = multiprocessing.get_context("spawn")
+    core_queue = context.Queue()
+    for cores in _core_sets(num_workers, threads_per_trial):
+        core_queue.put(cores)
+
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(core_queue, threads_per_trial, training_path, validation_path),
+    ) as executor, open(results_path, "a") as results_file:
+        pending = set()
+        trials = iter(trials)
+
+        def _submit_next() -> bool:
+            trial = next(trials, None)
+            if trial is None:
+                return False
+
+            # Pruning thresholds come from the trials finished so far, so trials are submitted as workers free up.
+            thresholds = (
+                prune_thresholds(results, prune_quantile) if prune_quantile > 0 else {}
+            )
+            pending.add(
+                executor.submit(
+                    run_trial, *trial, stopper_kwargs, thresholds, random_seed
+                )
+            )
+            return True
+
+        for _ in range(num_workers):
+            _submit_next()
+
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                record = future.result()
+                results.append(record)
+                results_file.write(json.dumps(record) + "\n")
+                results_file.flush()
+
+                message = f"Trial {record['trial_id']} {record['status']} in {record['wall_time_s']:.0f}s"
+                if "validation_mrr" in record:
+                    message += f" with validation MRR {record['validation_mrr']:.4f}"
+                logger.info(message)
+                _submit_next()
+
+    completed = [result for result in results if result["status"] == "completed"]
+    if completed:
+        best = max(completed, key=lambda result: result["validation_mrr"])
+        with open(os.path.join(output_path, BEST_CONFIG_FILE_NAME), "w") as f:
+            json.dump(best["config"], f, indent=4)
+
+        logger.info(
+            f"Best trial {best['trial_id']} has validation MRR {best['validation_mrr']:.4f}. Config saved to {output_path}"
+        )
+
+
+if __name__ == "__main__":
+    main()
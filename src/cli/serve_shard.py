@@ -0,0 +1,40 @@
+"""
+Serve searches of one shard built by `python -m src.cli.build_shards` to the API (see `src.sharding`). Start one for
+each shard, then set `SHARD_ADDRESSES` for the API to the address of each.
+
+Run from the repository root, e.g.:
+SHARD_AUTHKEY=... python -m src.cli.serve_shard -s ./data/processed/shards/heritageconnector_RotatE/shard_0 -p 9000
+"""
+
+import click
+from src.sharding import ShardServer
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--shard_path",
+    type=click.Path(exists=True, file_okay=False),
+    required=True,
+    help="Folder of the shard.",
+)
+@click.option("--host", type=str, default="0.0.0.0")
+@click.option("-p", "--port", type=int, required=True)
+@click.option(
+    "--authkey",
+    type=str,
+    envvar="SHARD_AUTHKEY",
+    required=True,
+    help="Key the API connects with. Defaults to $SHARD_AUTHKEY.",
+)
+@click.option(
+    "--mmap",
+    is_flag=True,
+    help="Memory-map the index, where Faiss supports it for the index type.",
+)
+def main(shard_path, host, port, authkey, mmap):
+    ShardServer(shard_path, mmap=mmap).serve((host, port), authkey.encode())
+
+
+if __name__ == "__main__":
+    main()
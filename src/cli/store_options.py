@@ -0,0 +1,60 @@
+"""
+Click options shared by CLIs which load a `KGEmbeddingStore` from DGL-KE outputs. Each option defaults to the
+environment variable the API uses for the same file.
+"""
+
+import os
+import click
+from src.embedding_store import KGEmbeddingStore
+
+_STORE_OPTIONS = [
+    ("--entity_embedding_path", "ENTITY_EMBEDDING_PATH"),
+    ("--relation_embedding_path", "RELATION_EMBEDDING_PATH"),
+    ("--entity_mapping_path", "ENTITY_MAPPING_PATH"),
+    ("--relation_mapping_path", "RELATION_MAPPING_PATH"),
+]
+
+
+def embedding_store_options(func):
+    """Add the options needed by `load_embedding_store` to a click command."""
+    for option, envvar in reversed(_STORE_OPTIONS):
+        func = click.option(
+            option,
+            # Embeddings can be folders of compressed embeddings. See `src.compressed_embeddings`.
+            type=click.Path(exists=True),
+            envvar=envvar,
+            required=True,
+            help=f"Defaults to ${envvar}.",
+        )(func)
+
+    return func
+
+
+def load_embedding_store(
+    entity_embedding_path: str,
+    relation_embedding_path: str,
+    entity_mapping_path: str,
+    relation_mapping_path: str,
+    mmap: bool = True,
+) -> KGEmbeddingStore:
+    """Load a `KGEmbeddingStore` from the paths given by `embedding_store_options`."""
+    assert os.path.dirname(entity_embedding_path) == os.path.dirname(
+        relation_embedding_path
+    )
+    assert os.path.dirname(entity_mapping_path) == os.path.dirname(
+        relation_mapping_path
+    )
+
+    return KGEmbeddingStore.from_dglke(
+        embeddings_folder=os.path.dirname(entity_embedding_path),
+        embeddings_file_names=[
+            os.path.basename(entity_embedding_path),
+            os.path.basename(relation_embedding_path),
+        ],
+        mappings_folder=os.path.dirname(entity_mapping_path),
+        mappings_file_names=[
+            os.path.basename(entity_mapping_path),
+            os.path.basename(relation_mapping_path),
+        ],
+        mmap=mmap,
+    )
@@ -2,7 +2,8 @@ import os
 import click
 import pandas as pd
 from log import get_logger, DisableLogger
-from utils import triplesfactory_from_tsv
+from encoded_triples import load_triplesfactory
+from triples_split import hash_split, parse_split_sizes
 
 logger = get_logger(__name__)
 
@@ -18,11 +19,44 @@ logger = get_logger(__name__)
     help="Comma-separated list of train/test/val or train/test sizes. If just a float is passed, this is used as the train size, with the rest of the triples making up the test set.",
 )
 @click.option("-r", "--random_state", type=int, default=100)
-def run_train_test_split(input_path, output_path, sizes, random_state):
-    tf = triplesfactory_from_tsv(input_path)
-
+@click.option(
+    "-m",
+    "--method",
+    type=click.Choice(["hash", "pykeen"]),
+    default="hash",
+    help="`hash` streams the triples and assigns them to splits by a seeded hash (see `triples_split.hash_split`). `pykeen` loads every triple into a `TriplesFactory` and uses its `split`.",
+)
+@click.option(
+    "-c",
+    "--chunksize",
+    type=int,
+    default=1_000_000,
+    help="Number of triples to read at a time with `--method hash`.",
+)
+def run_train_test_split(
+    input_path, output_path, sizes, random_state, method, chunksize
+):
     sizes = [float(i) for i in sizes.split(",")]
 
+    if method == "hash":
+        counts = hash_split(
+            input_path,
+            output_path,
+            parse_split_sizes(sizes),
+            random_state=random_state,
+            chunksize=chunksize,
+        )
+        success_msg = f"Created split of {counts['train']:,} train triples; {counts['test']:,} test triples"
+        if "val" in counts:
+            success_msg += f"; {counts['val']:,} validation triples"
+
+        logger.info(
+            f"{success_msg}. {counts['moved_to_train']:,} triples were moved to train so that it contains every entity and relation."
+        )
+        return
+
+    tf = load_triplesfactory(input_path)
+
     if len(sizes) <= 2:
         train, test = tf.split(sizes, random_state=random_state)
         val = None
@@ -0,0 +1,182 @@
+import os
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+import pandas as pd
+from utils import iter_triples_from_tsv
+from encoded_triples import EncodedTriples, _encode, is_encoded_triples
+
+SPLIT_NAMES = ["train", "test", "val"]
+
+# `pd.util.hash_pandas_object` takes a 16 character key.
+_HASH_KEY_LENGTH = 16
+
+
+def parse_split_sizes(sizes: List[float]) -> List[float]:
+    """Check the proportions of a train/test(/val) split. A single proportion is the train size, with the rest of the
+    triples making up the test set.
+    """
+    if len(sizes) == 1:
+        sizes = [sizes[0], 1 - sizes[0]]
+
+    if len(sizes) not in (2, 3) or not np.isclose(sum(sizes), 1):
+        raise ValueError(
+            f"Split sizes must be train/test or train/test/val proportions which add up to 1, not {sizes}"
+        )
+
+    return sizes
+
+
+def hash_triples(triples: pd.DataFrame, random_state: int) -> np.ndarray:
+    """Map each triple to a number in [0, 1) by a seeded hash of its labels, so that a triple is always put in the same
+    split for the same `random_state`, whatever the order or format of the input.
+    """
+    hashes = pd.util.hash_pandas_object(
+        triples[["subject", "predicate", "object"]],
+        index=False,
+        hash_key=str(random_state).zfill(_HASH_KEY_LENGTH)[-_HASH_KEY_LENGTH:],
+    ).values
+
+    # The top 53 bits, which a float64 holds exactly.
+    return (hashes >> np.uint64(11)).astype(np.float64) / 2**53
+
+
+def _iter_encoded_chunks(
+    input_path: str,
+    chunksize: int,
+    entity_to_id: Dict[str, int],
+    relation_to_id: Dict[str, int],
+) -> Iterator[Tuple[pd.DataFrame, np.ndarray]]:
+    """Chunks of triples as labels and as integer IDs. For a TSV, IDs are assigned by adding labels to `entity_to_id`
+    and `relation_to_id`, so reading the same file again gives the same IDs.
+    """
+    if is_encoded_triples(input_path):
+        triples = EncodedTriples.load(input_path)
+        for start in range(0, len(triples), chunksize):
+            rows = slice(start, start + chunksize)
+            yield triples.to_dataframe(rows), np.asarray(triples.triples[rows])
+
+        return
+
+    for chunk in iter_triples_from_tsv(input_path, chunksize=chunksize):
+        yield chunk, np.column_stack(
+            [
+                _encode(chunk["subject"], entity_to_id),
+                _encode(chunk["predicate"], relation_to_id),
+                _encode(chunk["object"], entity_to_id),
+            ]
+        )
+
+
+def _grow(mask: np.ndarray, size: int) -> np.ndarray:
+    """Extend a boolean array with False up to `size`, doubling its capacity so growing is amortised."""
+    if size <= len(mask):
+        return mask
+
+    grown = np.zeros(max(size, 2 * len(mask)), dtype=bool)
+    grown[: len(mask)] = mask
+
+    return grown
+
+
+def hash_split(
+    input_path: str,
+    output_path: str,
+    sizes: List[float],
+    random_state: int = 100,
+    chunksize: int = 1_000_000,
+) -> Dict[str, int]:
+    """
+    Split triples into train/test(/val) TSVs, reading `chunksize` triples at a time, so that memory use depends on the
+    number of entities and relations rather than the number of triples.
+
+    Each triple is assigned to a split by a seeded hash (see `hash_triples`). The split is then repaired so that every
+    entity and relation in the test and validation sets is also in the training set, as PyKEEN's
+    `TriplesFactory.split` does: the first pass over the triples records which entities and relations the hash puts
+    in the training set, and the second pass writes all the files, moving a test or validation triple to the training
+    set if it has an entity or relation that isn't in it yet.
+
+    Args:
+        input_path (str): TSV of triples, or folder of encoded triples (see `encode_triples.py`)
+        output_path (str): folder to write train.csv, test.csv and (for three sizes) val.csv to
+        sizes (List[float]): train/test(/val) proportions. See `parse_split_sizes`.
+        random_state (int, optional): seed for the hash. Defaults to 100.
+        chunksize (int, optional): number of triples to read at a time. Defaults to 1_000_000.
+
+    Returns:
+        Dict[str, int]: number of triples in each split, and the number of triples moved to the training set
+    """
+    sizes = parse_split_sizes(sizes)
+    split_names = SPLIT_NAMES[: len(sizes)]
+    thresholds = np.cumsum(sizes)[:-1]
+    entity_to_id = {}
+    relation_to_id = {}
+
+    def _assign(triples: pd.DataFrame) -> np.ndarray:
+        return np.searchsorted(
+            thresholds, hash_triples(triples, random_state), side="right"
+        )
+
+    # First pass: which entities and relations the hash puts in the training set.
+    entity_in_train = np.zeros(0, dtype=bool)
+    relation_in_train = np.zeros(0, dtype=bool)
+
+    for chunk, ids in _iter_encoded_chunks(
+        input_path, chunksize, entity_to_id, relation_to_id
+    ):
+        train_ids = ids[_assign(chunk) == 0]
+        entity_in_train = _grow(
+            entity_in_train, int(ids[:, [0, 2]].max(initial=-1)) + 1
+        )
+        relation_in_train = _grow(relation_in_train, int(ids[:, 1].max(initial=-1)) + 1)
+        entity_in_train[train_ids[:, 0]] = True
+        entity_in_train[train_ids[:, 2]] = True
+        relation_in_train[train_ids[:, 1]] = True
+
+    # Second pass: repair and write.
+    os.makedirs(output_path, exist_ok=True)
+    counts = {name: 0 for name in split_names}
+    counts["moved_to_train"] = 0
+    files = {
+        name: open(os.path.join(output_path, f"{name}.csv"), "w")
+        for name in split_names
+    }
+
+    try:
+        for chunk, ids in _iter_encoded_chunks(
+            input_path, chunksize, entity_to_id, relation_to_id
+        ):
+            assignment = _assign(chunk)
+
+            covered = np.logical_and.reduce(
+                [
+                    entity_in_train[ids[:, 0]],
+                    relation_in_train[ids[:, 1]],
+                    entity_in_train[ids[:, 2]],
+                ]
+            )
+
+            # Triples are moved one at a time, as moving one can cover the entities of the next.
+            for row in np.flatnonzero((assignment > 0) & ~covered):
+                subject, predicate, obj = ids[row]
+                if not all(
+                    [
+                        entity_in_train[subject],
+                        relation_in_train[predicate],
+                        entity_in_train[obj],
+                    ]
+                ):
+                    assignment[row] = 0
+                    entity_in_train[subject] = True
+                    entity_in_train[obj] = True
+                    relation_in_train[predicate] = True
+                    counts["moved_to_train"] += 1
+
+            for split, name in enumerate(split_names):
+                split_triples = chunk[assignment == split]
+                split_triples.to_csv(files[name], sep="\t", index=False, header=False)
+                counts[name] += len(split_triples)
+    finally:
+        for f in files.values():
+            f.close()
+
+    return counts
@@ -0,0 +1,209 @@
+"""
+Update the 2D projection of the entity embeddings and the d3fc visualisation data for a new model, placing only new
+and changed entities rather than refitting UMAP on every entity (see `src.projection`).
+
+Run from the repository root, e.g. to start from the projection used by `create_d3fc_data.ipynb`:
+python -m src.cli.update_projection -l ./data/processed/final_model_dglke/umap/layout \
+    --projection_path ./data/processed/final_model_dglke/umap/best_projection_n_neighbours_10.npy \
+    --projection_mapping_path ./data/processed/final_model_dglke/entities.tsv \
+    -g ./data/processed/embedding_colour_mappings -v ./data/processed/final_model_dglke/umap/visualisation_data_n_neighbours_10.tsv
+
+and then, for each new model, the same command without the projection options. If the layout folder doesn't exist
+and no projection is given, UMAP is fitted on every entity.
+"""
+
+import glob
+import os
+import shutil
+import tempfile
+import click
+from src.cli.log import get_logger
+from src.cli.store_options import embedding_store_options, load_embedding_store
+from src.entity_filters import GROUP_MAPPING_FILE_PATTERN
+from src.projection import (
+    LAYOUT_FILE_NAMES,
+    Layout,
+    map_to_database,
+    update_group_mapping,
+    update_layout,
+    update_visualisation_data,
+)
+
+logger = get_logger(__name__)
+
+
+def _replace(path: str, write_fn):
+    """Write a new version of `path` with `write_fn(temp_path)`, then move it into place."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+
+    try:
+        write_fn(temp_path)
+        shutil.move(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+@click.command()
+@click.option(
+    "-l",
+    "--layout_path",
+    type=click.Path(file_okay=False),
+    required=True,
+    help="Folder the layout is kept in. Created if it doesn't already exist.",
+)
+@click.option(
+    "--projection_path",
+    type=click.Path(exists=True, dir_okay=False),
+    required=False,
+    help="Create the layout from this projection (.npy) rather than fitting UMAP, if it doesn't already exist.",
+)
+@click.option(
+    "--projection_mapping_path",
+    type=click.Path(exists=True, dir_okay=False),
+    required=False,
+    help="Entity mapping for the rows of --projection_path. Defaults to the entity mapping of the model.",
+)
+@click.option(
+    "-c",
+    "--changed_path",
+    type=click.Path(exists=True, dir_okay=False),
+    required=False,
+    help="File of entities, one per line, to place again even though they are in the layout.",
+)
+@click.option(
+    "-g",
+    "--group_mappings_path",
+    type=click.Path(exists=True, file_okay=False),
+    required=False,
+    help="Folder of colour mappings (mapping_*.tsv) to update for the model in place.",
+)
+@click.option(
+    "-v",
+    "--visualisation_data_path",
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="Visualisation TSV to update in place, or create if it doesn't exist.",
+)
+@click.option(
+    "-k",
+    "--n_neighbours",
+    type=int,
+    default=10,
+    help="Neighbours to place each entity from.",
+)
+@click.option("-b", "--batch_size", type=int, default=10_000)
+@click.option(
+    "-t",
+    "--num_threads",
+    type=int,
+    required=False,
+    help="Number of threads to place entities with. Defaults to one per core.",
+)
+@click.option(
+    "--umap_n_neighbours",
+    type=int,
+    default=10,
+    help="n_neighbours for UMAP, if fitting the layout.",
+)
+@click.option("--random_state", type=int, default=42)
+@embedding_store_options
+def main(
+    layout_path,
+    projection_path,
+    projection_mapping_path,
+    changed_path,
+    group_mappings_path,
+    visualisation_data_path,
+    n_neighbours,
+    batch_size,
+    num_threads,
+    umap_n_neighbours,
+    random_state,
+    entity_embedding_path,
+    relation_embedding_path,
+    entity_mapping_path,
+    relation_mapping_path,
+):
+    embedding_store = load_embedding_store(
+        entity_embedding_path,
+        relation_embedding_path,
+        entity_mapping_path,
+        relation_mapping_path,
+    )
+
+    if os.path.exists(os.path.join(layout_path, LAYOUT_FILE_NAMES["info"])):
+        layout = Layout.load(layout_path)
+        logger.info(f"Loaded layout of {len(layout):,} entities from {layout_path}")
+    elif projection_path:
+        layout = Layout.from_projection(
+            projection_path, projection_mapping_path or entity_mapping_path
+        )
+        logger.info(
+            f"Created layout of {len(layout):,} entities from {projection_path}"
+        )
+    else:
+        logger.info(
+            f"Fitting UMAP on {embedding_store.ent_embedding_matrix.shape[0]:,} entities"
+        )
+        layout = Layout.fit_umap(
+            embedding_store, random_state=random_state, n_neighbors=umap_n_neighbours
+        )
+
+    changed_entities = []
+    if changed_path:
+        with open(changed_path, "r") as f:
+            changed_entities = [line.strip() for line in f if line.strip()]
+
+    layout, update_rows = update_layout(
+        layout,
+        embedding_store,
+        changed_entities,
+        n_neighbours=n_neighbours,
+        batch_size=batch_size,
+        num_threads=num_threads,
+    )
+    layout.save(layout_path)
+    logger.info(
+        f"Placed {layout.info['num_placed']:,} new or changed entities, kept {layout.info['num_kept']:,} and dropped "
+        f"{layout.info['num_dropped']:,}. Layout saved to {layout_path}"
+    )
+
+    group_mapping_paths = {}
+    if group_mappings_path:
+        for path in sorted(
+            glob.glob(os.path.join(group_mappings_path, GROUP_MAPPING_FILE_PATTERN))
+        ):
+            name = os.path.splitext(os.path.basename(path))[0].replace(
+                "mapping_", "", 1
+            )
+            # Only the database of an entity can be worked out from the entity itself.
+            new_group_fn = map_to_database if name == "database" else None
+            _replace(
+                path,
+                lambda temp_path: update_group_mapping(
+                    path, temp_path, embedding_store, new_group_fn
+                ),
+            )
+            group_mapping_paths[name] = path
+
+        logger.info(f"Updated group mappings {list(group_mapping_paths)}")
+
+    if visualisation_data_path:
+        _replace(
+            visualisation_data_path,
+            lambda temp_path: update_visualisation_data(
+                temp_path,
+                layout,
+                embedding_store,
+                update_rows,
+                group_mapping_paths,
+                input_path=visualisation_data_path,
+            ),
+        )
+        logger.info(f"Visualisation data saved to {visualisation_data_path}")
+
+
+if __name__ == "__main__":
+    main()
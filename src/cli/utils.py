@@ -1,4 +1,5 @@
 import time
+from typing import Iterator
 import pandas as pd
 from pykeen.triples import TriplesFactory
 
@@ -7,28 +8,46 @@ def get_timestamp():
     return time.strftime("%Y%m%d-%H%M")
 
 
-def load_triples_from_tsv(input_path: str) -> pd.DataFrame:
-    """
-    Due to newline characters in triples, they can't be imported correctly by a simple `pd.read_csv` or `TriplesFactory.from_file()`.
-    This function imports triples safely using pandas.
-    """
-
-    triples = pd.read_csv(
+def _read_triples_csv(input_path: str, **read_csv_kwargs):
+    return pd.read_csv(
         input_path,
         names=["subject", "predicate", "object"],
         sep="\t",
         lineterminator="\n",
         dtype=str,
         na_filter=False,
+        **read_csv_kwargs,
     )
 
-    triples["object"] = triples["object"].apply(
-        lambda x: x[0:-1] if x.endswith("\r") else x
-    )
+
+def _clean_triples(triples: pd.DataFrame) -> pd.DataFrame:
+    triples["object"] = triples["object"].str.replace(r"\r$", "", regex=True)
 
     return triples
 
 
+def load_triples_from_tsv(input_path: str) -> pd.DataFrame:
+    """
+    Due to newline characters in triples, they can't be imported correctly by a simple `pd.read_csv` or `TriplesFactory.from_file()`.
+    This function imports triples safely using pandas.
+    """
+
+    return _clean_triples(_read_triples_csv(input_path))
+
+
+def iter_triples_from_tsv(
+    input_path: str, chunksize: int = 1_000_000
+) -> Iterator[pd.DataFrame]:
+    """
+    Read triples in the same way as `load_triples_from_tsv`, but as DataFrames of at most `chunksize` triples at a time,
+    so that memory use doesn't depend on the size of the file.
+    """
+
+    with _read_triples_csv(input_path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield _clean_triples(chunk)
+
+
 def triplesfactory_from_tsv(input_path, **triplesfactory_kwargs) -> TriplesFactory:
     """
     Create a `pykeen.triples.TriplesFactory` from a TSV. More reliable than `TriplesFactory.from_file` for our data.
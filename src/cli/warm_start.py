@@ -0,0 +1,222 @@
+import json
+import os
+from typing import Dict, Tuple
+import numpy as np
+import pandas as pd
+import torch
+from scipy.sparse import csr_matrix
+from utils import load_triples_from_tsv
+from encoded_triples import EncodedTriples, is_encoded_triples
+
+# Files saved by `run_pykeen.py`, which an incremental run starts from.
+PREVIOUS_MODEL_FILE_NAMES = {
+    "entity_embeddings": "entity_embeddings.npy",
+    "relation_embeddings": "relation_embeddings.npy",
+    "entity_to_id": "entities_to_ids.json",
+    "relation_to_id": "relations_to_ids.json",
+}
+
+
+def load_previous_model(
+    folder: str,
+) -> Tuple[np.ndarray, Dict[str, int], np.ndarray, Dict[str, int]]:
+    """Load the embeddings and ID mappings saved by `run_pykeen.py` to `folder`.
+
+    Returns:
+        Tuple[np.ndarray, Dict[str, int], np.ndarray, Dict[str, int]]: entity embeddings, entity to ID, relation
+            embeddings, relation to ID
+    """
+    paths = {
+        name: os.path.join(folder, file_name)
+        for name, file_name in PREVIOUS_MODEL_FILE_NAMES.items()
+    }
+
+    with open(paths["entity_to_id"], "r") as f:
+        entity_to_id = json.load(f)
+
+    with open(paths["relation_to_id"], "r") as f:
+        relation_to_id = json.load(f)
+
+    return (
+        np.load(paths["entity_embeddings"]),
+        entity_to_id,
+        np.load(paths["relation_embeddings"]),
+        relation_to_id,
+    )
+
+
+def load_delta_entities(delta_path: str) -> np.ndarray:
+    """Entities (subjects and objects) of a TSV or folder of encoded triples of added or changed triples."""
+    if is_encoded_triples(delta_path):
+        delta = EncodedTriples.load(delta_path).compact()
+        return delta.entities
+
+    delta = load_triples_from_tsv(delta_path)
+
+    return pd.unique(np.concatenate([delta["subject"].values, delta["object"].values]))
+
+
+def align_embeddings(
+    embeddings: np.ndarray,
+    previous_to_id: Dict[str, int],
+    new_to_id: Dict[str, int],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Reorder the rows of `embeddings` from the IDs of a previous model to the IDs of a new one.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: embeddings with a row for each new ID (zeros for labels not in the previous
+            model), and a boolean mask of the rows that were in the previous model
+    """
+    aligned = np.zeros((len(new_to_id), *embeddings.shape[1:]), dtype=embeddings.dtype)
+    known = np.zeros(len(new_to_id), dtype=bool)
+
+    labels = [label for label in new_to_id if label in previous_to_id]
+    new_ids = np.fromiter((new_to_id[label] for label in labels), dtype=np.int64)
+    previous_ids = np.fromiter(
+        (previous_to_id[label] for label in labels), dtype=np.int64
+    )
+
+    aligned[new_ids] = embeddings[previous_ids]
+    known[new_ids] = True
+
+    return aligned, known
+
+
+def _random_like(
+    embeddings: np.ndarray, known: np.ndarray, num_rows: int, rnd: np.random.RandomState
+) -> np.ndarray:
+    """Random rows with the per-dimension mean and standard deviation of the known rows."""
+    reference = (
+        embeddings[known] if known.any() else np.zeros((1, *embeddings.shape[1:]))
+    )
+    mean, std = reference.mean(axis=0), reference.std(axis=0)
+    values = mean + std * rnd.standard_normal((num_rows, *embeddings.shape[1:]))
+
+    if np.iscomplexobj(embeddings):
+        values = values + 1j * std * rnd.standard_normal(values.shape)
+
+    return values.astype(embeddings.dtype)
+
+
+def init_from_neighbours(
+    embeddings: np.ndarray,
+    known: np.ndarray,
+    mapped_triples: np.ndarray,
+    max_hops: int = 3,
+    random_state: int = 100,
+) -> np.ndarray:
+    """Initialise the entities not in `known` as the mean embedding of their known neighbours in `mapped_triples`
+    (in either direction). Entities whose neighbours are all new are initialised in later hops from the entities
+    initialised before them, up to `max_hops` away; any left after that are initialised randomly.
+
+    Args:
+        embeddings (np.ndarray): entity embeddings, with rows not in `known` to be initialised
+        known (np.ndarray): boolean mask of the rows of `embeddings` which came from the previous model
+        mapped_triples (np.ndarray): triples of IDs (subject, predicate, object) of the new graph
+        max_hops (int, optional): Defaults to 3.
+        random_state (int, optional): Defaults to 100.
+
+    Returns:
+        np.ndarray: `embeddings` with every row initialised
+    """
+    embeddings = embeddings.copy()
+    known = known.copy()
+    num_entities = len(embeddings)
+
+    # Undirected adjacency matrix, with the number of triples between each pair of entities.
+    subjects, objects = mapped_triples[:, 0], mapped_triples[:, 2]
+    adjacency = csr_matrix(
+        (
+            np.ones(2 * len(mapped_triples), dtype=np.float32),
+            (np.concatenate([subjects, objects]), np.concatenate([objects, subjects])),
+        ),
+        shape=(num_entities, num_entities),
+    )
+    flat = embeddings.reshape(num_entities, -1)
+
+    for _ in range(max_hops):
+        unknown = np.flatnonzero(~known)
+        if not len(unknown):
+            break
+
+        neighbours = adjacency[unknown][:, np.flatnonzero(known)]
+        num_neighbours = np.asarray(neighbours.sum(axis=1)).ravel()
+        initialised = num_neighbours > 0
+        if not initialised.any():
+            break
+
+        sums = neighbours[initialised] @ flat[known]
+        flat[unknown[initialised]] = sums / num_neighbours[initialised, None]
+        known[unknown[initialised]] = True
+
+    if not known.all():
+        rnd = np.random.RandomState(random_state)
+        embeddings[~known] = _random_like(embeddings, known, (~known).sum(), rnd)
+
+    return embeddings
+
+
+def init_new_relations(
+    embeddings: np.ndarray, known: np.ndarray, random_state: int = 100
+) -> np.ndarray:
+    """Initialise relations not in `known` randomly, with the distribution of the known relations' embeddings."""
+    embeddings = embeddings.copy()
+    rnd = np.random.RandomState(random_state)
+    embeddings[~known] = _random_like(embeddings, known, (~known).sum(), rnd)
+
+    return embeddings
+
+
+def affected_triples_mask(
+    mapped_triples: np.ndarray, affected_entities: np.ndarray
+) -> np.ndarray:
+    """Boolean mask of the triples with an affected entity (boolean mask over entity IDs) as subject or object."""
+    return np.logical_or(
+        affected_entities[mapped_triples[:, 0]], affected_entities[mapped_triples[:, 2]]
+    )
+
+
+def sample_replay(
+    affected: np.ndarray, replay_ratio: float, random_state: int = 100
+) -> np.ndarray:
+    """Sample `replay_ratio` times as many unaffected triples as there are affected triples, so that training on the
+    affected triples doesn't move the rest of the graph away from its previous embeddings.
+
+    Returns:
+        np.ndarray: boolean mask of the affected triples and the sampled triples
+    """
+    rnd = np.random.RandomState(random_state)
+    unaffected = np.flatnonzero(~affected)
+    num_replay = min(int(replay_ratio * affected.sum()), len(unaffected))
+
+    mask = affected.copy()
+    mask[rnd.choice(unaffected, num_replay, replace=False)] = True
+
+    return mask
+
+
+class PretrainedCopyInitializer:
+    def __init__(self, tensor: torch.Tensor):
+        """A PyKEEN initializer which sets a representation to a copy of `tensor` each time it's called. Returning a
+        copy matters: the weight must not share memory with `tensor`, otherwise PyTorch's own in-place
+        initialisation, which PyKEEN runs before every reset, overwrites the pretrained values.
+        """
+        self.tensor = tensor
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        return (
+            self.tensor.to(device=x.device, dtype=x.dtype, copy=True)
+            .view_as(x)
+            .contiguous()
+        )
+
+
+def to_initializer(embeddings: np.ndarray) -> PretrainedCopyInitializer:
+    """A PyKEEN initializer which sets a representation to `embeddings`. Complex embeddings are passed as their real
+    view, which is how PyKEEN stores them.
+    """
+    tensor = torch.from_numpy(np.array(embeddings))
+    if tensor.is_complex():
+        tensor = torch.view_as_real(tensor)
+
+    return PretrainedCopyInitializer(tensor)
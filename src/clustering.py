@@ -0,0 +1,247 @@
+"""
+Submodule for clustering entity embeddings on CPU, at the scale of the whole graph.
+
+Clustering has three steps:
+1. `train_kmeans`: train Faiss k-means on a random sample of entities, giving coarse clusters.
+2. `assign_to_centroids`: assign every entity to its nearest centroid, streaming the embeddings matrix in blocks
+    spread across threads, so memory-mapped and compressed matrices aren't loaded whole.
+3. Optionally, a density step on the coarse clusters: `merge_clusters` joins coarse clusters whose centroids are
+    density-connected (within `eps` of each other, as in DBSCAN), and `mark_outliers` labels the entities furthest
+    from their centroid as noise (-1).
+
+Labels are saved as an int32 array with one element per row of the embeddings matrix (see `save_clusters` and
+`ClusterLabels`), replacing the text files of cluster indexes written by the clustering notebooks.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import datetime
+import json
+import os
+from typing import Tuple
+import faiss
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from src.embedding_store import KGEmbeddingStore
+
+LABELS_FILE_NAME = "labels.npy"
+CENTROIDS_FILE_NAME = "centroids.npy"
+INFO_FILE_NAME = "clusters.json"
+
+NOISE_LABEL = -1
+
+
+def train_kmeans(
+    matrix: np.ndarray,
+    n_clusters: int,
+    sample_size: int = 1_000_000,
+    niter: int = 20,
+    random_state: int = 42,
+    verbose: bool = False,
+) -> np.ndarray:
+    """Train k-means on a random sample of the rows of `matrix`.
+
+    Args:
+        matrix (np.ndarray): embeddings matrix (or memory-mapped or compressed matrix)
+        n_clusters (int): number of clusters
+        sample_size (int, optional): number of rows to train on. Defaults to 1_000_000.
+        niter (int, optional): number of k-means iterations. Defaults to 20.
+        random_state (int, optional): seed for the sample and k-means initialisation. Defaults to 42.
+        verbose (bool, optional): log k-means progress. Defaults to False.
+
+    Returns:
+        np.ndarray: float32 centroids, of shape (n_clusters, dim)
+    """
+    num_rows, dim = matrix.shape
+    rnd = np.random.RandomState(random_state)
+    # Sorted rows so that reading from a memory-mapped matrix is sequential.
+    rows = np.sort(rnd.choice(num_rows, min(sample_size, num_rows), replace=False))
+    sample = np.ascontiguousarray(matrix[rows], dtype=np.float32)
+
+    kmeans = faiss.Kmeans(
+        dim,
+        n_clusters,
+        niter=niter,
+        seed=random_state,
+        # Use the whole sample rather than Faiss' own subsample of 256 rows per centroid.
+        max_points_per_centroid=int(np.ceil(len(rows) / n_clusters)),
+        verbose=verbose,
+    )
+    kmeans.train(sample)
+
+    return kmeans.centroids
+
+
+def assign_to_centroids(
+    matrix: np.ndarray,
+    centroids: np.ndarray,
+    block_size: int = 100_000,
+    num_threads: int = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Assign each row of `matrix` to its nearest centroid by squared L2 distance.
+
+    Args:
+        matrix (np.ndarray): embeddings matrix (or memory-mapped or compressed matrix)
+        centroids (np.ndarray): centroids, e.g. from `train_kmeans`
+        block_size (int, optional): number of rows read and assigned at a time by each thread. Defaults to 100_000.
+        num_threads (int, optional): number of threads. Defaults to None (one per core).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: int32 labels and float32 squared distances to the assigned centroid, with one
+            element per row of `matrix`
+    """
+    centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+    centroid_norms = (centroids**2).sum(axis=1)
+    num_rows = matrix.shape[0]
+    labels = np.empty(num_rows, dtype=np.int32)
+    distances = np.empty(num_rows, dtype=np.float32)
+
+    def _assign_block(start: int):
+        block = slice(start, min(start + block_size, num_rows))
+        x = np.asarray(matrix[block], dtype=np.float32)
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, where the |x|^2 term doesn't change which centroid is nearest.
+        scores = centroid_norms - 2 * (x @ centroids.T)
+        block_labels = scores.argmin(axis=1)
+
+        labels[block] = block_labels
+        distances[block] = np.maximum(
+            scores[np.arange(len(x)), block_labels] + (x**2).sum(axis=1), 0
+        )
+
+    with ThreadPoolExecutor(
+        max_workers=num_threads or os.cpu_count(), thread_name_prefix="clustering"
+    ) as executor:
+        list(executor.map(_assign_block, range(0, num_rows, block_size)))
+
+    return labels, distances
+
+
+def merge_clusters(centroids: np.ndarray, eps: float) -> np.ndarray:
+    """Join coarse clusters whose centroids are connected by chains of centroids within L2 distance `eps` of each
+    other (DBSCAN with `min_samples=1` over the centroids).
+
+    Returns:
+        np.ndarray: int32 merged cluster of each coarse cluster, numbered from 0 in order of the coarse clusters
+    """
+    centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+    index = faiss.IndexFlatL2(centroids.shape[1])
+    index.add(centroids)
+    # Radius is a squared distance for L2 indexes.
+    lims, _, neighbours = index.range_search(centroids, eps**2)
+
+    n = len(centroids)
+    graph = csr_matrix(
+        (np.ones(len(neighbours), dtype=np.int8), neighbours, lims), shape=(n, n)
+    )
+    _, components = connected_components(graph, directed=False)
+
+    # Renumber so that merged clusters are in order of their first coarse cluster.
+    _, first, inverse = np.unique(components, return_index=True, return_inverse=True)
+
+    return np.argsort(np.argsort(first)).astype(np.int32)[inverse]
+
+
+def mark_outliers(
+    labels: np.ndarray, distances: np.ndarray, quantile: float
+) -> np.ndarray:
+    """Label entities further from their centroid than the `quantile` of distances in their cluster as noise (-1)."""
+    thresholds = pd.Series(distances).groupby(labels).quantile(quantile)
+    outliers = distances > thresholds.reindex(labels).values
+
+    return np.where(outliers, NOISE_LABEL, labels).astype(np.int32)
+
+
+def save_clusters(
+    folder: str, labels: np.ndarray, centroids: np.ndarray, info: dict
+) -> dict:
+    """Save labels, centroids and information about how they were made to `folder`. The info file is written last,
+    so a folder without one is incomplete.
+
+    Returns:
+        dict: `info`, with the number of clusters, noise and cluster sizes added
+    """
+    os.makedirs(folder, exist_ok=True)
+    info_path = os.path.join(folder, INFO_FILE_NAME)
+    if os.path.exists(info_path):
+        os.remove(info_path)
+
+    np.save(os.path.join(folder, LABELS_FILE_NAME), labels.astype(np.int32))
+    np.save(os.path.join(folder, CENTROIDS_FILE_NAME), centroids.astype(np.float32))
+
+    sizes = np.bincount(labels[labels >= 0])
+    info = {
+        **info,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "num_entities": int(len(labels)),
+        "num_clusters": int(len(sizes)),
+        "num_noise": int((labels == NOISE_LABEL).sum()),
+        "cluster_sizes": sizes.tolist(),
+    }
+
+    with open(info_path, "w") as f:
+        json.dump(info, f, indent=4)
+
+    return info
+
+
+def write_group_mapping(
+    path: str,
+    embedding_store: KGEmbeddingStore,
+    labels: np.ndarray,
+    block_size: int = 1_000_000,
+):
+    """Write labels as a group mapping TSV in the format of the visualisation colour mappings, so that the API can
+    filter neighbours by cluster (see `src.entity_filters`).
+    """
+    with open(path, "w") as f:
+        for start in range(0, len(labels), block_size):
+            rows = np.arange(start, min(start + block_size, len(labels)))
+            block_labels = labels[rows]
+            pd.DataFrame(
+                {
+                    "value": embedding_store.idxs_to_entities(rows),
+                    "group": np.where(
+                        block_labels >= 0,
+                        np.char.add("Cluster ", block_labels.astype(str)),
+                        "Noise",
+                    ),
+                },
+                index=rows,
+            ).to_csv(f, sep="\t", header=False, quoting=csv.QUOTE_NONE)
+
+
+class ClusterLabels:
+    def __init__(self, labels: np.ndarray, info: dict = None):
+        """Cluster label of each row of an entity embeddings matrix, with -1 for noise.
+
+        Args:
+            labels (np.ndarray): int32 array with one element per row
+            info (dict, optional): information about how the labels were made. Defaults to None.
+        """
+        self.labels = labels
+        self.info = info or {}
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = True) -> "ClusterLabels":
+        """Load labels saved with `save_clusters`."""
+        with open(os.path.join(folder, INFO_FILE_NAME), "r") as f:
+            info = json.load(f)
+
+        labels = np.load(
+            os.path.join(folder, LABELS_FILE_NAME), mmap_mode="r" if mmap else None
+        )
+
+        return cls(labels, info)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def num_clusters(self) -> int:
+        return self.info.get("num_clusters", int(self.labels.max()) + 1)
+
+    def members(self, label: int) -> np.ndarray:
+        """Rows of the entities in cluster `label`, in ascending order."""
+        return np.flatnonzero(self.labels == label)
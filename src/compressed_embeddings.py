@@ -0,0 +1,267 @@
+"""
+Submodule for storing embeddings matrices compressed, as float16, per-dimension scalar quantized int8 or product
+quantized codes. Compressed matrices can be used in place of float32 matrices in a `KGEmbeddingStore`: rows are
+decoded to float32 when they're indexed, so lookups and distances only decode the rows they use.
+"""
+
+import json
+import os
+from typing import Tuple
+import faiss
+import numpy as np
+
+COMPRESSION_METHODS = ("float16", "int8", "pq")
+META_FILE_NAME = "compression.json"
+CODES_FILE_NAME = "codes.npy"
+PARAMS_FILE_NAME = "params.npz"
+
+
+class CompressedEmbeddings:
+    """A read-only embeddings matrix stored as compressed codes, which decodes rows to float32 when indexed.
+
+    Supports the parts of the `np.ndarray` interface that `KGEmbeddingStore` uses: `shape`, `dtype`, `len` and
+    indexing by row (an int, slice or array of rows, optionally followed by column indexes). Converting it to an
+    array (e.g. `np.asarray`) decodes the whole matrix.
+    """
+
+    method = None
+
+    def __init__(self, codes: np.ndarray, dim: int):
+        self.codes = codes
+        self.dim = dim
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (self.codes.shape[0], self.dim)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(np.float32)
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the codes and decoding parameters."""
+        return self.codes.nbytes + sum(p.nbytes for p in self._params().values())
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def __getitem__(self, key):
+        rows, cols = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        codes = self.codes[rows]
+        single_row = codes.ndim == self.codes.ndim - 1
+        decoded = self._decode(codes[np.newaxis] if single_row else codes)
+
+        if single_row:
+            decoded = decoded[0]
+
+        return decoded[(Ellipsis, *cols)] if cols else decoded
+
+    def __array__(self, dtype=None):
+        decoded = self.decode_blocks()
+        return decoded if dtype is None else decoded.astype(dtype)
+
+    def decode_blocks(self, block_size: int = 100_000) -> np.ndarray:
+        """Decode the whole matrix, `block_size` rows at a time."""
+        decoded = np.empty(self.shape, dtype=np.float32)
+
+        for start in range(0, len(self), block_size):
+            block = slice(start, start + block_size)
+            decoded[block] = self._decode(self.codes[block])
+
+        return decoded
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _params(self) -> dict:
+        return {}
+
+    @classmethod
+    def _from_params(cls, codes: np.ndarray, dim: int, params: dict):
+        return cls(codes, dim, **params)
+
+    def save(self, folder: str):
+        """Save to `folder` (created if it doesn't exist). Load with `load_compressed_embeddings`."""
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, CODES_FILE_NAME), self.codes)
+        np.savez(os.path.join(folder, PARAMS_FILE_NAME), **self._params())
+
+        with open(os.path.join(folder, META_FILE_NAME), "w") as f:
+            json.dump(
+                {"method": self.method, "num_rows": len(self), "dim": self.dim}, f
+            )
+
+
+class Float16Embeddings(CompressedEmbeddings):
+    """Embeddings stored as float16, using half the memory of float32."""
+
+    method = "float16"
+
+    def __init__(self, codes: np.ndarray, dim: int = None):
+        super().__init__(codes, dim or codes.shape[1])
+
+    @classmethod
+    def encode(cls, matrix: np.ndarray, block_size: int = 100_000):
+        codes = np.empty(matrix.shape, dtype=np.float16)
+
+        for start in range(0, matrix.shape[0], block_size):
+            block = slice(start, start + block_size)
+            codes[block] = matrix[block]
+
+        return cls(codes)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32)
+
+
+class Int8Embeddings(CompressedEmbeddings):
+    """Embeddings stored as int8 by scalar quantization of each dimension, using a quarter of the memory of float32.
+
+    Each dimension's range of values is split into 256 equal steps, and values are decoded to the middle of their step.
+    """
+
+    method = "int8"
+
+    def __init__(self, codes: np.ndarray, dim: int = None, mins=None, scales=None):
+        super().__init__(codes, dim or codes.shape[1])
+        self.mins = mins
+        self.scales = scales
+
+    @classmethod
+    def encode(cls, matrix: np.ndarray, block_size: int = 100_000):
+        mins = np.full(matrix.shape[1], np.inf, dtype=np.float32)
+        maxs = np.full(matrix.shape[1], -np.inf, dtype=np.float32)
+
+        for start in range(0, matrix.shape[0], block_size):
+            block = np.asarray(matrix[slice(start, start + block_size)])
+            mins = np.minimum(mins, block.min(axis=0))
+            maxs = np.maximum(maxs, block.max(axis=0))
+
+        # Constant dimensions would otherwise have a step of 0.
+        scales = np.maximum((maxs - mins) / 256, np.finfo(np.float32).tiny)
+        codes = np.empty(matrix.shape, dtype=np.int8)
+
+        for start in range(0, matrix.shape[0], block_size):
+            block = slice(start, start + block_size)
+            steps = np.floor((matrix[block] - mins) / scales)
+            codes[block] = np.clip(steps, 0, 255) - 128
+
+        return cls(codes, mins=mins, scales=scales)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        return (codes.astype(np.float32) + 128.5) * self.scales + self.mins
+
+    def _params(self) -> dict:
+        return {"mins": self.mins, "scales": self.scales}
+
+
+class PQEmbeddings(CompressedEmbeddings):
+    """Embeddings stored as product quantization codes: each of `m` subvectors is replaced by the index of its nearest
+    centroid out of 256 learned for that subspace, so each row uses `m` bytes.
+    """
+
+    method = "pq"
+
+    def __init__(self, codes: np.ndarray, dim: int = None, centroids=None):
+        # centroids: (m, 256, dim / m)
+        super().__init__(codes, dim or centroids.shape[0] * centroids.shape[2])
+        self.centroids = centroids
+
+    @classmethod
+    def encode(
+        cls,
+        matrix: np.ndarray,
+        m: int = 16,
+        train_sample_size: int = 100_000,
+        block_size: int = 100_000,
+        random_state: int = 42,
+    ):
+        if matrix.shape[1] % m != 0:
+            raise ValueError(
+                f"The embedding dimension ({matrix.shape[1]}) must be divisible by `m` ({m})."
+            )
+
+        pq = faiss.ProductQuantizer(matrix.shape[1], m, 8)
+        rnd = np.random.RandomState(random_state)
+        train_rows = np.sort(
+            rnd.choice(
+                matrix.shape[0],
+                min(train_sample_size, matrix.shape[0]),
+                replace=False,
+            )
+        )
+        pq.train(np.ascontiguousarray(matrix[train_rows], dtype=np.float32))
+
+        codes = np.empty((matrix.shape[0], m), dtype=np.uint8)
+        for start in range(0, matrix.shape[0], block_size):
+            block = slice(start, start + block_size)
+            codes[block] = pq.compute_codes(
+                np.ascontiguousarray(matrix[block], dtype=np.float32)
+            )
+
+        centroids = faiss.vector_to_array(pq.centroids).reshape(m, pq.ksub, pq.dsub)
+
+        return cls(codes, centroids=centroids)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        m = self.centroids.shape[0]
+
+        return self.centroids[np.arange(m), codes.astype(np.int64)].reshape(
+            codes.shape[0], self.dim
+        )
+
+    def _params(self) -> dict:
+        return {"centroids": self.centroids}
+
+
+_METHOD_CLASSES = {
+    cls.method: cls for cls in (Float16Embeddings, Int8Embeddings, PQEmbeddings)
+}
+
+
+def compress_embeddings(
+    matrix: np.ndarray, method: str, **kwargs
+) -> CompressedEmbeddings:
+    """Compress an embeddings matrix.
+
+    Args:
+        matrix (np.ndarray): float32 matrix, which can be memory-mapped
+        method (str): one of "float16", "int8" or "pq"
+        **kwargs: passed to the `encode` method of the compression class, e.g. `m` for "pq"
+
+    Returns:
+        CompressedEmbeddings
+    """
+    if method not in COMPRESSION_METHODS:
+        raise ValueError(
+            f"Argument `method` must be one of {COMPRESSION_METHODS}; got '{method}'."
+        )
+
+    return _METHOD_CLASSES[method].encode(matrix, **kwargs)
+
+
+def is_compressed_embeddings(path: str) -> bool:
+    """Whether `path` is a folder saved by `CompressedEmbeddings.save`."""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE_NAME))
+
+
+def load_compressed_embeddings(folder: str, mmap: bool = False) -> CompressedEmbeddings:
+    """Load compressed embeddings saved with `CompressedEmbeddings.save`. With `mmap=True` the codes are
+    memory-mapped read-only.
+    """
+    with open(os.path.join(folder, META_FILE_NAME), "r") as f:
+        meta = json.load(f)
+
+    codes = np.load(
+        os.path.join(folder, CODES_FILE_NAME), mmap_mode="r" if mmap else None
+    )
+
+    with np.load(os.path.join(folder, PARAMS_FILE_NAME)) as params:
+        params = {name: params[name] for name in params.files}
+
+    return _METHOD_CLASSES[meta["method"]]._from_params(codes, meta["dim"], params)
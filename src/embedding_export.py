@@ -0,0 +1,79 @@
+"""
+Submodule for exporting entity embeddings in bulk as an Arrow IPC stream, a chunk at a time.
+
+The stream is a table with the columns `entity` (string) and `embedding` (fixed size list of float32), with the
+model version and embedding dimension in its schema metadata. It can be read with e.g.
+`pyarrow.ipc.open_stream(response.raw)`, one record batch at a time.
+
+Only one chunk is held in memory at a time. When the rows of a chunk are contiguous in the entity embeddings matrix
+(as they are when exporting the whole store, or a namespace prefix whose entities are stored together) the chunk's
+embeddings are a view of the matrix rather than a copy. Compressed matrices are decoded a chunk at a time.
+"""
+
+from typing import Iterator
+import numpy as np
+from src.embedding_store import KGEmbeddingStore
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# The end-of-stream marker of the Arrow IPC streaming format: a continuation token followed by a zero length.
+_END_OF_STREAM = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+def _rows_block(matrix, rows: np.ndarray) -> np.ndarray:
+    """Rows of `matrix` as float32, as a view if `rows` are contiguous and ascending."""
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows) and np.all(np.diff(rows) == 1):
+        block = matrix[slice(int(rows[0]), int(rows[-1]) + 1)]
+    else:
+        block = matrix[rows]
+
+    return np.ascontiguousarray(block, dtype=np.float32)
+
+
+def iter_embeddings_arrow(
+    store: KGEmbeddingStore,
+    rows: np.ndarray,
+    chunk_size: int = 10_000,
+    model_version: str = None,
+) -> Iterator[bytes]:
+    """Generate an Arrow IPC stream of the entities in `rows` of `store` and their embeddings, as one message per
+    chunk of `chunk_size` rows. Nothing is computed until the next message is asked for, so a consumer that iterates
+    only as fast as it can send (like Starlette's `StreamingResponse`) applies backpressure.
+
+    Args:
+        store (KGEmbeddingStore)
+        rows (np.ndarray): rows of the entity embeddings matrix to export, in the order to export them
+        chunk_size (int, optional): number of rows per record batch. Defaults to 10_000.
+        model_version (str, optional): recorded in the schema metadata. Defaults to None.
+
+    Yields:
+        bytes: the schema, then each record batch, then the end of stream marker
+    """
+    import pyarrow as pa
+
+    dim = store.entity_dim
+    schema = pa.schema(
+        [("entity", pa.string()), ("embedding", pa.list_(pa.float32(), dim))],
+        metadata={
+            "model_version": model_version or "",
+            "dim": str(dim),
+            "num_rows": str(len(rows)),
+        },
+    )
+    yield schema.serialize().to_pybytes()
+
+    for start in range(0, len(rows), chunk_size):
+        chunk_rows = rows[slice(start, start + chunk_size)]
+        block = _rows_block(store.ent_embedding_matrix, chunk_rows)
+
+        batch = pa.record_batch(
+            [
+                pa.array(store.idxs_to_entities(chunk_rows), type=pa.string()),
+                # Zero-copy: the Arrow array wraps `block`'s buffer.
+                pa.FixedSizeListArray.from_arrays(pa.array(block.reshape(-1)), dim),
+            ],
+            schema=schema,
+        )
+        yield batch.serialize().to_pybytes()
+
+    yield _END_OF_STREAM
@@ -1,8 +1,147 @@
 import os
 import csv
-from typing import Iterable, List
+from typing import Iterable, List, Tuple
 import numpy as np
 import pandas as pd
+from src.compressed_embeddings import (
+    compress_embeddings,
+    is_compressed_embeddings,
+    load_compressed_embeddings,
+)
+from src.metrics import timed_stage
+
+
+class UnknownValuesError(KeyError):
+    """Raised when entities or relations are requested from a `KGEmbeddingStore` that aren't in its mappings."""
+
+    def __init__(self, values: List[str]):
+        self.values = values
+        super().__init__(f"{len(values)} value(s) not found in mapping: {values}")
+
+
+def _build_value_index(mapping: pd.DataFrame) -> Tuple[pd.Index, np.ndarray]:
+    """Build a hash index over the 'value' column of a mapping DataFrame, and the matrix rows that each position
+    of the index corresponds to. If a value appears more than once in the mapping its first row is used.
+    """
+    keep = ~mapping["value"].duplicated(keep="first").values
+
+    return pd.Index(mapping["value"].values[keep]), mapping.index.values[keep].astype(
+        np.int64
+    )
+
+
+def _build_value_table(mapping: pd.DataFrame) -> np.ndarray:
+    """Build an array of the values in a mapping DataFrame, where the value of matrix row i is at position i, so that
+    rows can be converted to values with a single gather.
+    """
+    rows = mapping.index.values.astype(np.int64)
+    table = np.full(rows.max() + 1 if len(rows) else 0, None, dtype=object)
+    table[rows] = mapping["value"].values
+
+    return table
+
+
+def _lookup_values(idxs, value_table: np.ndarray) -> list:
+    idxs = np.asarray(idxs, dtype=np.int64)
+    values = value_table[idxs]
+
+    # Searches return -1 where fewer neighbours than requested were found.
+    missing = idxs < 0
+    if missing.any():
+        values[missing] = None
+
+    return values.tolist()
+
+
+def _lookup_idxs(
+    values: Iterable[str],
+    value_index: pd.Index,
+    value_rows: np.ndarray,
+    ignore_missing: bool,
+) -> np.ndarray:
+    if not isinstance(values, (list, np.ndarray, pd.Index, pd.Series)):
+        values = list(values)
+
+    positions = value_index.get_indexer(values)
+    missing = positions < 0
+
+    if missing.any() and not ignore_missing:
+        raise UnknownValuesError(np.asarray(values, dtype=object)[missing].tolist())
+
+    return np.where(missing, -1, value_rows[positions])
+
+
+def load_embeddings_matrix(
+    path: str, mmap: bool = False, block_size: int = 100_000
+) -> np.ndarray:
+    """Load an embeddings matrix from a .npy file as float32, or from a folder of compressed embeddings saved by
+    `CompressedEmbeddings.save`, which are decoded to float32 as rows are used.
+
+    With `mmap=True` the file is memory-mapped read-only rather than copied into memory, so that processes loading
+    the same file share its pages in the OS page cache. If the file isn't already a C-ordered float32 array it is
+    converted once to a float32 copy alongside it (`{name}.float32.npy`), which is memory-mapped on this and all
+    subsequent loads.
+
+    Args:
+        path (str): path to .npy file
+        mmap (bool, optional): whether to memory-map the file rather than loading it into memory. Defaults to False.
+        block_size (int, optional): number of rows converted at a time when creating a float32 copy. Defaults to 100_000.
+
+    Returns:
+        np.ndarray: float32 matrix (a read-only `np.memmap` if `mmap=True`)
+    """
+    if is_compressed_embeddings(path):
+        return load_compressed_embeddings(path, mmap=mmap)
+
+    if not mmap:
+        return np.load(path).astype("float32")
+
+    matrix = np.load(path, mmap_mode="r")
+
+    if matrix.dtype == np.float32 and matrix.flags["C_CONTIGUOUS"]:
+        return matrix
+
+    converted_path = f"{os.path.splitext(path)[0]}.float32.npy"
+
+    if not os.path.exists(converted_path) or os.path.getmtime(
+        converted_path
+    ) < os.path.getmtime(path):
+        # Write to a temporary file and rename it so that other processes never see a partially written file.
+        tmp_path = f"{converted_path}.{os.getpid()}.tmp"
+        converted = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=matrix.shape
+        )
+        for start in range(0, matrix.shape[0], block_size):
+            block = slice(start, start + block_size)
+            converted[block] = matrix[block]
+        converted.flush()
+        del converted
+        os.replace(tmp_path, converted_path)
+
+    return np.load(converted_path, mmap_mode="r")
+
+
+def load_mapping(path: str) -> pd.DataFrame:
+    """Load a DGL-KE style mapping TSV, where each line is a matrix row followed by an entity or relation value."""
+    return pd.read_csv(
+        path,
+        sep="\t",
+        index_col=0,
+        header=None,
+        names=["value"],
+        quoting=csv.QUOTE_NONE,
+        error_bad_lines=False,
+    )
+
+
+DISTANCE_METRICS = ("squared_l2", "cosine")
+
+
+def _check_metric(metric: str):
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(
+            f"Argument `metric` must be one of {DISTANCE_METRICS}; got '{metric}'."
+        )
 
 
 class KGEmbeddingStore:
@@ -16,7 +155,7 @@ class KGEmbeddingStore:
         rel_mapping: pd.DataFrame,
     ):
         """Create KGEmbeddingStore from embeddings matrices and mappings.
-        Embeddings matrices are np.ndarrays with dtype=float32; mappings are DataFrames where the index column corresponds to rows of the embeddings matrices,
+        Embeddings matrices are np.ndarrays with dtype=float32 (or `CompressedEmbeddings`, which decode rows to float32); mappings are DataFrames where the index column corresponds to rows of the embeddings matrices,
         and there is a 'value' column with a unique identifier for each entity or relation.
 
         Args:
@@ -30,6 +169,13 @@ class KGEmbeddingStore:
         self._ent_mapping = ent_mapping
         self._rel_mapping = rel_mapping
 
+        # Built once so that looking up values costs O(k) for k values rather than a scan over the whole mapping.
+        self._ent_index, self._ent_index_rows = _build_value_index(ent_mapping)
+        self._rel_index, self._rel_index_rows = _build_value_index(rel_mapping)
+        # Converting rows back to values is one gather from these, rather than a pandas lookup.
+        self._ent_values = _build_value_table(ent_mapping)
+        self._rel_values = _build_value_table(rel_mapping)
+
     @property
     def ent_embedding_matrix(self):
         return self._ent_embeddings
@@ -38,6 +184,14 @@ class KGEmbeddingStore:
     def rel_embedding_matrix(self):
         return self._rel_embeddings
 
+    @property
+    def ent_mapping(self):
+        return self._ent_mapping
+
+    @property
+    def rel_mapping(self):
+        return self._rel_mapping
+
     @property
     def entity_dim(self):
         return self._ent_embeddings.shape[1]
@@ -46,27 +200,77 @@ class KGEmbeddingStore:
     def relation_dim(self):
         return self._rel_embeddings.shape[1]
 
+    def entities_to_idxs(
+        self, entities: Iterable[str], ignore_missing: bool = False
+    ) -> np.ndarray:
+        """Convert entity values to rows of the entity embeddings matrix.
+
+        Args:
+            entities (Iterable[str]): List of entities by URI/value.
+            ignore_missing (bool, optional): if True, entities not in the store get the row -1 rather than raising an
+                `UnknownValuesError`. Defaults to False.
+
+        Returns:
+            np.ndarray: int64 array of rows, in the order of `entities`
+        """
+        with timed_stage("entity_lookup"):
+            return _lookup_idxs(
+                entities, self._ent_index, self._ent_index_rows, ignore_missing
+            )
+
+    def relations_to_idxs(
+        self, relations: Iterable[str], ignore_missing: bool = False
+    ) -> np.ndarray:
+        """Convert relation values to rows of the relation embeddings matrix.
+
+        Args:
+            relations (Iterable[str]): List of relations by URI/value.
+            ignore_missing (bool, optional): if True, relations not in the store get the row -1 rather than raising an
+                `UnknownValuesError`. Defaults to False.
+
+        Returns:
+            np.ndarray: int64 array of rows, in the order of `relations`
+        """
+        return _lookup_idxs(
+            relations, self._rel_index, self._rel_index_rows, ignore_missing
+        )
+
+    def entity_idxs_with_prefix(self, prefix: str = None) -> np.ndarray:
+        """Rows of the entity embeddings matrix of entities whose values start with `prefix`, e.g. a namespace such as
+        "http://www.wikidata.org/entity/".
+
+        Args:
+            prefix (str, optional): Defaults to None (rows of all entities).
+
+        Returns:
+            np.ndarray: int64 array of rows, in ascending order
+        """
+        rows = self._ent_index_rows
+
+        if prefix:
+            rows = rows[np.asarray(self._ent_index.str.startswith(prefix), dtype=bool)]
+
+        return np.sort(rows)
+
     def get_entity_embeddings(self, entities: Iterable[str] = None) -> np.ndarray:
         """Get embeddings vectors for a subset of entities.
 
         Args:
             entities (Iterable[str], optional): List of entities by URI/value. Defaults to None.
 
+        Raises:
+            UnknownValuesError: if any of `entities` aren't in the store
+
         Returns:
             np.ndarray: rows correspond to order of `entities`
         """
         if not entities:
             return self.ent_embedding_matrix
 
-        tempdf = self._ent_mapping[self._ent_mapping["value"].isin(entities)]
-        # Here we create a new column which allows us to ensure the returned idxs match up to the order
-        # of `entities`.
-        tempdf["sort_entities"] = pd.Categorical(
-            tempdf["value"], categories=entities, ordered=True
-        )
-        idxs = tempdf.sort_values("sort_entities").index.tolist()
+        idxs = self.entities_to_idxs(entities)
 
-        return self._ent_embeddings[idxs, :]
+        with timed_stage("embedding_gather"):
+            return self._ent_embeddings[idxs, :]
 
     def get_relation_embeddings(self, relations: Iterable[str] = None) -> np.ndarray:
         """Get embeddings vectors for a subset of relations.
@@ -74,6 +278,9 @@ class KGEmbeddingStore:
         Args:
             relations (Iterable[str], optional): List of relations by URI/value. Defaults to None.
 
+        Raises:
+            UnknownValuesError: if any of `relations` aren't in the store
+
         Returns:
             np.ndarray: rows correspond to order of `relations`
         """
@@ -81,26 +288,145 @@ class KGEmbeddingStore:
         if not relations:
             return self.rel_embedding_matrix
 
-        idxs = self._rel_mapping[
-            self._rel_mapping["value"].isin(relations)
-        ].index.tolist()
+        return self._rel_embeddings[self.relations_to_idxs(relations), :]
 
-        return self._rel_embeddings[idxs, :]
-
-    def idxs_to_entities(self, idxs: int) -> List[str]:
-        """Convert indexes to entity values."""
-        return self._ent_mapping.iloc[idxs]["value"].tolist()
+    def idxs_to_entities(self, idxs) -> list:
+        """Convert rows of the entity embeddings matrix to entity values. A matrix of rows (e.g. search results) is
+        converted in one operation to a list of lists. Negative rows, which searches return where fewer neighbours
+        than requested were found, are converted to None.
+        """
+        with timed_stage("idxs_to_entities"):
+            return _lookup_values(idxs, self._ent_values)
 
-    def idxs_to_relations(self, idxs: int) -> List[str]:
-        """Convert indexes to relation values."""
-        return self._rel_embeddings.iloc[idxs]["value"].tolist()
+    def idxs_to_relations(self, idxs) -> list:
+        """Convert rows of the relation embeddings matrix to relation values. See `idxs_to_entities`."""
+        return _lookup_values(idxs, self._rel_values)
 
     def get_entity_distance(self, entity_pair: Iterable[str]) -> float:
         """Get the squared Euclidean distance between the embeddings of the two entities defined by `entity_pair`."""
 
         embeddings = self.get_entity_embeddings(entity_pair)
 
-        return float(np.linalg.norm(embeddings[0, :] - embeddings[1, :]))**2
+        with timed_stage("distance"):
+            return float(np.linalg.norm(embeddings[0, :] - embeddings[1, :])) ** 2
+
+    def get_entity_distances(
+        self,
+        entities_a: Iterable[str],
+        entities_b: Iterable[str],
+        metric: str = "squared_l2",
+        block_size: int = 100_000,
+    ) -> np.ndarray:
+        """Get the distance between the embeddings of each pair of entities (`entities_a[i]`, `entities_b[i]`).
+
+        Args:
+            entities_a (Iterable[str]): first entity of each pair, by URI/value
+            entities_b (Iterable[str]): second entity of each pair, by URI/value. Must be the same length as `entities_a`.
+            metric (str, optional): one of "squared_l2" (squared Euclidean distance) or "cosine" (cosine distance).
+                Defaults to "squared_l2".
+            block_size (int, optional): number of pairs to compute at a time, which bounds memory use. Defaults to 100_000.
+
+        Raises:
+            UnknownValuesError: if any of the entities aren't in the store
+
+        Returns:
+            np.ndarray: float64 array of distances, in the order of the pairs
+        """
+        _check_metric(metric)
+        idxs_a = self.entities_to_idxs(entities_a)
+        idxs_b = self.entities_to_idxs(entities_b)
+
+        if len(idxs_a) != len(idxs_b):
+            raise ValueError(
+                f"`entities_a` and `entities_b` must be the same length; got {len(idxs_a)} and {len(idxs_b)}."
+            )
+
+        with timed_stage("distance"):
+            distances = np.empty(len(idxs_a), dtype=np.float64)
+
+            for start in range(0, len(idxs_a), block_size):
+                block = slice(start, start + block_size)
+                a = self._ent_embeddings[idxs_a[block]].astype(np.float64)
+                b = self._ent_embeddings[idxs_b[block]].astype(np.float64)
+
+                if metric == "squared_l2":
+                    distances[block] = np.einsum("ij,ij->i", a - b, a - b)
+                else:
+                    distances[block] = 1 - np.einsum("ij,ij->i", a, b) / (
+                        np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+                    )
+
+        return distances
+
+    def get_entity_distance_matrix(
+        self,
+        entities_a: Iterable[str],
+        entities_b: Iterable[str],
+        metric: str = "squared_l2",
+        block_size: int = 1_000,
+    ) -> np.ndarray:
+        """Get the distances between the embeddings of every entity in `entities_a` and every entity in `entities_b`.
+
+        Args:
+            entities_a (Iterable[str]): entities by URI/value, corresponding to rows of the result
+            entities_b (Iterable[str]): entities by URI/value, corresponding to columns of the result
+            metric (str, optional): one of "squared_l2" (squared Euclidean distance) or "cosine" (cosine distance).
+                Defaults to "squared_l2".
+            block_size (int, optional): number of rows to compute at a time, which bounds the memory used on top of the
+                result. Defaults to 1_000.
+
+        Raises:
+            UnknownValuesError: if any of the entities aren't in the store
+
+        Returns:
+            np.ndarray: float32 matrix of shape (len(entities_a), len(entities_b))
+        """
+        _check_metric(metric)
+        # Not `get_entity_embeddings`, which returns every entity for an empty list.
+        b = self._ent_embeddings[self.entities_to_idxs(entities_b)]
+        idxs_a = self.entities_to_idxs(entities_a)
+        with timed_stage("distance"):
+            b_sq_norms = np.einsum("ij,ij->i", b, b)
+
+            if metric == "cosine":
+                b = b / np.sqrt(b_sq_norms)[:, np.newaxis]
+
+            distances = np.empty((len(idxs_a), b.shape[0]), dtype=np.float32)
+
+            for start in range(0, len(idxs_a), block_size):
+                block = slice(start, start + block_size)
+                a = self._ent_embeddings[idxs_a[block]]
+                a_sq_norms = np.einsum("ij,ij->i", a, a)
+
+                if metric == "squared_l2":
+                    # ||a - b||^2 = ||a||^2 + ||b||^2 - 2ab, clipped as rounding errors can make it slightly negative.
+                    distances[block] = np.maximum(
+                        a_sq_norms[:, np.newaxis] + b_sq_norms - 2 * a @ b.T, 0
+                    )
+                else:
+                    distances[block] = (
+                        1 - (a / np.sqrt(a_sq_norms)[:, np.newaxis]) @ b.T
+                    )
+
+        return distances
+
+    def compress(self, method: str, **kwargs) -> "KGEmbeddingStore":
+        """Get a copy of the store with the entity embeddings compressed (see `src.compressed_embeddings`). Relation
+        embeddings are kept as they are, as there are few of them.
+
+        Args:
+            method (str): one of "float16", "int8" or "pq"
+            **kwargs: passed to `compress_embeddings`, e.g. `m` for "pq"
+
+        Returns:
+            KGEmbeddingStore
+        """
+        return KGEmbeddingStore(
+            ent_embeddings=compress_embeddings(self._ent_embeddings, method, **kwargs),
+            ent_mapping=self._ent_mapping,
+            rel_embeddings=self._rel_embeddings,
+            rel_mapping=self._rel_mapping,
+        )
 
     @classmethod
     def from_dglke(
@@ -109,6 +435,7 @@ class KGEmbeddingStore:
         embeddings_file_names: Iterable[str],
         mappings_folder: str,
         mappings_file_names: Iterable[str] = ["entities.tsv", "relations.tsv"],
+        mmap: bool = False,
     ) -> "KGEmbeddingStore":
         """Create a KGEmbeddingStore from saved DGL-KE training outputs.
 
@@ -117,34 +444,24 @@ class KGEmbeddingStore:
             embeddings_file_names (Iterable[str]): file names of embedding and relation matrices in `embeddings_folder`
             mappings_folder (str): folder that the TSV files storing the mapping between matrix rows and entity/relation names are stored in
             mappings_file_names (Iterable[str], optional): file names of entity and relation mapping TSVs. Defaults to ["entities.tsv", "relations.tsv"].
+            mmap (bool, optional): memory-map the embeddings matrices read-only instead of loading a copy of them into memory.
+                See `load_embeddings_matrix`. Defaults to False.
 
         Returns:
             KGEmbeddingStore: correctly initialised instance
         """
-        entities = np.load(
-            os.path.join(embeddings_folder, embeddings_file_names[0])
-        ).astype("float32")
-        relations = np.load(
-            os.path.join(embeddings_folder, embeddings_file_names[1])
-        ).astype("float32")
-
-        ent_mapping = pd.read_csv(
-            os.path.join(mappings_folder, mappings_file_names[0]),
-            sep="\t",
-            index_col=0,
-            header=None,
-            names=["value"],
-            quoting=csv.QUOTE_NONE,
-            error_bad_lines=False,
+        entities = load_embeddings_matrix(
+            os.path.join(embeddings_folder, embeddings_file_names[0]), mmap=mmap
+        )
+        relations = load_embeddings_matrix(
+            os.path.join(embeddings_folder, embeddings_file_names[1]), mmap=mmap
+        )
+
+        ent_mapping = load_mapping(
+            os.path.join(mappings_folder, mappings_file_names[0])
         )
-        rel_mapping = pd.read_csv(
-            os.path.join(mappings_folder, mappings_file_names[1]),
-            sep="\t",
-            index_col=0,
-            header=None,
-            names=["value"],
-            quoting=csv.QUOTE_NONE,
-            error_bad_lines=False,
+        rel_mapping = load_mapping(
+            os.path.join(mappings_folder, mappings_file_names[1])
         )
 
         return KGEmbeddingStore(
@@ -0,0 +1,186 @@
+"""
+Submodule for restricting nearest neighbour searches to a subset of entities, e.g. only Wikidata entities or only
+objects in one collection category.
+
+A `RowFilter` holds the rows of the entity embeddings matrix that searches may return, as a bitmap that Faiss checks
+inside the search (see `FaissNearestNeighbours.search_vectors`), so filtered searches return k matching results
+without oversampling. Filters are built from a namespace prefix and/or the groups that entities belong to in the
+colour mappings made for the embedding visualisations (`notebooks/create_colour_mappings_for_vis.ipynb`).
+"""
+
+from collections import OrderedDict
+import csv
+import glob
+import os
+import threading
+from typing import Dict, Iterable, List
+import faiss
+import numpy as np
+import pandas as pd
+from src.embedding_store import KGEmbeddingStore
+
+# Colour mappings are saved as e.g. mapping_collection_category.tsv, and are named "collection_category" here.
+GROUP_MAPPING_FILE_PATTERN = "mapping_*.tsv"
+
+
+class UnknownGroupsError(KeyError):
+    """Raised when a filter uses a group mapping or group that doesn't exist."""
+
+
+class RowFilter:
+    def __init__(self, mask: np.ndarray):
+        """Rows of the entity embeddings matrix that a search may return.
+
+        Args:
+            mask (np.ndarray): boolean array with an element for each row of the matrix
+        """
+        self.num_rows = len(mask)
+        self.rows = np.flatnonzero(mask)
+        # Bit i of the bitmap is row i, in the layout `faiss.IDSelectorBitmap` expects.
+        self.bitmap = np.packbits(mask, bitorder="little")
+        # Refers to `self.bitmap`'s memory, so must not outlive it.
+        self.selector = faiss.IDSelectorBitmap(
+            self.num_rows, faiss.swig_ptr(self.bitmap)
+        )
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class EntityGroups:
+    def __init__(self, groups: Dict[str, pd.Categorical]):
+        """The group each entity belongs to in one or more group mappings (e.g. "type" or "collection_category").
+
+        Args:
+            groups (Dict[str, pd.Categorical]): for each mapping, the group of each row of the entity embeddings
+                matrix (NaN for entities without one)
+        """
+        self.groups = groups
+
+    @classmethod
+    def from_folder(
+        cls, folder: str, embedding_store: KGEmbeddingStore
+    ) -> "EntityGroups":
+        """Load the colour mapping TSVs in `folder` (`mapping_{name}.tsv`, with rows of index, entity and group),
+        aligning them to the rows of `embedding_store` by entity. Entities not in the store are ignored.
+        """
+        num_rows = embedding_store.ent_embedding_matrix.shape[0]
+        groups = {}
+
+        for path in sorted(glob.glob(os.path.join(folder, GROUP_MAPPING_FILE_PATTERN))):
+            name = os.path.splitext(os.path.basename(path))[0].replace(
+                "mapping_", "", 1
+            )
+            mapping = pd.read_csv(
+                path,
+                sep="\t",
+                header=None,
+                names=["value", "group"],
+                index_col=0,
+                quoting=csv.QUOTE_NONE,
+                dtype=str,
+            )
+            rows = embedding_store.entities_to_idxs(
+                mapping["value"].fillna("").values, ignore_missing=True
+            )
+            found = rows >= 0
+
+            row_groups = np.full(num_rows, None, dtype=object)
+            row_groups[rows[found]] = mapping["group"].values[found]
+            groups[name] = pd.Categorical(row_groups)
+
+        return cls(groups)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.groups)
+
+    def categories(self, name: str) -> List[str]:
+        """The groups in mapping `name`."""
+        return self._get(name).categories.tolist()
+
+    def _get(self, name: str) -> pd.Categorical:
+        if name not in self.groups:
+            raise UnknownGroupsError(
+                f"No group mapping named '{name}'; available mappings are {self.names}"
+            )
+
+        return self.groups[name]
+
+    def mask(self, name: str, groups: Iterable[str]) -> np.ndarray:
+        """Boolean mask of the rows whose group in mapping `name` is one of `groups`."""
+        row_groups = self._get(name)
+        groups = list(groups)
+        unknown = set(groups) - set(row_groups.categories)
+
+        if unknown:
+            raise UnknownGroupsError(
+                f"Groups not in mapping '{name}': {sorted(unknown)}"
+            )
+
+        codes = row_groups.categories.get_indexer(groups)
+
+        return np.isin(row_groups.codes, codes)
+
+
+class RowFilterCache:
+    def __init__(
+        self,
+        embedding_store: KGEmbeddingStore,
+        entity_groups: EntityGroups = None,
+        max_size: int = 64,
+    ):
+        """Builds `RowFilter`s for one model, keeping the most recently used so that repeated filters (e.g. the same
+        namespace) aren't rebuilt for every request.
+
+        Args:
+            embedding_store (KGEmbeddingStore)
+            entity_groups (EntityGroups, optional): group mappings to filter by. Defaults to None (filter by namespace
+                only).
+            max_size (int, optional): number of filters to keep. Defaults to 64.
+        """
+        self.embedding_store = embedding_store
+        self.entity_groups = entity_groups
+        self.max_size = max_size
+        self._filters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, namespace: str = None, groups: Dict[str, List[str]] = None
+    ) -> RowFilter:
+        """Filter to entities whose values start with `namespace` and, for each mapping in `groups`, which are in one
+        of the listed groups.
+
+        Raises:
+            UnknownGroupsError: if a mapping or group in `groups` doesn't exist
+        """
+        groups = groups or {}
+        key = (
+            namespace,
+            tuple(
+                sorted((name, tuple(sorted(values))) for name, values in groups.items())
+            ),
+        )
+
+        with self._lock:
+            if key in self._filters:
+                self._filters.move_to_end(key)
+                return self._filters[key]
+
+        if groups and self.entity_groups is None:
+            raise UnknownGroupsError("No group mappings are loaded for this model")
+
+        mask = np.zeros(self.embedding_store.ent_embedding_matrix.shape[0], dtype=bool)
+        mask[self.embedding_store.entity_idxs_with_prefix(namespace)] = True
+
+        for name, values in groups.items():
+            mask &= self.entity_groups.mask(name, values)
+
+        row_filter = RowFilter(mask)
+
+        with self._lock:
+            self._filters[key] = row_filter
+            while len(self._filters) > self.max_size:
+                self._filters.popitem(last=False)
+
+        return row_filter
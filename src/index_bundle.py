@@ -0,0 +1,177 @@
+"""
+Submodule for saving and loading index bundles: a folder containing everything the API needs to serve a model (the
+embeddings matrices, their mappings and a fitted Faiss index), so that nothing has to be rebuilt when it starts.
+"""
+
+import csv
+import datetime
+import hashlib
+import json
+import os
+from typing import Tuple
+import numpy as np
+from src.embedding_store import KGEmbeddingStore, load_embeddings_matrix, load_mapping
+from src.nearest_neighbours import FaissNearestNeighbours
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+BUNDLE_FILE_NAMES = {
+    "entity_embeddings": "entity_embeddings.npy",
+    "relation_embeddings": "relation_embeddings.npy",
+    "entity_mapping": "entities.tsv",
+    "relation_mapping": "relations.tsv",
+    "faiss_index": "faiss.index",
+}
+
+
+class BundleError(Exception):
+    """Raised when an index bundle is missing, incomplete, of an unsupported format or fails checksum verification."""
+
+
+def _sha256(path: str, block_size: int = 2**20) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def build_bundle(
+    nearest_neighbours: FaissNearestNeighbours,
+    output_folder: str,
+    model_name: str,
+) -> dict:
+    """Write a fitted `FaissNearestNeighbours` and its embedding store to a bundle folder.
+
+    The manifest is written last, so a folder without one is an incomplete bundle and won't be loaded.
+
+    Args:
+        nearest_neighbours (FaissNearestNeighbours): nearest neighbours instance, fitted on entities
+        output_folder (str): folder to write the bundle to. Created if it does not already exist.
+        model_name (str): name of the model the embeddings come from, stored in the manifest
+
+    Returns:
+        dict: the bundle manifest
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    embedding_store = nearest_neighbours.embedding_store
+    paths = {
+        name: os.path.join(output_folder, file_name)
+        for name, file_name in BUNDLE_FILE_NAMES.items()
+    }
+
+    np.save(
+        paths["entity_embeddings"],
+        np.ascontiguousarray(embedding_store.ent_embedding_matrix, dtype="float32"),
+    )
+    np.save(
+        paths["relation_embeddings"],
+        np.ascontiguousarray(embedding_store.rel_embedding_matrix, dtype="float32"),
+    )
+    embedding_store.ent_mapping.to_csv(
+        paths["entity_mapping"], sep="\t", header=False, quoting=csv.QUOTE_NONE
+    )
+    embedding_store.rel_mapping.to_csv(
+        paths["relation_mapping"], sep="\t", header=False, quoting=csv.QUOTE_NONE
+    )
+    nearest_neighbours.save(paths["faiss_index"])
+
+    files = {
+        name: {
+            "file_name": BUNDLE_FILE_NAMES[name],
+            "sha256": _sha256(path),
+            "bytes": os.path.getsize(path),
+        }
+        for name, path in paths.items()
+    }
+
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "model_name": model_name,
+        # Identifies the exact contents of the bundle, e.g. to tell whether a model has changed.
+        "version": hashlib.sha256(
+            "".join(files[name]["sha256"] for name in sorted(files)).encode()
+        ).hexdigest()[:12],
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "num_entities": int(embedding_store.ent_embedding_matrix.shape[0]),
+        "num_relations": int(embedding_store.rel_embedding_matrix.shape[0]),
+        "entity_dim": int(embedding_store.entity_dim),
+        "relation_dim": int(embedding_store.relation_dim),
+        "index_params": nearest_neighbours.get_params(),
+        "files": files,
+    }
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    return manifest
+
+
+def read_manifest(bundle_folder: str) -> dict:
+    """Read and validate the manifest of the bundle in `bundle_folder`."""
+    manifest_path = os.path.join(bundle_folder, MANIFEST_FILE_NAME)
+
+    if not os.path.exists(manifest_path):
+        raise BundleError(f"No {MANIFEST_FILE_NAME} in {bundle_folder}.")
+
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise BundleError(
+            f"Bundle format version {manifest.get('format_version')} is not supported (expected {BUNDLE_FORMAT_VERSION})."
+        )
+
+    return manifest
+
+
+def verify_bundle(bundle_folder: str, manifest: dict = None):
+    """Check the files in a bundle against the checksums in its manifest, raising a `BundleError` if any don't match."""
+    manifest = manifest or read_manifest(bundle_folder)
+
+    for name, file_info in manifest["files"].items():
+        path = os.path.join(bundle_folder, file_info["file_name"])
+        if not os.path.exists(path) or _sha256(path) != file_info["sha256"]:
+            raise BundleError(f"Checksum of {name} ({path}) does not match manifest.")
+
+
+def load_bundle(
+    bundle_folder: str, mmap: bool = True, verify_checksums: bool = False
+) -> Tuple[FaissNearestNeighbours, dict]:
+    """Load a bundle written by `build_bundle`.
+
+    Args:
+        bundle_folder (str): folder containing the bundle
+        mmap (bool, optional): memory-map the embeddings matrices and, where supported, the Faiss index. Defaults to True.
+        verify_checksums (bool, optional): check every file against the manifest before loading. This reads every file
+            in full so is off by default. Defaults to False.
+
+    Returns:
+        Tuple[FaissNearestNeighbours, dict]: fitted nearest neighbours (with its embedding store as `.embedding_store`), and the bundle manifest
+    """
+    manifest = read_manifest(bundle_folder)
+
+    if verify_checksums:
+        verify_bundle(bundle_folder, manifest)
+
+    paths = {
+        name: os.path.join(bundle_folder, file_info["file_name"])
+        for name, file_info in manifest["files"].items()
+    }
+
+    embedding_store = KGEmbeddingStore(
+        ent_embeddings=load_embeddings_matrix(paths["entity_embeddings"], mmap=mmap),
+        ent_mapping=load_mapping(paths["entity_mapping"]),
+        rel_embeddings=load_embeddings_matrix(paths["relation_embeddings"], mmap=mmap),
+        rel_mapping=load_mapping(paths["relation_mapping"]),
+    )
+    nearest_neighbours = FaissNearestNeighbours.load(
+        embedding_store, paths["faiss_index"], mmap=mmap, **manifest["index_params"]
+    )
+
+    return nearest_neighbours, manifest
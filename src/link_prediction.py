@@ -0,0 +1,270 @@
+"""
+Submodule for predicting links (head, relation, ?) and (?, relation, tail) by scoring every entity with the
+interaction function of the model that produced the embeddings.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Iterable, List, Tuple
+import numpy as np
+from src.embedding_store import KGEmbeddingStore
+
+# DGL-KE model names. As in DGL-KE, "TransE" is TransE_l2.
+SCORING_MODELS = ("RotatE", "TransE", "TransE_l1", "TransE_l2", "DistMult")
+_TRANSE_P_NORMS = {"TransE_l1": 1, "TransE_l2": 2}
+
+
+def _top_k(
+    scores: np.ndarray, idxs: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """The `k` highest of each row of `scores` in descending order, with the corresponding `idxs`. Only the top `k`
+    are sorted, after selecting them with a partial sort.
+    """
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, top, axis=1)
+        idxs = np.take_along_axis(idxs, top, axis=1)
+
+    order = np.argsort(-scores, axis=1, kind="stable")
+
+    return (
+        np.take_along_axis(scores, order, axis=1),
+        np.take_along_axis(idxs, order, axis=1),
+    )
+
+
+class LinkPredictor:
+    def __init__(
+        self,
+        embedding_store: KGEmbeddingStore,
+        model: str = "RotatE",
+        gamma: float = 12.0,
+        p_norm: int = None,
+        block_size: int = 10_000,
+        num_threads: int = None,
+    ):
+        """Score candidate heads or tails for (head, relation, ?) and (?, relation, tail) queries against every entity.
+
+        Scores use the DGL-KE definitions of each model's interaction function, and higher scores are more plausible:
+        - RotatE: gamma - sum(|h * r - t|), where entities are complex vectors stored as [real parts, imaginary parts]
+            and relations are phases, rescaled by (gamma + 2) / relation_dim as they are by DGL-KE
+        - TransE: gamma - ||h + r - t||, using the L1 norm for TransE_l1 and the L2 norm for TransE_l2 (or TransE)
+        - DistMult: sum(h * r * t)
+
+        Each query is reduced to a single vector that is compared with every entity (e.g. h * r for RotatE tails, and
+        t * conj(r) for RotatE heads, as rotations preserve distances). The entity matrix is scored in blocks of
+        `block_size` rows, which bounds memory use, and the blocks are spread across `num_threads` threads. The top k
+        of each block are selected with a partial sort and merged.
+
+        Args:
+            embedding_store (KGEmbeddingStore): entity and relation embeddings
+            model (str, optional): DGL-KE model name, one of "RotatE", "TransE_l1", "TransE_l2", "TransE" (the same as
+                "TransE_l2") or "DistMult". Defaults to "RotatE".
+            gamma (float, optional): margin the model was trained with. Defaults to 12.0 (DGL-KE's default for RotatE).
+            p_norm (int, optional): norm used by TransE, 1 or 2. Defaults to None (the norm in the model name, or 2).
+            block_size (int, optional): number of entities scored at a time by each thread. Defaults to 10_000.
+            num_threads (int, optional): number of threads. Defaults to None (one per core).
+        """
+        if model not in SCORING_MODELS:
+            raise ValueError(
+                f"Argument `model` must be one of {SCORING_MODELS}; got '{model}'."
+            )
+
+        if model in _TRANSE_P_NORMS:
+            if p_norm is not None and p_norm != _TRANSE_P_NORMS[model]:
+                raise ValueError(
+                    f"Argument `p_norm` must match the norm of {model}; got {p_norm}."
+                )
+            model, p_norm = "TransE", _TRANSE_P_NORMS[model]
+
+        # DGL-KE's "TransE" uses the L2 norm.
+        p_norm = 2 if p_norm is None else p_norm
+        if p_norm not in (1, 2):
+            raise ValueError(f"Argument `p_norm` must be 1 or 2; got {p_norm}.")
+
+        expected_relation_dim = (
+            embedding_store.entity_dim // 2
+            if model == "RotatE"
+            else embedding_store.entity_dim
+        )
+        if embedding_store.relation_dim != expected_relation_dim:
+            raise ValueError(
+                f"{model} needs relation embeddings of dimension {expected_relation_dim} for entity embeddings of dimension {embedding_store.entity_dim}; got {embedding_store.relation_dim}."
+            )
+
+        self.embedding_store = embedding_store
+        self.model = model
+        self.gamma = gamma
+        self.p_norm = p_norm
+        self.block_size = block_size
+        self.num_threads = num_threads or os.cpu_count()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.num_threads, thread_name_prefix="link-prediction"
+        )
+
+    def _relation_vectors(self, relation_idxs: np.ndarray) -> np.ndarray:
+        relations = np.asarray(
+            self.embedding_store.rel_embedding_matrix[relation_idxs], dtype=np.float32
+        )
+
+        if self.model == "RotatE":
+            # DGL-KE stores RotatE relations scaled by the embedding initialisation range.
+            phases = relations * (
+                np.pi * self.embedding_store.relation_dim / (self.gamma + 2.0)
+            )
+            return np.cos(phases) + 1j * np.sin(phases)
+
+        return relations
+
+    def _entity_vectors(self, entity_idxs) -> np.ndarray:
+        entities = np.asarray(
+            self.embedding_store.ent_embedding_matrix[entity_idxs], dtype=np.float32
+        )
+
+        if self.model == "RotatE":
+            half = entities.shape[1] // 2
+            return entities[:, :half] + 1j * entities[:, half:]
+
+        return entities
+
+    def _query_vectors(
+        self, entity_idxs: np.ndarray, relation_idxs: np.ndarray, predict: str
+    ) -> np.ndarray:
+        """The vectors that candidate entities are compared with, for queries (entity, relation, ?) if `predict` is
+        "tails" and (?, relation, entity) if it's "heads".
+        """
+        entities = self._entity_vectors(entity_idxs)
+        relations = self._relation_vectors(relation_idxs)
+
+        if self.model == "RotatE":
+            return entities * (relations if predict == "tails" else np.conj(relations))
+
+        if self.model == "TransE":
+            return entities + relations if predict == "tails" else entities - relations
+
+        return entities * relations
+
+    def _score_block(self, queries: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """Scores of shape (len(queries), len(candidates))."""
+        if self.model == "DistMult":
+            return queries @ candidates.T
+
+        if self.model == "TransE" and self.p_norm == 2:
+            # ||q - c||^2 = ||q||^2 + ||c||^2 - 2qc, clipped as rounding errors can make it slightly negative.
+            sq_distances = (
+                np.einsum("ij,ij->i", queries, queries)[:, np.newaxis]
+                + np.einsum("ij,ij->i", candidates, candidates)  # noqa: W503
+                - 2 * queries @ candidates.T  # noqa: W503
+            )
+            return self.gamma - np.sqrt(np.maximum(sq_distances, 0))
+
+        # L1 distances (sum of complex moduli for RotatE) have no matrix product form, so are computed one query at a
+        # time to keep memory use to one block.
+        scores = np.empty((queries.shape[0], candidates.shape[0]), dtype=np.float32)
+        for row, query in enumerate(queries):
+            scores[row] = self.gamma - np.abs(candidates - query).sum(axis=1)
+
+        return scores
+
+    def _top_k_in_block(
+        self, queries: np.ndarray, start: int, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        block = slice(start, start + self.block_size)
+        scores = self._score_block(queries, self._entity_vectors(block))
+        idxs = np.broadcast_to(
+            np.arange(block.start, block.start + scores.shape[1]), scores.shape
+        )
+
+        return _top_k(scores, idxs, k)
+
+    def _predict(
+        self,
+        entities: Iterable[str],
+        relations: Iterable[str],
+        predict: str,
+        k: int,
+    ) -> Tuple[List[List[str]], np.ndarray]:
+        entity_idxs = self.embedding_store.entities_to_idxs(entities)
+        relation_idxs = self.embedding_store.relations_to_idxs(relations)
+
+        if len(entity_idxs) != len(relation_idxs):
+            raise ValueError(
+                f"The same number of entities and relations must be given; got {len(entity_idxs)} and {len(relation_idxs)}."
+            )
+
+        queries = self._query_vectors(entity_idxs, relation_idxs, predict)
+        num_entities = self.embedding_store.ent_embedding_matrix.shape[0]
+        k = min(k, num_entities)
+
+        block_results = list(
+            self._executor.map(
+                lambda start: self._top_k_in_block(queries, start, k),
+                range(0, num_entities, self.block_size),
+            )
+        )
+        scores, idxs = _top_k(
+            np.concatenate([scores for scores, _ in block_results], axis=1),
+            np.concatenate([idxs for _, idxs in block_results], axis=1),
+            k,
+        )
+
+        return self.embedding_store.idxs_to_entities(idxs), scores
+
+    def predict_tails(
+        self, heads: Iterable[str], relations: Iterable[str], k: int = 10
+    ) -> Tuple[List[List[str]], np.ndarray]:
+        """Get the `k` highest scoring tails for each query (`heads[i]`, `relations[i]`, ?).
+
+        Raises:
+            UnknownValuesError: if any of the entities or relations aren't in the store
+
+        Returns:
+            Tuple[List[List[str]], np.ndarray]: tails for each query, and a matrix of their scores in descending order
+        """
+        return self._predict(heads, relations, "tails", k)
+
+    def predict_heads(
+        self, relations: Iterable[str], tails: Iterable[str], k: int = 10
+    ) -> Tuple[List[List[str]], np.ndarray]:
+        """Get the `k` highest scoring heads for each query (?, `relations[i]`, `tails[i]`).
+
+        Raises:
+            UnknownValuesError: if any of the entities or relations aren't in the store
+
+        Returns:
+            Tuple[List[List[str]], np.ndarray]: heads for each query, and a matrix of their scores in descending order
+        """
+        return self._predict(tails, relations, "heads", k)
+
+    def score_triples(
+        self,
+        heads: Iterable[str],
+        relations: Iterable[str],
+        tails: Iterable[str],
+    ) -> np.ndarray:
+        """Get the score of each triple (`heads[i]`, `relations[i]`, `tails[i]`).
+
+        Raises:
+            UnknownValuesError: if any of the entities or relations aren't in the store
+
+        Returns:
+            np.ndarray: float32 array of scores, in the order of the triples
+        """
+        queries = self._query_vectors(
+            self.embedding_store.entities_to_idxs(heads),
+            self.embedding_store.relations_to_idxs(relations),
+            "tails",
+        )
+        tails = self._entity_vectors(self.embedding_store.entities_to_idxs(tails))
+
+        if self.model == "DistMult":
+            return np.einsum("ij,ij->i", queries, tails)
+
+        distances = (
+            np.linalg.norm(queries - tails, axis=1)
+            if self.model == "TransE" and self.p_norm == 2
+            else np.abs(queries - tails).sum(axis=1)
+        )
+
+        return (self.gamma - distances).astype(np.float32)
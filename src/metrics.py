@@ -0,0 +1,262 @@
+"""
+Submodule for recording API metrics and rendering them in the Prometheus text format, and for timing the stages of
+each request.
+
+Code on a request's path wraps each stage in `timed_stage`, which records its duration in the `stage_seconds`
+histogram and, if a request is being tracked (see `track_request`), in that request's breakdown of stages.
+"""
+
+from contextlib import contextmanager
+import contextvars
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple) -> str:
+    if not labelnames:
+        return ""
+
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in zip(labelnames, labelvalues)
+    )
+
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        """A value that only goes up, e.g. a number of requests, per combination of label values."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                )
+
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        """Counts of observations (e.g. durations in seconds) falling into cumulative buckets, with their sum and
+        count, per combination of label values.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+
+            for idx, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    values[idx] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        labelnames = self.labelnames + ("le",)
+
+        with self._lock:
+            for key, values in sorted(self._values.items()):
+                for upper_bound, count in zip(
+                    self.buckets + (float("inf"),), values[:-2] + [values[-1]]
+                ):
+                    labels = _format_labels(
+                        labelnames, key + (_format_value(upper_bound),)
+                    )
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(values[-2])}")
+                lines.append(f"{self.name}_count{labels} {values[-1]}")
+
+        return lines
+
+
+class GaugeCollector:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect_fn: Callable[[], Dict[Tuple, float]],
+        labelnames: Iterable[str] = (),
+    ):
+        """Values read when metrics are rendered, e.g. memory use or the size of a cache.
+
+        Args:
+            name (str): metric name
+            documentation (str): help text
+            collect_fn (Callable[[], Dict[Tuple, float]]): function returning the current value for each combination
+                of label values. Return `{(): value}` if there are no labels.
+            labelnames (Iterable[str], optional): Defaults to ().
+        """
+        self.name = name
+        self.documentation = documentation
+        self.collect_fn = collect_fn
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        for key, value in self.collect_fn().items():
+            if value is not None:
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                )
+
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "hc_vectors"):
+        """A set of metrics, rendered together in the Prometheus text format. Metric names are prefixed with `prefix`."""
+        self.prefix = prefix
+        self._metrics = {}
+
+    def _register(self, metric):
+        metric.name = f"{self.prefix}_{metric.name}"
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(
+        self, name: str, documentation: str, collect_fn, labelnames=()
+    ) -> GaugeCollector:
+        """Register a gauge whose values are read by `collect_fn` when metrics are rendered. Registering a gauge with
+        the same name again replaces it.
+        """
+        return self._register(
+            GaugeCollector(name, documentation, collect_fn, labelnames)
+        )
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_seconds",
+    "Time spent in each stage of serving requests.",
+    labelnames=("stage",),
+)
+
+# Per-request breakdown of time spent in each stage, set by `track_request`.
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Time the code in the `with` block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+
+        stages = _request_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+def track_request() -> Dict[str, float]:
+    """Start collecting a breakdown of stage durations for the current request, returning the dict that they're
+    added to. Stages timed in the same context (including threads the context is copied to) are included.
+
+    Stages run by another task or an executor that doesn't copy the context, such as Faiss searches run by the search
+    batcher, aren't included in the breakdown, but the time waited for them can be timed as a stage of the request.
+    """
+    stages = {}
+    _request_stages.set(stages)
+
+    return stages
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Resident set size of this process, or None if it isn't available (only Linux is supported)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
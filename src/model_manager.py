@@ -0,0 +1,293 @@
+"""
+Submodule for swapping the model served by the API without restarting it.
+"""
+
+import asyncio
+import datetime
+from functools import partial
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Hashable, List, Optional, Tuple
+import numpy as np
+from src.batching import SearchBatcher
+from src.clustering import ClusterLabels
+from src.embedding_store import KGEmbeddingStore
+from src.entity_filters import EntityGroups, RowFilter, RowFilterCache
+from src.index_bundle import MANIFEST_FILE_NAME
+from src.link_prediction import LinkPredictor
+from src.metrics import timed_stage
+from src.nearest_neighbours import FaissNearestNeighbours
+from src.neighbour_table import NeighbourTable
+from src.cli.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class ServingModel:
+    def __init__(
+        self,
+        nearest_neighbours: FaissNearestNeighbours,
+        version: str,
+        neighbour_table: NeighbourTable = None,
+        link_predictor: LinkPredictor = None,
+        source: str = None,
+        entity_groups: EntityGroups = None,
+        cluster_labels: ClusterLabels = None,
+        **batcher_kwargs,
+    ):
+        """One loaded version of a model, with everything needed to serve requests from it.
+
+        Request handlers should get the model once (`ModelManager.current`) and use it for the whole request, so that
+        a request which is in flight when the model is swapped finishes on the model it started on.
+
+        Args:
+            nearest_neighbours (FaissNearestNeighbours): fitted index (or `ShardedNearestNeighbours`), whose embedding
+                store is used for lookups
+            version (str): version of the model, reported in responses and used to key caches
+            neighbour_table (NeighbourTable, optional): precomputed neighbours for this version. Defaults to None.
+            link_predictor (LinkPredictor, optional): scores links with this version's embeddings. Defaults to None.
+            source (str, optional): where the model was loaded from, e.g. a bundle folder. Defaults to None.
+            entity_groups (EntityGroups, optional): group mappings that searches can be filtered by. Defaults to None.
+            cluster_labels (ClusterLabels, optional): cluster of each entity. Defaults to None.
+            **batcher_kwargs: passed to the `SearchBatcher` that batches this model's Faiss searches
+        """
+        self.nearest_neighbours = nearest_neighbours
+        self.version = version
+        self.neighbour_table = neighbour_table
+        self.link_predictor = link_predictor
+        self.source = source
+        self.cluster_labels = cluster_labels
+        self.loaded_at = datetime.datetime.now().isoformat(timespec="seconds")
+        self.search_batcher = SearchBatcher(
+            nearest_neighbours.search_vectors, **batcher_kwargs
+        )
+        self.row_filters = RowFilterCache(self.embedding_store, entity_groups)
+
+        # Release the index's resources (e.g. the connections of `ShardedNearestNeighbours`) once the model has been
+        # swapped out and the last request using it has finished, or on `close`.
+        self._finalizer = weakref.finalize(
+            self, getattr(nearest_neighbours, "close", lambda: None)
+        )
+
+    def close(self):
+        self._finalizer()
+
+    @property
+    def embedding_store(self) -> KGEmbeddingStore:
+        return self.nearest_neighbours.embedding_store
+
+    async def search_neighbours(
+        self, entities: List[str], k: int, row_filter: RowFilter = None
+    ) -> Tuple[list, np.ndarray]:
+        """Get the `k` nearest neighbours of each of `entities`, from the neighbour table if it stores enough neighbours
+        and otherwise from the Faiss index via the search batcher. Returns the same as `FaissNearestNeighbours.search`.
+
+        Searches filtered by `row_filter` can't share a batch with other searches, so they're run on their own.
+        """
+        if row_filter is not None:
+            xq = self.embedding_store.get_entity_embeddings(entities)
+
+            with timed_stage("filtered_search"):
+                distances, idxs = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    partial(
+                        self.nearest_neighbours.search_vectors,
+                        xq,
+                        k,
+                        row_filter=row_filter,
+                    ),
+                )
+        elif self.neighbour_table is not None and k <= self.neighbour_table.width:
+            entity_idxs = self.embedding_store.entities_to_idxs(entities)
+
+            with timed_stage("neighbour_table_lookup"):
+                distances, idxs = self.neighbour_table.lookup(entity_idxs, k)
+        else:
+            xq = self.embedding_store.get_entity_embeddings(entities)
+
+            # Includes waiting for the batch to be run, as well as the search itself.
+            with timed_stage("batched_search"):
+                distances, idxs = await self.search_batcher.search(xq, k)
+
+        return self.embedding_store.idxs_to_entities(idxs), distances
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "num_entities": self.embedding_store.ent_embedding_matrix.shape[0],
+            "index_params": self.nearest_neighbours.get_params(),
+            "neighbour_table": self.neighbour_table is not None,
+            "group_mappings": (
+                self.row_filters.entity_groups.names
+                if self.row_filters.entity_groups
+                else []
+            ),
+            "num_clusters": (
+                self.cluster_labels.num_clusters if self.cluster_labels else None
+            ),
+            "link_prediction_model": (
+                self.link_predictor.model if self.link_predictor else None
+            ),
+        }
+
+
+class ModelManager:
+    def __init__(self, load_fn: Callable[[Optional[str]], ServingModel], source=None):
+        """Hold the model being served, and replace it with a newly loaded one without interrupting requests.
+
+        A reload loads and indexes the new model in a background thread while the current one keeps serving, then
+        swaps the reference to it in one assignment. Requests that already hold the old model finish on it, and it's
+        released once the last of them does.
+
+        The first model is loaded synchronously when the manager is created.
+
+        Args:
+            load_fn (Callable[[Optional[str]], ServingModel]): function which loads a model from a source (e.g. an
+                index bundle folder), or from its default source if passed None
+            source (optional): source to load the first model from. Defaults to None.
+        """
+        self.load_fn = load_fn
+        self.source = source
+
+        self._current = load_fn(source)
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self._watch_thread = None
+        self._stop_watching = threading.Event()
+
+        self.num_reloads = 0
+        self.last_reload = None
+        self.last_error = None
+
+        logger.info(f"Serving model version {self._current.version}")
+
+    @property
+    def current(self) -> ServingModel:
+        return self._current
+
+    @property
+    def reloading(self) -> bool:
+        return self._reload_thread is not None and self._reload_thread.is_alive()
+
+    @property
+    def watching(self) -> bool:
+        return self._watch_thread is not None and self._watch_thread.is_alive()
+
+    def reload(self, source=None, wait: bool = False) -> bool:
+        """Load a model in the background and swap it in once it's ready.
+
+        Args:
+            source (optional): source to load the model from. Defaults to None (the source of the current model).
+            wait (bool, optional): block until the reload has finished. Defaults to False.
+
+        Returns:
+            bool: whether a reload was started. It isn't if another reload is still in progress.
+        """
+        with self._reload_lock:
+            if self.reloading:
+                return False
+
+            self._reload_thread = threading.Thread(
+                target=self._reload,
+                args=(source if source is not None else self.source,),
+                name="model-reload",
+                daemon=True,
+            )
+            self._reload_thread.start()
+
+        if wait:
+            self._reload_thread.join()
+
+        return True
+
+    def _reload(self, source):
+        start = time.perf_counter()
+        logger.info(f"Loading model from {source or 'default source'}")
+
+        try:
+            model = self.load_fn(source)
+        except Exception as e:
+            logger.exception(
+                f"Failed to load model from {source}. Still serving version {self._current.version}"
+            )
+            self.last_error = repr(e)
+            return
+
+        old_version = self._current.version
+        # Requests read `current` once, so this is the only point at which they switch to the new model.
+        self._current = model
+        self.source = source
+        self.num_reloads += 1
+        self.last_error = None
+        self.last_reload = datetime.datetime.now().isoformat(timespec="seconds")
+
+        logger.info(
+            f"Swapped model version {old_version} for {model.version} in {time.perf_counter() - start:.1f}s"
+        )
+
+    def watch(
+        self,
+        fingerprint_fn: Callable[[], Optional[Hashable]],
+        source=None,
+        interval: float = 60.0,
+    ):
+        """Reload whenever the fingerprint of the files the model is loaded from changes.
+
+        Args:
+            fingerprint_fn (Callable[[], Optional[Hashable]]): function returning a fingerprint of the model files (e.g.
+                `bundle_fingerprint`), or None if they aren't ready to load
+            source (optional): source to reload from. Defaults to None (the source of the current model).
+            interval (float, optional): number of seconds between checks. Defaults to 60.0.
+        """
+        self._stop_watching.clear()
+        last_fingerprint = fingerprint_fn()
+
+        def _watch():
+            nonlocal last_fingerprint
+
+            while not self._stop_watching.wait(interval):
+                try:
+                    fingerprint = fingerprint_fn()
+                except OSError:
+                    continue
+
+                if fingerprint is not None and fingerprint != last_fingerprint:
+                    logger.info("Model files changed, reloading")
+                    if self.reload(source):
+                        last_fingerprint = fingerprint
+
+        self._watch_thread = threading.Thread(
+            target=_watch, name="model-watch", daemon=True
+        )
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        self._stop_watching.set()
+
+    def status(self) -> dict:
+        return {
+            "model": self._current.info(),
+            "reloading": self.reloading,
+            "reloads": self.num_reloads,
+            "last_reload": self.last_reload,
+            "last_error": self.last_error,
+            "watching": self.watching,
+        }
+
+
+def bundle_fingerprint(bundle_path: str) -> Optional[Tuple[str, float]]:
+    """Resolved path and manifest modification time of an index bundle, or None if it has no manifest (e.g. because
+    it's being built). Bundles should be built into a new folder and published by switching a symlink, rather than
+    rebuilt in place, as the model being served may have their files memory-mapped.
+    """
+    resolved_path = os.path.realpath(bundle_path)
+    manifest_path = os.path.join(resolved_path, MANIFEST_FILE_NAME)
+
+    if not os.path.exists(manifest_path):
+        return None
+
+    return resolved_path, os.path.getmtime(manifest_path)
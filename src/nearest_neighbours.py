@@ -4,19 +4,115 @@ Submodule for finding nearest neighbours.
 
 from typing import Iterable, Tuple
 import faiss
+import numpy as np
 from src.embedding_store import KGEmbeddingStore
+from src.entity_filters import RowFilter
+from src.metrics import timed_stage
+
+INDEX_TYPES = ("flat", "ivfflat", "ivfpq", "hnsw")
+
+# Filtered searches of approximate indexes which find fewer than k matches are repeated up to this many times, each
+# time visiting this many times as many inverted lists (nprobe) or HNSW nodes (efSearch).
+FILTER_MAX_WIDENINGS = 3
+FILTER_WIDENING_FACTOR = 4
 
 
 class FaissNearestNeighbours:
-    def __init__(self, embedding_store: KGEmbeddingStore):
-        """Create a wrapper around a Faiss IndexFlatL2, which gets nearest neighbours based on Euclidean distance
+    def __init__(
+        self,
+        embedding_store: KGEmbeddingStore,
+        index_type: str = "flat",
+        nlist: int = 1024,
+        pq_m: int = 16,
+        pq_nbits: int = 8,
+        hnsw_m: int = 32,
+        ef_construction: int = 40,
+        nprobe: int = 8,
+        ef_search: int = 64,
+        train_sample_size: int = None,
+        random_state: int = 42,
+        filter_exact_max_rows: int = 20_000,
+    ):
+        """Create a wrapper around a Faiss index, which gets nearest neighbours based on Euclidean distance.
+        By default this is an exact IndexFlatL2; `index_type` can be used to choose an approximate index instead.
 
         Args:
             embedding_store (KGEmbeddingStore): initialised `embedding_store.KGEmbeddingStore`
+            index_type (str, optional): one of "flat" (exact), "ivfflat", "ivfpq" or "hnsw". Defaults to "flat".
+            nlist (int, optional): number of inverted lists (IVF indexes only). Defaults to 1024.
+            pq_m (int, optional): number of product quantizer subvectors, which must divide the embedding dimension
+                (IVF-PQ only). Defaults to 16.
+            pq_nbits (int, optional): bits per product quantizer code (IVF-PQ only). Defaults to 8.
+            hnsw_m (int, optional): number of neighbours per node in the HNSW graph (HNSW only). Defaults to 32.
+            ef_construction (int, optional): search depth when building the HNSW graph (HNSW only). Defaults to 40.
+            nprobe (int, optional): number of inverted lists visited at search time (IVF indexes only). Defaults to 8.
+            ef_search (int, optional): search depth at search time (HNSW only). Defaults to 64.
+            train_sample_size (int, optional): number of vectors to train IVF indexes on. Defaults to None (all vectors).
+            random_state (int, optional): seed used to draw the training sample. Defaults to 42.
+            filter_exact_max_rows (int, optional): filtered searches matching at most this many entities search their
+                embeddings exactly rather than searching the index. Defaults to 20_000.
         """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(
+                f"Argument `index_type` must be one of {INDEX_TYPES}; got '{index_type}'."
+            )
+
         self.embedding_store = embedding_store
+        self.index_type = index_type
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_sample_size = train_sample_size
+        self.random_state = random_state
+        self.filter_exact_max_rows = filter_exact_max_rows
         self.faiss_index = None
 
+    def get_params(self) -> dict:
+        """Get the parameters this instance was configured with (excluding the embedding store)."""
+        return {
+            "index_type": self.index_type,
+            "nlist": self.nlist,
+            "pq_m": self.pq_m,
+            "pq_nbits": self.pq_nbits,
+            "hnsw_m": self.hnsw_m,
+            "ef_construction": self.ef_construction,
+            "nprobe": self.nprobe,
+            "ef_search": self.ef_search,
+            "train_sample_size": self.train_sample_size,
+            "random_state": self.random_state,
+            "filter_exact_max_rows": self.filter_exact_max_rows,
+        }
+
+    def _create_index(self, dim: int) -> faiss.Index:
+        if self.index_type == "flat":
+            return faiss.IndexFlatL2(dim)
+
+        if self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m)
+            index.hnsw.efConstruction = self.ef_construction
+            return index
+
+        quantizer = faiss.IndexFlatL2(dim)
+
+        if self.index_type == "ivfflat":
+            return faiss.IndexIVFFlat(quantizer, dim, self.nlist)
+
+        return faiss.IndexIVFPQ(quantizer, dim, self.nlist, self.pq_m, self.pq_nbits)
+
+    def _get_training_sample(self, X: np.ndarray) -> np.ndarray:
+        if not self.train_sample_size or self.train_sample_size >= X.shape[0]:
+            return X
+
+        rnd = np.random.RandomState(self.random_state)
+        # Sorted rows so that reading from a memory-mapped matrix is sequential.
+        rows = np.sort(rnd.choice(X.shape[0], self.train_sample_size, replace=False))
+
+        return X[rows]
+
     def fit(self, entities_or_relations: str) -> "FaissNearestNeighbours":
         """Fit Faiss index using either entity or relation data.
 
@@ -32,11 +128,145 @@ class FaissNearestNeighbours:
                 "Argument `entities_or_relations` must be either 'entities' or 'relations'."
             )
 
-        self.faiss_index = faiss.IndexFlatL2(X.shape[1])
+        self.faiss_index = self._create_index(X.shape[1])
+
+        if not self.faiss_index.is_trained:
+            self.faiss_index.train(self._get_training_sample(X))
+
         self.faiss_index.add(X)
+        self.set_search_params()
 
         return self
 
+    def set_search_params(
+        self, nprobe: int = None, ef_search: int = None
+    ) -> "FaissNearestNeighbours":
+        """Change search-time parameters of a fitted index. Parameters which don't apply to the index type are ignored.
+
+        Args:
+            nprobe (int, optional): number of inverted lists visited (IVF indexes). Defaults to None (keep current value).
+            ef_search (int, optional): search depth (HNSW). Defaults to None (keep current value).
+        """
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+
+        if self.index_type in ("ivfflat", "ivfpq"):
+            self.faiss_index.nprobe = self.nprobe
+        elif self.index_type == "hnsw":
+            self.faiss_index.hnsw.efSearch = self.ef_search
+
+        return self
+
+    def save(self, path: str):
+        """Serialise the fitted Faiss index to `path`. Use `FaissNearestNeighbours.load` with the same parameters to load it."""
+        faiss.write_index(self.faiss_index, path)
+
+    @classmethod
+    def load(
+        cls,
+        embedding_store: KGEmbeddingStore,
+        path: str,
+        mmap: bool = False,
+        **params,
+    ) -> "FaissNearestNeighbours":
+        """Load a Faiss index saved with `FaissNearestNeighbours.save`, rather than fitting a new one.
+
+        Args:
+            embedding_store (KGEmbeddingStore): the embedding store the index was fitted on
+            path (str): path to the serialised index
+            mmap (bool, optional): memory-map the index file read-only where Faiss supports it for the index type. Defaults to False.
+            **params: the parameters the index was created with. See `FaissNearestNeighbours.get_params`.
+        """
+        nn = cls(embedding_store, **params)
+        io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        nn.faiss_index = faiss.read_index(path, io_flags)
+        nn.set_search_params()
+
+        return nn
+
+    def _search_params(
+        self, selector: faiss.IDSelector, scale: int = 1
+    ) -> faiss.SearchParameters:
+        # Search parameters replace those set on the index, so the index's search-time parameters are passed too.
+        if self.index_type in ("ivfflat", "ivfpq"):
+            return faiss.SearchParametersIVF(
+                sel=selector, nprobe=min(self.nprobe * scale, self.nlist)
+            )
+
+        if self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(
+                sel=selector, efSearch=self.ef_search * scale
+            )
+
+        return faiss.SearchParameters(sel=selector)
+
+    def _search_rows(
+        self, xq: np.ndarray, k: int, rows: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact search of the entity embeddings in `rows`."""
+        xb = np.ascontiguousarray(
+            self.embedding_store.ent_embedding_matrix[rows], dtype="float32"
+        )
+        distances, idxs = faiss.knn(xq, xb, k)
+
+        return distances, np.where(idxs < 0, -1, rows[np.maximum(idxs, 0)])
+
+    def search_vectors(
+        self, xq: np.ndarray, k: int, row_filter: RowFilter = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get `k` nearest neighbours for each row of a matrix of query vectors.
+
+        Filters are applied inside the search: small filters are searched exactly, and larger ones by passing the
+        filter to the index. Approximate indexes can find fewer than `k` matches for a query when the filter excludes
+        most of the vectors they visit, so those queries are searched again visiting more of the index (up to
+        `FILTER_WIDENING_FACTOR ** FILTER_MAX_WIDENINGS` times as many lists or graph nodes), and may still return
+        fewer than `k`.
+
+        Args:
+            xq (np.ndarray): float32 matrix of query vectors
+            k (int): number of nearest neighbours to return for each query
+            row_filter (RowFilter, optional): only return these rows (index fitted on entities only). Defaults to None.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: distances, idxs. Both have one row per query; idxs are rows of the embeddings
+                matrix, with -1 where fewer than `k` neighbours were found.
+        """
+        xq = np.ascontiguousarray(xq, dtype="float32")
+
+        with timed_stage("faiss_search"):
+            if row_filter is None:
+                return self.faiss_index.search(xq, k)
+
+            if len(row_filter) == 0:
+                return (
+                    np.full((xq.shape[0], k), np.inf, dtype="float32"),
+                    np.full((xq.shape[0], k), -1, dtype="int64"),
+                )
+
+            if len(row_filter) <= self.filter_exact_max_rows:
+                return self._search_rows(xq, k, row_filter.rows)
+
+            distances, idxs = self.faiss_index.search(
+                xq, k, params=self._search_params(row_filter.selector)
+            )
+
+            # Widen the search for queries that found fewer than k matches, rather than gathering every row of the
+            # filter for an exact search.
+            scale = 1
+            for _ in range(FILTER_MAX_WIDENINGS):
+                short = np.flatnonzero(idxs[:, -1] < 0)
+                if len(row_filter) < k or not len(short) or self.index_type == "flat":
+                    break
+
+                scale *= FILTER_WIDENING_FACTOR
+                distances[short], idxs[short] = self.faiss_index.search(
+                    xq[short], k, params=self._search_params(row_filter.selector, scale)
+                )
+
+            return distances, idxs
+
     def search(self, entities: Iterable[str], k: int) -> Tuple[list]:
         """Get `k` nearest neighbours for each entity in `entities`.
 
@@ -48,7 +278,7 @@ class FaissNearestNeighbours:
             Tuple[list]: entities, distances. Each is a list of lists where the order corresponds to the order of entities in the function call
         """
         xq = self.embedding_store.get_entity_embeddings(entities)
-        distances, idxs = self.faiss_index.search(xq, k)
-        entities = [self.embedding_store.idxs_to_entities(_) for _ in idxs]
+        distances, idxs = self.search_vectors(xq, k)
+        entities = self.embedding_store.idxs_to_entities(idxs)
 
         return entities, distances
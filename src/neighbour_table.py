@@ -0,0 +1,181 @@
+"""
+Submodule for precomputed nearest neighbour tables: the top-k neighbours of every entity, stored as fixed-width
+memory-mappable arrays so that neighbours can be looked up with a single row read rather than a search.
+"""
+
+import json
+import os
+from typing import Tuple
+import faiss
+import numpy as np
+from src.cli.log import get_logger
+
+logger = get_logger(__name__)
+
+NEIGHBOURS_FILE_NAME = "neighbours.npy"
+DISTANCES_FILE_NAME = "distances.npy"
+METADATA_FILE_NAME = "metadata.json"
+
+
+class NeighbourTable:
+    def __init__(self, neighbours: np.ndarray, distances: np.ndarray, metadata: dict):
+        """Nearest neighbours of every row of an embeddings matrix.
+
+        Args:
+            neighbours (np.ndarray): int32 matrix with one row per entity, and one column per neighbour in order of distance.
+                The first neighbour of each entity is normally the entity itself, as with a Faiss search.
+            distances (np.ndarray): float32 matrix of squared Euclidean distances corresponding to `neighbours`
+            metadata (dict): metadata written by `build_neighbour_table`
+        """
+        self.neighbours = neighbours
+        self.distances = distances
+        self.metadata = metadata
+
+    @property
+    def width(self) -> int:
+        """Number of neighbours stored for each entity (including the entity itself)."""
+        return self.neighbours.shape[1]
+
+    @property
+    def model_version(self) -> str:
+        return self.metadata.get("model_version")
+
+    def lookup(self, idxs: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the `k` nearest neighbours of each entity row in `idxs`, in the same form as `FaissNearestNeighbours.search_vectors`.
+
+        Args:
+            idxs (np.ndarray): rows of the entity embeddings matrix
+            k (int): number of neighbours to return for each row. Must be at most `width`.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: distances, idxs
+        """
+        if k > self.width:
+            raise ValueError(
+                f"Neighbour table only stores {self.width} neighbours per entity; {k} were requested."
+            )
+
+        return self.distances[idxs, :k], self.neighbours[idxs, :k].astype(np.int64)
+
+    @classmethod
+    def load(cls, folder: str) -> "NeighbourTable":
+        """Memory-map a complete neighbour table written by `build_neighbour_table`."""
+        metadata = _read_metadata(folder)
+
+        if not metadata or not metadata.get("complete"):
+            raise ValueError(
+                f"{folder} does not contain a complete neighbour table. Run (or resume) `build_neighbour_table` on it."
+            )
+
+        return cls(
+            neighbours=np.load(
+                os.path.join(folder, NEIGHBOURS_FILE_NAME), mmap_mode="r"
+            ),
+            distances=np.load(os.path.join(folder, DISTANCES_FILE_NAME), mmap_mode="r"),
+            metadata=metadata,
+        )
+
+
+def _read_metadata(folder: str) -> dict:
+    path = os.path.join(folder, METADATA_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_metadata(folder: str, metadata: dict):
+    # Write then rename, so that an interrupted build never leaves invalid metadata behind.
+    path = os.path.join(folder, METADATA_FILE_NAME)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(metadata, f, indent=4)
+    os.replace(f"{path}.tmp", path)
+
+
+def build_neighbour_table(
+    embeddings: np.ndarray,
+    output_folder: str,
+    k: int,
+    block_size: int = 10_000,
+    num_threads: int = None,
+    model_version: str = None,
+) -> NeighbourTable:
+    """Compute the exact `k` nearest neighbours of every row of `embeddings` in blocks of rows, and write them to a neighbour table.
+
+    Progress is recorded after each block, so if the build is interrupted calling this again with the same arguments
+    resumes from the first unfinished block.
+
+    Args:
+        embeddings (np.ndarray): float32 embeddings matrix, which can be memory-mapped
+        output_folder (str): folder to write the table to. Created if it does not already exist.
+        k (int): number of neighbours to store per entity. As an entity is normally its own nearest neighbour, this
+            should be one more than the number of neighbours to serve.
+        block_size (int, optional): number of query rows to search at a time. Defaults to 10_000.
+        num_threads (int, optional): number of threads for Faiss to use. Defaults to None (all cores).
+        model_version (str, optional): version of the model the embeddings come from, stored in the metadata. Defaults to None.
+
+    Returns:
+        NeighbourTable: the complete table
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    neighbours_path = os.path.join(output_folder, NEIGHBOURS_FILE_NAME)
+    distances_path = os.path.join(output_folder, DISTANCES_FILE_NAME)
+
+    if num_threads:
+        faiss.omp_set_num_threads(num_threads)
+
+    num_entities = embeddings.shape[0]
+    metadata = {
+        "k": k,
+        "num_entities": num_entities,
+        "block_size": block_size,
+        "model_version": model_version,
+    }
+    existing_metadata = _read_metadata(output_folder)
+
+    if existing_metadata and all(
+        existing_metadata.get(key) == value for key, value in metadata.items()
+    ):
+        metadata = existing_metadata
+        neighbours = np.load(neighbours_path, mmap_mode="r+")
+        distances = np.load(distances_path, mmap_mode="r+")
+        logger.info(
+            f"Resuming neighbour table: {len(metadata['completed_blocks'])} blocks already complete"
+        )
+    else:
+        metadata.update({"completed_blocks": [], "complete": False})
+        neighbours = np.lib.format.open_memmap(
+            neighbours_path, mode="w+", dtype=np.int32, shape=(num_entities, k)
+        )
+        distances = np.lib.format.open_memmap(
+            distances_path, mode="w+", dtype=np.float32, shape=(num_entities, k)
+        )
+        _write_metadata(output_folder, metadata)
+
+    completed_blocks = set(metadata["completed_blocks"])
+    block_starts = range(0, num_entities, block_size)
+
+    for block_num, start in enumerate(block_starts):
+        if block_num in completed_blocks:
+            continue
+
+        block = slice(start, start + block_size)
+        block_distances, block_idxs = faiss.knn(
+            np.ascontiguousarray(embeddings[block], dtype="float32"),
+            embeddings,
+            k,
+        )
+        neighbours[block] = block_idxs
+        distances[block] = block_distances
+        neighbours.flush()
+        distances.flush()
+
+        metadata["completed_blocks"].append(block_num)
+        _write_metadata(output_folder, metadata)
+        logger.info(f"Completed block {block_num + 1}/{len(block_starts)}")
+
+    metadata["complete"] = True
+    _write_metadata(output_folder, metadata)
+
+    return NeighbourTable.load(output_folder)
@@ -0,0 +1,430 @@
+"""
+Submodule for maintaining the 2D projection of the entity embeddings used by the d3fc visualisation, without
+refitting it every time the model changes.
+
+A `Layout` is the persisted projection: the x, y position of each entity, keyed by entity so that it survives rows
+being renumbered by a new model. `update_layout` keeps the positions of entities that are still in the model and
+haven't changed, and places new or changed entities at the distance-weighted mean position of their nearest unchanged
+neighbours in the new embeddings, in parallel batches. This is how UMAP initialises new points in `UMAP.transform`,
+but unlike `UMAP.transform` it doesn't need the new embeddings to be in the same space as the ones the projection was
+fitted on, which isn't true of a retrained model.
+
+The visualisation and colour mapping TSVs are keyed by row, so `update_group_mapping` and
+`update_visualisation_data` rewrite them for a new model a chunk at a time, keeping the rows (and labels) of entities
+that are still in the model rather than regenerating every row.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import datetime
+import json
+import os
+from typing import Dict, Iterable, Tuple
+import faiss
+import numpy as np
+import pandas as pd
+from src.embedding_store import KGEmbeddingStore, load_mapping
+
+LAYOUT_FILE_NAMES = {
+    "coordinates": "coordinates.npy",
+    "entities": "entities.tsv",
+    "info": "layout.json",
+}
+
+
+class Layout:
+    def __init__(
+        self, entities: np.ndarray, coordinates: np.ndarray, info: dict = None
+    ):
+        """Positions of entities in a 2D projection.
+
+        Args:
+            entities (np.ndarray): entity values
+            coordinates (np.ndarray): float32 array of shape (len(entities), 2)
+            info (dict, optional): information about how the layout was made. Defaults to None.
+        """
+        self.entities = np.asarray(entities, dtype=object)
+        self.coordinates = np.asarray(coordinates, dtype=np.float32)
+        self.info = info or {}
+
+    def __len__(self):
+        return len(self.entities)
+
+    @classmethod
+    def from_projection(
+        cls, projection_path: str, entity_mapping_path: str
+    ) -> "Layout":
+        """Create a layout from a projection saved as a .npy file whose rows are the rows of an entity mapping TSV,
+        e.g. `best_projection_n_neighbours_10.npy`.
+        """
+        mapping = load_mapping(entity_mapping_path)
+        coordinates = np.load(projection_path)
+
+        return cls(
+            mapping["value"].values,
+            coordinates[mapping.index.values],
+            {"source": os.path.abspath(projection_path)},
+        )
+
+    @classmethod
+    def fit_umap(
+        cls, embedding_store: KGEmbeddingStore, random_state: int = 42, **umap_kwargs
+    ) -> "Layout":
+        """Fit a new UMAP projection of every entity. This is slow for large models, so is only meant for creating the
+        first layout. Requires umap-learn.
+        """
+        import umap
+
+        reducer = umap.UMAP(n_components=2, random_state=random_state, **umap_kwargs)
+        coordinates = reducer.fit_transform(
+            np.asarray(embedding_store.ent_embedding_matrix, dtype=np.float32)
+        )
+
+        return cls(
+            embedding_store.idxs_to_entities(np.arange(len(coordinates))),
+            coordinates,
+            {
+                "source": "umap",
+                "umap_params": umap_kwargs,
+                "random_state": random_state,
+            },
+        )
+
+    @classmethod
+    def load(cls, folder: str) -> "Layout":
+        with open(os.path.join(folder, LAYOUT_FILE_NAMES["info"]), "r") as f:
+            info = json.load(f)
+
+        return cls(
+            load_mapping(os.path.join(folder, LAYOUT_FILE_NAMES["entities"]))[
+                "value"
+            ].values,
+            np.load(os.path.join(folder, LAYOUT_FILE_NAMES["coordinates"])),
+            info,
+        )
+
+    def save(self, folder: str):
+        """Save the layout to `folder`. The info file is written last, so a folder without one is incomplete."""
+        os.makedirs(folder, exist_ok=True)
+        info_path = os.path.join(folder, LAYOUT_FILE_NAMES["info"])
+        if os.path.exists(info_path):
+            os.remove(info_path)
+
+        np.save(
+            os.path.join(folder, LAYOUT_FILE_NAMES["coordinates"]), self.coordinates
+        )
+        pd.DataFrame({"value": self.entities}).to_csv(
+            os.path.join(folder, LAYOUT_FILE_NAMES["entities"]),
+            sep="\t",
+            header=False,
+            quoting=csv.QUOTE_NONE,
+        )
+
+        with open(info_path, "w") as f:
+            json.dump(self.info, f, indent=4)
+
+
+def project_from_neighbours(
+    embedding_store: KGEmbeddingStore,
+    anchor_rows: np.ndarray,
+    anchor_coordinates: np.ndarray,
+    rows: np.ndarray,
+    n_neighbours: int = 10,
+    batch_size: int = 10_000,
+    num_threads: int = None,
+) -> np.ndarray:
+    """Place the entities in `rows` of `embedding_store` at the inverse distance weighted mean position of their
+    `n_neighbours` nearest anchors (entities whose positions are already known).
+
+    Args:
+        embedding_store (KGEmbeddingStore)
+        anchor_rows (np.ndarray): rows of the anchor entities
+        anchor_coordinates (np.ndarray): position of each anchor, of shape (len(anchor_rows), 2)
+        rows (np.ndarray): rows of the entities to place
+        n_neighbours (int, optional): Defaults to 10.
+        batch_size (int, optional): number of entities placed at a time by each thread. Defaults to 10_000.
+        num_threads (int, optional): number of threads. Defaults to None (one per core).
+
+    Returns:
+        np.ndarray: float32 positions of shape (len(rows), 2)
+    """
+    matrix = embedding_store.ent_embedding_matrix
+    index = faiss.IndexFlatL2(matrix.shape[1])
+    index.add(np.ascontiguousarray(matrix[anchor_rows], dtype=np.float32))
+    anchor_coordinates = np.asarray(anchor_coordinates, dtype=np.float32)
+    coordinates = np.empty((len(rows), 2), dtype=np.float32)
+    k = min(n_neighbours, len(anchor_rows))
+
+    def _place_batch(start: int):
+        batch = slice(start, start + batch_size)
+        xq = np.ascontiguousarray(matrix[rows[batch]], dtype=np.float32)
+        distances, idxs = index.search(xq, k)
+        weights = 1 / (np.sqrt(np.maximum(distances, 0)) + 1e-6)
+        weights /= weights.sum(axis=1, keepdims=True)
+        coordinates[batch] = np.einsum("ij,ijk->ik", weights, anchor_coordinates[idxs])
+
+    with ThreadPoolExecutor(
+        max_workers=num_threads or os.cpu_count(), thread_name_prefix="projection"
+    ) as executor:
+        list(executor.map(_place_batch, range(0, len(rows), batch_size)))
+
+    return coordinates
+
+
+def update_layout(
+    layout: Layout,
+    embedding_store: KGEmbeddingStore,
+    changed_entities: Iterable[str] = (),
+    **projection_kwargs,
+) -> Tuple[Layout, np.ndarray]:
+    """Update `layout` for the entities in `embedding_store`: entities no longer in the store are dropped, new
+    entities and `changed_entities` are placed from their neighbours (see `project_from_neighbours`), and every other
+    entity keeps its position.
+
+    Args:
+        layout (Layout)
+        embedding_store (KGEmbeddingStore): the new model
+        changed_entities (Iterable[str], optional): entities to place again even though they have a position.
+            Defaults to ().
+        **projection_kwargs: passed to `project_from_neighbours`
+
+    Returns:
+        Tuple[Layout, np.ndarray]: the layout, with an entity for each row of the store's entity embeddings matrix,
+            and the rows that were placed
+    """
+    num_rows = embedding_store.ent_embedding_matrix.shape[0]
+    entities = np.asarray(
+        embedding_store.idxs_to_entities(np.arange(num_rows)), dtype=object
+    )
+    coordinates = np.full((num_rows, 2), np.nan, dtype=np.float32)
+
+    layout_rows = embedding_store.entities_to_idxs(layout.entities, ignore_missing=True)
+    kept = layout_rows >= 0
+    coordinates[layout_rows[kept]] = layout.coordinates[kept]
+
+    changed_rows = embedding_store.entities_to_idxs(
+        list(changed_entities), ignore_missing=True
+    )
+    coordinates[changed_rows[changed_rows >= 0]] = np.nan
+
+    placed = np.isnan(coordinates[:, 0])
+    anchor_rows = np.flatnonzero(~placed)
+    update_rows = np.flatnonzero(placed)
+
+    if len(update_rows):
+        if not len(anchor_rows):
+            raise ValueError("No entities in the layout are in the embedding store.")
+
+        coordinates[update_rows] = project_from_neighbours(
+            embedding_store,
+            anchor_rows,
+            coordinates[anchor_rows],
+            update_rows,
+            **projection_kwargs,
+        )
+
+    info = {
+        **layout.info,
+        "updated": datetime.datetime.now().isoformat(timespec="seconds"),
+        "num_entities": int(num_rows),
+        "num_kept": int(len(anchor_rows)),
+        "num_placed": int(len(update_rows)),
+        "num_dropped": int((~kept).sum()),
+    }
+
+    return Layout(entities, coordinates, info), update_rows
+
+
+def map_to_database(value: str) -> str:
+    """The database an entity comes from, as in the `database` colour mapping."""
+    if "collection.sciencemuseumgroup" in value:
+        return "SMG"
+    elif "blog.sciencemuseum" in value:
+        return "SMG blog"
+    elif "journal.sciencemuseum" in value:
+        return "SMG journal"
+    elif "wikidata.org/entity" in value:
+        return "Wikidata"
+    elif ("https://api.vam.ac.uk/v2/objects/search" in value) or (
+        "http://collections.vam.ac.uk/item" in value
+    ):
+        return "V&A"
+    else:
+        return None
+
+
+def update_group_mapping(
+    input_path: str,
+    output_path: str,
+    embedding_store: KGEmbeddingStore,
+    new_group_fn=None,
+    chunk_size: int = 1_000_000,
+) -> Dict[str, str]:
+    """Rewrite a colour mapping TSV (rows of index, entity and group) for the rows of `embedding_store`, a chunk at a
+    time. Entities no longer in the store are dropped, and entities not in the mapping are added with the group
+    `new_group_fn(entity)`, or no group if `new_group_fn` is None.
+
+    Returns:
+        Dict[str, str]: group of each added entity which has one
+    """
+    num_rows = embedding_store.ent_embedding_matrix.shape[0]
+    in_mapping = np.zeros(num_rows, dtype=bool)
+
+    with open(output_path, "w") as f:
+        for chunk in pd.read_csv(
+            input_path,
+            sep="\t",
+            header=None,
+            names=["value", "group"],
+            index_col=0,
+            quoting=csv.QUOTE_NONE,
+            dtype=str,
+            chunksize=chunk_size,
+        ):
+            rows = embedding_store.entities_to_idxs(
+                chunk["value"].fillna("").values, ignore_missing=True
+            )
+            found = rows >= 0
+            in_mapping[rows[found]] = True
+            chunk[found].set_index(rows[found]).to_csv(
+                f, sep="\t", header=False, quoting=csv.QUOTE_NONE
+            )
+
+        new_rows = np.flatnonzero(~in_mapping)
+        new_entities = embedding_store.idxs_to_entities(new_rows)
+        new_groups = [
+            new_group_fn(entity) if new_group_fn else None for entity in new_entities
+        ]
+        pd.DataFrame(
+            {"value": new_entities, "group": new_groups}, index=new_rows
+        ).to_csv(f, sep="\t", header=False, quoting=csv.QUOTE_NONE)
+
+    return {
+        entity: group
+        for entity, group in zip(new_entities, new_groups)
+        if group is not None
+    }
+
+
+def _load_groups(path: str, embedding_store: KGEmbeddingStore) -> np.ndarray:
+    mapping = pd.read_csv(
+        path,
+        sep="\t",
+        header=None,
+        names=["value", "group"],
+        index_col=0,
+        quoting=csv.QUOTE_NONE,
+        dtype=str,
+    )
+    rows = embedding_store.entities_to_idxs(
+        mapping["value"].fillna("").values, ignore_missing=True
+    )
+    groups = np.full(embedding_store.ent_embedding_matrix.shape[0], None, dtype=object)
+    groups[rows[rows >= 0]] = mapping["group"].values[rows >= 0]
+
+    return groups
+
+
+# Group columns that `create_d3fc_data.ipynb` only exports entities with a group in.
+EXPORTED_GROUP_COLUMNS = ("collection_category", "type")
+
+
+def update_visualisation_data(
+    output_path: str,
+    layout: Layout,
+    embedding_store: KGEmbeddingStore,
+    update_rows: np.ndarray,
+    group_mapping_paths: Dict[str, str],
+    input_path: str = None,
+    required_groups: Iterable[str] = EXPORTED_GROUP_COLUMNS,
+    chunk_size: int = 1_000_000,
+):
+    """Write the visualisation TSV (columns index, id, x, y, label and a column per colour mapping) for `layout`,
+    which has an entity for each row of `embedding_store`.
+
+    If `input_path` is an existing visualisation TSV, its rows are copied a chunk at a time, renumbered for the new
+    model, except for entities that are no longer in the store. Rows of entities in `update_rows` are moved to their
+    new positions and given their groups from `group_mapping_paths`, keeping their labels and any other columns.
+    Entities in `update_rows` that weren't in it are then appended. Otherwise every entity is written.
+
+    As in `create_d3fc_data.ipynb`, an entity is only written from the layout if it has a group in each of the
+    `required_groups` columns that the visualisation has.
+
+    Args:
+        output_path (str)
+        layout (Layout): layout with an entity for each row of `embedding_store` (see `update_layout`)
+        embedding_store (KGEmbeddingStore)
+        update_rows (np.ndarray): rows whose positions have changed
+        group_mapping_paths (Dict[str, str]): colour mapping TSV for each group column, e.g. {"type": ".../mapping_type.tsv"}
+        input_path (str, optional): the previous visualisation TSV. Defaults to None.
+        required_groups (Iterable[str], optional): Defaults to ("collection_category", "type").
+        chunk_size (int, optional): Defaults to 1_000_000.
+    """
+    num_rows = embedding_store.ent_embedding_matrix.shape[0]
+    write_rows = np.zeros(num_rows, dtype=bool)
+    write_rows[update_rows] = True
+    has_input = input_path and os.path.exists(input_path)
+    columns = (
+        list(pd.read_csv(input_path, sep="\t", nrows=0).columns)
+        if has_input
+        else ["index", "id", "x", "y", "label", *group_mapping_paths]
+    )
+    groups = {
+        name: _load_groups(path, embedding_store)
+        for name, path in group_mapping_paths.items()
+        if name in columns
+    }
+
+    with open(output_path, "w") as f:
+        header = True
+
+        if has_input:
+            for chunk in pd.read_csv(
+                input_path,
+                sep="\t",
+                dtype=str,
+                keep_default_na=False,
+                chunksize=chunk_size,
+            ):
+                rows = embedding_store.entities_to_idxs(
+                    chunk["id"].values, ignore_missing=True
+                )
+                keep = rows >= 0
+                chunk = chunk[keep].copy()
+                rows = rows[keep]
+                chunk["index"] = rows
+
+                moved = write_rows[rows]
+                write_rows[rows] = False
+                chunk.loc[moved, "x"] = layout.coordinates[rows[moved], 0]
+                chunk.loc[moved, "y"] = layout.coordinates[rows[moved], 1]
+                for name, row_groups in groups.items():
+                    chunk.loc[moved, name] = row_groups[rows[moved]]
+
+                chunk.to_csv(f, sep="\t", index=False, header=header)
+                header = False
+        else:
+            write_rows[:] = True
+
+        for name in required_groups:
+            if name in columns:
+                # Without a colour mapping for the column, no entity has a group in it.
+                write_rows &= pd.notna(groups[name]) if name in groups else False
+
+        new_rows = np.flatnonzero(write_rows)
+
+        for start in range(0, len(new_rows), chunk_size):
+            rows = new_rows[slice(start, start + chunk_size)]
+            chunk = pd.DataFrame(
+                {
+                    "index": rows,
+                    "id": layout.entities[rows],
+                    "x": layout.coordinates[rows, 0],
+                    "y": layout.coordinates[rows, 1],
+                    **{name: row_groups[rows] for name, row_groups in groups.items()},
+                }
+            )
+            chunk.reindex(columns=columns).to_csv(
+                f, sep="\t", index=False, header=header
+            )
+            header = False
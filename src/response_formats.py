@@ -0,0 +1,142 @@
+"""
+Submodule for rendering nearest neighbour results in the format a client asks for with the `Accept` header.
+
+JSON (the default) is rendered with orjson. High-volume clients can ask for a compact binary format instead:
+- `application/msgpack`: a map with the request's `entities` in order, their `neighbours` as a list of lists, and
+    `distances` as the bytes of a little-endian float32 matrix of shape (len(entities), k), padded with NaN where
+    fewer than k neighbours were found.
+- `application/vnd.apache.arrow.stream`: an Arrow IPC stream of a table with one row per neighbour and the columns
+    `entity`, `rank`, `neighbour` and `distance`. Requires pyarrow.
+"""
+
+import itertools
+from typing import Dict, List, Tuple
+import numpy as np
+import orjson
+from fastapi.responses import Response
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+_MEDIA_TYPES = {
+    MSGPACK_MEDIA_TYPE: MSGPACK_MEDIA_TYPE,
+    "application/x-msgpack": MSGPACK_MEDIA_TYPE,
+    ARROW_MEDIA_TYPE: ARROW_MEDIA_TYPE,
+}
+
+
+class UnsupportedFormatError(Exception):
+    def __init__(self, media_type: str, reason: str):
+        self.media_type = media_type
+        self.reason = reason
+        super().__init__(f"Can't respond with {media_type}: {reason}")
+
+
+def negotiate_media_type(accept: str = None) -> str:
+    """The media type to respond with, given an `Accept` header. The first binary format listed is used, and JSON if
+    none is listed.
+    """
+    for media_range in (accept or "").split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in _MEDIA_TYPES:
+            return _MEDIA_TYPES[media_type]
+
+    return JSON_MEDIA_TYPE
+
+
+# `{entity: (neighbours, distances)}`: the neighbours of each entity and a float32 array of their distances.
+NeighboursResults = Dict[str, Tuple[List[str], np.ndarray]]
+
+
+def neighbours_to_arrays(
+    results: NeighboursResults, entities: List[str], k: int
+) -> Tuple[List[List[str]], np.ndarray]:
+    """Get the neighbours of each of `entities` and a float32 matrix of their distances, padded with NaN where an
+    entity has fewer than `k` neighbours.
+    """
+    distances = np.full((len(entities), k), np.nan, dtype=np.float32)
+    neighbours = []
+
+    for idx, ent in enumerate(entities):
+        ent_neighbours, ent_distances = results[ent]
+        neighbours.append(ent_neighbours[:k])
+        distances[idx, : len(neighbours[-1])] = ent_distances[:k]
+
+    return neighbours, distances
+
+
+def _render_msgpack(results: NeighboursResults, entities: List[str], k: int) -> bytes:
+    try:
+        import msgpack
+    except ImportError:
+        raise UnsupportedFormatError(MSGPACK_MEDIA_TYPE, "msgpack isn't installed")
+
+    neighbours, distances = neighbours_to_arrays(results, entities, k)
+
+    return msgpack.packb(
+        {
+            "entities": entities,
+            "k": k,
+            "neighbours": neighbours,
+            "distances": distances.astype("<f4", copy=False).tobytes(),
+        }
+    )
+
+
+def _render_arrow(results: NeighboursResults, entities: List[str], k: int) -> bytes:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise UnsupportedFormatError(ARROW_MEDIA_TYPE, "pyarrow isn't installed")
+
+    neighbours, distances = neighbours_to_arrays(results, entities, k)
+    counts = np.array(
+        [len(ent_neighbours) for ent_neighbours in neighbours], dtype=np.int64
+    )
+    # Cells of the padded distance matrix which hold a neighbour. Indexing with it gives them in the table's order.
+    is_neighbour = np.arange(k) < counts[:, np.newaxis]
+    table = pa.table(
+        {
+            "entity": pa.array(
+                np.repeat(np.array(entities, dtype=object), counts), type=pa.string()
+            ),
+            "rank": pa.array(np.nonzero(is_neighbour)[1]),
+            "neighbour": pa.array(
+                list(itertools.chain.from_iterable(neighbours)), type=pa.string()
+            ),
+            "distance": pa.array(distances[is_neighbour], type=pa.float32()),
+        }
+    )
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def render_neighbours(
+    results: NeighboursResults,
+    entities: List[str],
+    k: int,
+    media_type: str = JSON_MEDIA_TYPE,
+) -> Response:
+    """Render nearest neighbour results for `entities` as `media_type` (see `negotiate_media_type`).
+
+    Raises:
+        UnsupportedFormatError: if the library needed for `media_type` isn't installed
+    """
+    if media_type == MSGPACK_MEDIA_TYPE:
+        content = _render_msgpack(results, entities, k)
+    elif media_type == ARROW_MEDIA_TYPE:
+        content = _render_arrow(results, entities, k)
+    else:
+        content = orjson.dumps(
+            {
+                ent: list(zip(results[ent][0], results[ent][1].tolist()))
+                for ent in entities
+            }
+        )
+
+    return Response(content=content, media_type=media_type)
@@ -0,0 +1,502 @@
+"""
+Submodule for nearest neighbour search across shards, for indexes too large for one process.
+
+The entity embeddings matrix is partitioned into contiguous ranges of rows, and a Faiss index is built for each range
+(`build_shards`). Each shard is served by its own process, on this machine or another (`ShardServer`, or
+`python -m src.cli.serve_shard`). `ShardedNearestNeighbours` is a coordinator with the same search interface as
+`FaissNearestNeighbours`: it sends each batch of queries to every shard at once, converts each shard's results to
+rows of the whole matrix and merges them into the overall top k. Shards that don't respond within a timeout are left
+out of the results rather than failing the search.
+
+Shards and the coordinator talk over `multiprocessing.connection`, which authenticates connections with a shared key.
+Only run shards on a trusted network.
+"""
+
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+from multiprocessing.connection import (
+    Connection,
+    Listener,
+    answer_challenge,
+    deliver_challenge,
+)
+from typing import Iterable, List, Tuple
+import numpy as np
+import pandas as pd
+from src.embedding_store import KGEmbeddingStore
+from src.metrics import REGISTRY, timed_stage
+from src.nearest_neighbours import FaissNearestNeighbours
+from src.cli.log import get_logger
+
+logger = get_logger(__name__)
+
+SHARD_MANIFEST_FILE_NAME = "shard.json"
+SHARD_INDEX_FILE_NAME = "faiss.index"
+
+SHARD_FAILURES = REGISTRY.counter(
+    "shard_failures_total",
+    "Number of shard searches left out of results, by shard and reason.",
+    labelnames=("shard", "reason"),
+)
+
+
+class ShardError(Exception):
+    """Raised when shards are inconsistent with each other or the embedding store, or when no shard returns results."""
+
+
+def shard_row_ranges(num_rows: int, num_shards: int) -> List[Tuple[int, int]]:
+    """Split `num_rows` rows into `num_shards` contiguous ranges of (start, stop) whose sizes differ by at most one."""
+    bounds = np.linspace(0, num_rows, num_shards + 1).round().astype(int)
+
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _shard_store(
+    embedding_store: KGEmbeddingStore, start: int, stop: int
+) -> KGEmbeddingStore:
+    """Store of the entities in rows `start` to `stop` of `embedding_store`, with their rows renumbered from 0."""
+    ent_mapping = embedding_store.ent_mapping
+    in_range = (ent_mapping.index.values >= start) & (ent_mapping.index.values < stop)
+    shard_mapping = pd.DataFrame(
+        {"value": ent_mapping["value"].values[in_range]},
+        index=ent_mapping.index.values[in_range] - start,
+    )
+
+    return KGEmbeddingStore(
+        ent_embeddings=embedding_store.ent_embedding_matrix[slice(start, stop)],
+        ent_mapping=shard_mapping,
+        rel_embeddings=embedding_store.rel_embedding_matrix,
+        rel_mapping=embedding_store.rel_mapping,
+    )
+
+
+def build_shards(
+    embedding_store: KGEmbeddingStore,
+    output_folder: str,
+    num_shards: int,
+    model_name: str,
+    **index_params,
+) -> List[str]:
+    """Partition the entity embeddings of `embedding_store` into `num_shards` contiguous ranges of rows, and build a
+    Faiss index for each, in the folders `{output_folder}/shard_{i}`.
+
+    Each shard's manifest is written last, so a folder without one is an incomplete shard and won't be served.
+
+    Args:
+        embedding_store (KGEmbeddingStore)
+        output_folder (str): folder to write the shards to. Created if it doesn't exist.
+        num_shards (int): number of shards
+        model_name (str): name of the model the embeddings come from, stored in each shard's manifest
+        **index_params: `FaissNearestNeighbours` parameters for each shard's index
+
+    Returns:
+        List[str]: folder of each shard
+    """
+    num_entities = embedding_store.ent_embedding_matrix.shape[0]
+    created = datetime.datetime.now().isoformat(timespec="seconds")
+    # Shared by the shards built together, so the coordinator can check it's searching one consistent set.
+    build_id = hashlib.sha256(
+        f"{model_name}-{num_entities}-{num_shards}-{created}".encode()
+    ).hexdigest()[:12]
+    shard_folders = []
+
+    for shard, (start, stop) in enumerate(shard_row_ranges(num_entities, num_shards)):
+        shard_folder = os.path.join(output_folder, f"shard_{shard}")
+        os.makedirs(shard_folder, exist_ok=True)
+        manifest_path = os.path.join(shard_folder, SHARD_MANIFEST_FILE_NAME)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        logger.info(f"Building shard {shard} of rows {start:,} to {stop:,}")
+        nearest_neighbours = FaissNearestNeighbours(
+            _shard_store(embedding_store, start, stop), **index_params
+        ).fit("entities")
+        nearest_neighbours.save(os.path.join(shard_folder, SHARD_INDEX_FILE_NAME))
+
+        with open(manifest_path, "w") as f:
+            json.dump(
+                {
+                    "model_name": model_name,
+                    "build_id": build_id,
+                    "created": created,
+                    "shard": shard,
+                    "num_shards": num_shards,
+                    "start": start,
+                    "stop": stop,
+                    "num_entities": num_entities,
+                    "index_params": nearest_neighbours.get_params(),
+                },
+                f,
+                indent=4,
+            )
+
+        shard_folders.append(shard_folder)
+
+    return shard_folders
+
+
+def read_shard_manifest(shard_folder: str) -> dict:
+    manifest_path = os.path.join(shard_folder, SHARD_MANIFEST_FILE_NAME)
+
+    if not os.path.exists(manifest_path):
+        raise ShardError(f"No {SHARD_MANIFEST_FILE_NAME} in {shard_folder}.")
+
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+class ShardServer:
+    def __init__(self, shard_folder: str, mmap: bool = False):
+        """Serves searches of one shard's index (see `build_shards`) to `ShardedNearestNeighbours` coordinators.
+
+        Args:
+            shard_folder (str): folder of the shard
+            mmap (bool, optional): memory-map the index where Faiss supports it for the index type. Defaults to False.
+        """
+        self.manifest = read_shard_manifest(shard_folder)
+        self.nearest_neighbours = FaissNearestNeighbours.load(
+            None,
+            os.path.join(shard_folder, SHARD_INDEX_FILE_NAME),
+            mmap=mmap,
+            **self.manifest["index_params"],
+        )
+
+    def handle(self, message: tuple) -> tuple:
+        """Reply to a message from a coordinator: `("info",)` or `("search", xq, k)`."""
+        if message[0] == "info":
+            return "ok", self.manifest
+
+        if message[0] == "search":
+            _, xq, k = message
+            return "ok", self.nearest_neighbours.search_vectors(xq, k)
+
+        return "error", f"Unknown message type {message[0]!r}"
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    reply = self.handle(message)
+                except Exception as e:
+                    reply = "error", f"{type(e).__name__}: {e}"
+
+                try:
+                    conn.send(reply)
+                except (OSError, ValueError):
+                    # The coordinator gave up waiting and closed the connection.
+                    return
+
+    def serve(self, address: Tuple[str, int], authkey: bytes, ready_fn=None):
+        """Accept connections from coordinators at `address` until the process is stopped, handling each connection in
+        its own thread. Faiss releases the GIL while searching, so searches from different connections run in
+        parallel.
+
+        Args:
+            address (Tuple[str, int]): (host, port) to listen on. Port 0 picks a free port.
+            authkey (bytes): key that coordinators must connect with
+            ready_fn (optional): called with the address being listened on once connections are accepted. Defaults
+                to None.
+        """
+        with Listener(address, authkey=authkey) as listener:
+            logger.info(
+                f"Serving shard {self.manifest['shard']} (rows {self.manifest['start']:,} to {self.manifest['stop']:,}) on {listener.address}"
+            )
+            if ready_fn is not None:
+                ready_fn(listener.address)
+
+            while True:
+                try:
+                    conn = listener.accept()
+                except multiprocessing.AuthenticationError:
+                    logger.warning("Rejected a connection with the wrong key")
+                    continue
+
+                threading.Thread(
+                    target=self._serve_connection, args=(conn,), daemon=True
+                ).start()
+
+
+def _run_local_shard(shard_folder: str, authkey: bytes, address_conn):
+    ShardServer(shard_folder).serve(
+        ("127.0.0.1", 0), authkey, ready_fn=address_conn.send
+    )
+
+
+class LocalShards:
+    def __init__(self, shard_folders: Iterable[str], authkey: bytes):
+        """Run a `ShardServer` for each of `shard_folders` in its own local process, e.g. for testing or for running
+        every shard on one large machine. Use as a context manager, or call `stop` when done.
+
+        The listening addresses are in `addresses`, in the order of `shard_folders`.
+        """
+        context = multiprocessing.get_context("spawn")
+        self.processes = []
+        self.addresses = []
+
+        try:
+            for shard_folder in shard_folders:
+                receive_conn, send_conn = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=_run_local_shard,
+                    args=(shard_folder, authkey, send_conn),
+                    daemon=True,
+                )
+                process.start()
+                self.processes.append(process)
+                self.addresses.append(receive_conn.recv())
+        except BaseException:
+            self.stop()
+            raise
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+    def __enter__(self) -> "LocalShards":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class _ShardClient:
+    def __init__(self, address: Tuple[str, int], authkey: bytes):
+        """Connections to one shard. Each request uses an idle connection, or a new one if there isn't one, so
+        concurrent searches don't wait for each other. A connection whose reply timed out is closed, so that a late
+        reply can't be read as the reply to a later request.
+        """
+        self.address = address
+        self.authkey = authkey
+        self._idle = queue.LifoQueue()
+
+    def _connect(self, timeout: float) -> Connection:
+        """`multiprocessing.connection.Client`, but giving up with a `TimeoutError` if the shard doesn't accept the
+        connection or start the authentication handshake within `timeout` seconds.
+        """
+        try:
+            sock = socket.create_connection(self.address, timeout=timeout)
+        except socket.timeout:
+            raise TimeoutError(
+                f"Couldn't connect to shard at {self.address} within {timeout}s"
+            )
+
+        # `Connection` reads the file descriptor directly, which must be blocking.
+        sock.setblocking(True)
+        conn = Connection(sock.detach())
+
+        try:
+            if not conn.poll(timeout):
+                raise TimeoutError(
+                    f"Shard at {self.address} accepted the connection but didn't authenticate it within {timeout}s"
+                )
+            answer_challenge(conn, self.authkey)
+            deliver_challenge(conn, self.authkey)
+        except BaseException:
+            conn.close()
+            raise
+
+        return conn
+
+    def request(self, message: tuple, timeout: float):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect(timeout)
+
+        try:
+            conn.send(message)
+            if not conn.poll(timeout):
+                raise TimeoutError(
+                    f"No reply from shard at {self.address} within {timeout}s"
+                )
+            status, reply = conn.recv()
+        except BaseException:
+            conn.close()
+            raise
+
+        self._idle.put(conn)
+
+        if status != "ok":
+            raise ShardError(f"Shard at {self.address} failed: {reply}")
+
+        return reply
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def merge_top_k(
+    distances: List[np.ndarray], idxs: List[np.ndarray], k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Merge the top k results of each shard, whose idxs are already rows of the whole matrix, into the overall top k.
+    Where there are fewer than k results in total, distances are padded with inf and idxs with -1.
+    """
+    all_distances = np.concatenate(distances, axis=1).astype(np.float32, copy=False)
+    all_idxs = np.concatenate(idxs, axis=1)
+    all_distances[all_idxs < 0] = np.inf
+
+    if all_distances.shape[1] < k:
+        padding = k - all_distances.shape[1]
+        all_distances = np.pad(
+            all_distances, ((0, 0), (0, padding)), constant_values=np.inf
+        )
+        all_idxs = np.pad(all_idxs, ((0, 0), (0, padding)), constant_values=-1)
+
+    order = np.argsort(all_distances, axis=1, kind="stable")[:, :k]
+
+    return (
+        np.take_along_axis(all_distances, order, axis=1),
+        np.take_along_axis(all_idxs, order, axis=1),
+    )
+
+
+class ShardedNearestNeighbours:
+    def __init__(
+        self,
+        embedding_store: KGEmbeddingStore,
+        addresses: Iterable[Tuple[str, int]],
+        authkey: bytes,
+        timeout: float = 1.0,
+    ):
+        """Search shards served by `ShardServer`s as if they were one index, with the same search interface as
+        `FaissNearestNeighbours`.
+
+        The embedding store is only used to look up query vectors and convert rows to entities, so it can be
+        memory-mapped; the indexes are held by the shards.
+
+        Args:
+            embedding_store (KGEmbeddingStore): the store the shards were built from
+            addresses (Iterable[Tuple[str, int]]): (host, port) of each shard's server
+            authkey (bytes): key the shard servers were started with
+            timeout (float, optional): seconds to wait for each shard's results. Shards that take longer (or fail)
+                are left out of the results. Defaults to 1.0.
+
+        Raises:
+            ShardError: if the shards weren't built together, don't cover every row of the store exactly once, or
+                any of them can't be reached
+        """
+        self.embedding_store = embedding_store
+        self.timeout = timeout
+        self._clients = [_ShardClient(tuple(address), authkey) for address in addresses]
+        # Extra threads so that searches can be sent while threads are still waiting on an unresponsive shard.
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=4 * len(self._clients), thread_name_prefix="shard"
+        )
+
+        try:
+            self.shard_manifests = [
+                client.request(("info",), timeout=max(timeout, 10.0))
+                for client in self._clients
+            ]
+        except (OSError, TimeoutError, multiprocessing.AuthenticationError) as e:
+            raise ShardError(f"Couldn't get the manifest of every shard: {e!r}")
+
+        self._check_shards()
+        self.starts = np.array([m["start"] for m in self.shard_manifests])
+
+    def _check_shards(self):
+        manifests = sorted(self.shard_manifests, key=lambda m: m["start"])
+        num_entities = self.embedding_store.ent_embedding_matrix.shape[0]
+
+        if len({m["build_id"] for m in manifests}) > 1:
+            raise ShardError("The shards weren't built together (build ids differ).")
+
+        if manifests[0]["num_entities"] != num_entities:
+            raise ShardError(
+                f"The shards were built on {manifests[0]['num_entities']} entities, but the embedding store has {num_entities}."
+            )
+
+        stops = [0] + [m["stop"] for m in manifests]
+        if [m["start"] for m in manifests] != stops[:-1] or stops[-1] != num_entities:
+            raise ShardError(
+                "The shards don't cover every row of the embeddings matrix exactly once."
+            )
+
+    def get_params(self) -> dict:
+        return {
+            "num_shards": len(self._clients),
+            "shard_timeout": self.timeout,
+            "build_id": self.shard_manifests[0]["build_id"],
+            **self.shard_manifests[0]["index_params"],
+        }
+
+    def search_vectors(
+        self, xq: np.ndarray, k: int, row_filter=None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get `k` nearest neighbours for each row of a matrix of query vectors from every shard. Returns the same as
+        `FaissNearestNeighbours.search_vectors`.
+
+        Raises:
+            NotImplementedError: if `row_filter` is given, as filtered searches aren't supported across shards
+            ShardError: if no shard returned results in time
+        """
+        if row_filter is not None:
+            raise NotImplementedError(
+                "Filtered searches aren't supported across shards"
+            )
+
+        xq = np.ascontiguousarray(xq, dtype="float32")
+
+        with timed_stage("shard_search"):
+            futures = [
+                self._executor.submit(client.request, ("search", xq, k), self.timeout)
+                for client in self._clients
+            ]
+            # The clients time out connecting and waiting for replies separately, so this bounds the wait for both.
+            concurrent.futures.wait(futures, timeout=self.timeout + 0.1)
+
+        distances, idxs = [], []
+
+        for shard, (future, start) in enumerate(zip(futures, self.starts)):
+            if not future.done():
+                reason, error = "timeout", "no reply in time"
+            elif future.exception() is not None:
+                error = future.exception()
+                reason = "timeout" if isinstance(error, TimeoutError) else "error"
+            else:
+                shard_distances, shard_idxs = future.result()
+                distances.append(shard_distances)
+                # Rows of the shard's index are offset by where its range starts in the whole matrix.
+                idxs.append(np.where(shard_idxs < 0, -1, shard_idxs + start))
+                continue
+
+            SHARD_FAILURES.inc(shard=shard, reason=reason)
+            logger.warning(
+                f"Leaving shard {shard} out of search results ({reason}): {error!r}"
+            )
+
+        if not distances:
+            raise ShardError("No shard returned search results in time.")
+
+        with timed_stage("shard_merge"):
+            return merge_top_k(distances, idxs, k)
+
+    def search(self, entities: Iterable[str], k: int) -> Tuple[list]:
+        """Get `k` nearest neighbours for each entity in `entities`. Returns the same as `FaissNearestNeighbours.search`."""
+        xq = self.embedding_store.get_entity_embeddings(entities)
+        distances, idxs = self.search_vectors(xq, k)
+
+        return self.embedding_store.idxs_to_entities(idxs), distances
+
+    def close(self):
+        for client in self._clients:
+            client.close()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The CLI scripts in src/cli import each other as top-level modules (they're run as `python src/cli/<script>.py`).
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src", "cli")
+)
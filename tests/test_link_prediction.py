@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.embedding_store import KGEmbeddingStore
+from src.link_prediction import LinkPredictor
+
+GAMMA = 12.0
+NUM_ENTITIES = 50
+ENTITY_DIM = 8
+
+
+def _store(relation_dim: int) -> KGEmbeddingStore:
+    rnd = np.random.RandomState(0)
+
+    return KGEmbeddingStore(
+        ent_embeddings=rnd.standard_normal((NUM_ENTITIES, ENTITY_DIM)).astype(
+            np.float32
+        ),
+        ent_mapping=pd.DataFrame({"value": [f"e{i}" for i in range(NUM_ENTITIES)]}),
+        rel_embeddings=rnd.uniform(-1, 1, (3, relation_dim)).astype(np.float32),
+        rel_mapping=pd.DataFrame({"value": ["r0", "r1", "r2"]}),
+    )
+
+
+def _expected_scores(model: str, store: KGEmbeddingStore, head, relation, tail):
+    """Scores of every (head, relation, tail) by DGL-KE's definition of each model's score, broadcasting entity rows."""
+    h = store.ent_embedding_matrix[head]
+    r = store.rel_embedding_matrix[relation]
+    t = store.ent_embedding_matrix[tail]
+
+    if model == "RotatE":
+        half = ENTITY_DIM // 2
+        # DGL-KE's embedding initialisation range, which relation phases are stored relative to.
+        emb_init = (GAMMA + 2.0) / half
+        phase = r / (emb_init / np.pi)
+        re_h, im_h = h[..., :half], h[..., half:]
+        re_t, im_t = t[..., :half], t[..., half:]
+        re_score = re_h * np.cos(phase) - im_h * np.sin(phase) - re_t
+        im_score = re_h * np.sin(phase) + im_h * np.cos(phase) - im_t
+        return GAMMA - np.sqrt(re_score**2 + im_score**2).sum(axis=-1)
+
+    if model == "TransE_l1":
+        return GAMMA - np.abs(h + r - t).sum(axis=-1)
+
+    if model in ("TransE_l2", "TransE"):
+        return GAMMA - np.sqrt(((h + r - t) ** 2).sum(axis=-1))
+
+    return (h * r * t).sum(axis=-1)
+
+
+@pytest.mark.parametrize(
+    "model", ["RotatE", "TransE", "TransE_l1", "TransE_l2", "DistMult"]
+)
+def test_scores_match_formula(model):
+    store = _store(ENTITY_DIM // 2 if model == "RotatE" else ENTITY_DIM)
+    # Small blocks, so that results are merged across blocks and threads.
+    predictor = LinkPredictor(store, model=model, gamma=GAMMA, block_size=7)
+    candidates = np.arange(NUM_ENTITIES)
+
+    np.testing.assert_allclose(
+        predictor.score_triples(["e1", "e2"], ["r0", "r2"], ["e3", "e4"]),
+        _expected_scores(model, store, [1, 2], [0, 2], [3, 4]),
+        rtol=1e-4,
+        atol=1e-4,
+    )
+
+    tails, tail_scores = predictor.predict_tails(["e1"], ["r1"], k=5)
+    expected = _expected_scores(model, store, 1, 1, candidates)
+    np.testing.assert_allclose(
+        tail_scores[0], np.sort(expected)[::-1][:5], rtol=1e-4, atol=1e-4
+    )
+    assert tails[0] == [f"e{i}" for i in np.argsort(-expected, kind="stable")[:5]]
+
+    heads, head_scores = predictor.predict_heads(["r1"], ["e1"], k=5)
+    expected = _expected_scores(model, store, candidates, 1, 1)
+    np.testing.assert_allclose(
+        head_scores[0], np.sort(expected)[::-1][:5], rtol=1e-4, atol=1e-4
+    )
+    assert heads[0] == [f"e{i}" for i in np.argsort(-expected, kind="stable")[:5]]
+
+
+def test_p_norm_must_match_model_name():
+    with pytest.raises(ValueError):
+        LinkPredictor(_store(ENTITY_DIM), model="TransE_l1", p_norm=2)
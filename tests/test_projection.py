@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.embedding_store import KGEmbeddingStore
+from src.projection import Layout, update_layout, update_visualisation_data
+
+# The previous model had e0 to e4. The new one drops e4, adds e5 and renumbers the rows of the others.
+NEW_ENTITIES = ["e5", "e3", "e2", "e1", "e0"]
+
+
+@pytest.fixture
+def embedding_store() -> KGEmbeddingStore:
+    rnd = np.random.RandomState(0)
+
+    return KGEmbeddingStore(
+        ent_embeddings=rnd.standard_normal((len(NEW_ENTITIES), 8)).astype(np.float32),
+        ent_mapping=pd.DataFrame({"value": NEW_ENTITIES}),
+        rel_embeddings=rnd.standard_normal((1, 8)).astype(np.float32),
+        rel_mapping=pd.DataFrame({"value": ["r0"]}),
+    )
+
+
+@pytest.fixture
+def layout() -> Layout:
+    return Layout(
+        ["e0", "e1", "e2", "e3", "e4"],
+        np.arange(10, dtype=np.float32).reshape(5, 2),
+    )
+
+
+def _row(entity: str) -> int:
+    return NEW_ENTITIES.index(entity)
+
+
+def test_update_layout(layout, embedding_store):
+    new_layout, update_rows = update_layout(layout, embedding_store, ["e1"])
+
+    assert new_layout.entities.tolist() == NEW_ENTITIES
+    assert sorted(update_rows.tolist()) == sorted([_row("e5"), _row("e1")])
+    for entity, old_row in [("e0", 0), ("e2", 2), ("e3", 3)]:
+        np.testing.assert_array_equal(
+            new_layout.coordinates[_row(entity)], layout.coordinates[old_row]
+        )
+    assert not np.isnan(new_layout.coordinates).any()
+    assert new_layout.info["num_kept"] == 3
+    assert new_layout.info["num_placed"] == 2
+    assert new_layout.info["num_dropped"] == 1
+
+
+def test_update_visualisation_data(layout, embedding_store, tmp_path):
+    # As exported by create_d3fc_data.ipynb: e2 and e3 have no type, so aren't in the visualisation.
+    input_path = tmp_path / "visualisation_data.tsv"
+    pd.DataFrame(
+        {
+            "index": [0, 1, 4],
+            "id": ["e0", "e1", "e4"],
+            "x": ["0.0", "2.0", "8.0"],
+            "y": ["1.0", "3.0", "9.0"],
+            "label": ["L0", "L1", "L4"],
+            "collection_category": ["c", "c", "c"],
+            "type": ["a", "b", "a"],
+            "notes": ["n0", "n1", "n4"],
+        }
+    ).to_csv(input_path, sep="\t", index=False)
+
+    group_mapping_paths = {}
+    for name, groups in [
+        ("collection_category", {"e0": "c", "e1": "c", "e5": "c"}),
+        ("type", {"e0": "a", "e1": "b2", "e5": "a"}),
+    ]:
+        group_mapping_paths[name] = str(tmp_path / f"mapping_{name}.tsv")
+        pd.DataFrame(
+            {"value": NEW_ENTITIES, "group": [groups.get(e) for e in NEW_ENTITIES]}
+        ).to_csv(group_mapping_paths[name], sep="\t", header=False)
+
+    new_layout, update_rows = update_layout(layout, embedding_store, ["e1"])
+    output_path = tmp_path / "output.tsv"
+    update_visualisation_data(
+        str(output_path),
+        new_layout,
+        embedding_store,
+        update_rows,
+        group_mapping_paths,
+        input_path=str(input_path),
+    )
+
+    output = pd.read_csv(output_path, sep="\t", keep_default_na=False).set_index("id")
+
+    # Dropped entities are removed, and entities without a type or collection category aren't added.
+    assert sorted(output.index) == ["e0", "e1", "e5"]
+    assert output["index"].to_dict() == {e: _row(e) for e in ["e0", "e1", "e5"]}
+    # Kept entities are copied as they were.
+    assert output.loc["e0", ["x", "y", "label", "type", "notes"]].tolist() == [
+        0.0,
+        1.0,
+        "L0",
+        "a",
+        "n0",
+    ]
+    # Changed entities are moved and regrouped, keeping their label and other columns.
+    np.testing.assert_allclose(
+        output.loc["e1", ["x", "y"]].astype(float),
+        new_layout.coordinates[_row("e1")],
+        rtol=1e-6,
+    )
+    assert output.loc["e1", ["label", "type", "notes"]].tolist() == ["L1", "b2", "n1"]
+    # New entities are added without a label.
+    assert output.loc["e5", ["label", "collection_category", "type"]].tolist() == [
+        "",
+        "c",
+        "a",
+    ]
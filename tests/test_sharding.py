@@ -0,0 +1,60 @@
+import socket
+import numpy as np
+import pandas as pd
+import pytest
+from src.embedding_store import KGEmbeddingStore
+from src.nearest_neighbours import FaissNearestNeighbours
+from src.sharding import (
+    LocalShards,
+    ShardError,
+    ShardedNearestNeighbours,
+    build_shards,
+)
+
+AUTHKEY = b"test"
+
+
+@pytest.fixture(scope="module")
+def embedding_store() -> KGEmbeddingStore:
+    rnd = np.random.RandomState(0)
+
+    return KGEmbeddingStore(
+        ent_embeddings=rnd.standard_normal((500, 8)).astype(np.float32),
+        ent_mapping=pd.DataFrame({"value": [f"e{i}" for i in range(500)]}),
+        rel_embeddings=rnd.standard_normal((2, 8)).astype(np.float32),
+        rel_mapping=pd.DataFrame({"value": ["r0", "r1"]}),
+    )
+
+
+def test_sharded_search_matches_flat_search(embedding_store, tmp_path):
+    shard_folders = build_shards(
+        embedding_store, str(tmp_path), num_shards=3, model_name="test"
+    )
+    flat = FaissNearestNeighbours(embedding_store).fit("entities")
+    xq = embedding_store.ent_embedding_matrix[::25]
+
+    with LocalShards(shard_folders, AUTHKEY) as shards:
+        sharded = ShardedNearestNeighbours(
+            embedding_store, shards.addresses, AUTHKEY, timeout=10.0
+        )
+        try:
+            sharded_distances, sharded_idxs = sharded.search_vectors(xq, 10)
+        finally:
+            sharded.close()
+
+    flat_distances, flat_idxs = flat.search_vectors(xq, 10)
+
+    np.testing.assert_array_equal(sharded_idxs, flat_idxs)
+    np.testing.assert_allclose(sharded_distances, flat_distances, rtol=1e-5)
+
+
+def test_unresponsive_shard_raises_shard_error(embedding_store):
+    # Connections to a socket that listens but is never accepted from complete, but the handshake never starts.
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+
+        with pytest.raises(ShardError, match="didn't authenticate"):
+            ShardedNearestNeighbours(
+                embedding_store, [sock.getsockname()], AUTHKEY, timeout=0.5
+            )
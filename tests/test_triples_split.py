@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from utils import load_triples_from_tsv
+from triples_split import hash_split
+
+
+@pytest.fixture
+def triples_path(tmp_path) -> str:
+    # Many entities with few triples, so that the hash alone leaves some test/val entities out of train.
+    rnd = np.random.RandomState(0)
+    triples = pd.DataFrame(
+        {
+            "subject": [f"http://e/{i}" for i in rnd.randint(0, 300, 1000)],
+            "predicate": [f"http://p/{i}" for i in rnd.randint(0, 20, 1000)],
+            "object": [f"http://e/{i}" for i in rnd.randint(0, 300, 1000)],
+        }
+    ).drop_duplicates()
+    path = os.path.join(tmp_path, "triples.tsv")
+    triples.to_csv(path, sep="\t", index=False, header=False)
+
+    return path
+
+
+def _load_splits(folder: str) -> dict:
+    return {
+        name: load_triples_from_tsv(os.path.join(folder, f"{name}.csv"))
+        for name in ["train", "test", "val"]
+    }
+
+
+def _as_set(triples: pd.DataFrame) -> set:
+    return set(map(tuple, triples.values.tolist()))
+
+
+def test_same_split_for_same_seed(triples_path, tmp_path):
+    hash_split(triples_path, tmp_path / "a", [0.8, 0.1, 0.1], random_state=1)
+    hash_split(
+        triples_path, tmp_path / "b", [0.8, 0.1, 0.1], random_state=1, chunksize=100
+    )
+    hash_split(triples_path, tmp_path / "c", [0.8, 0.1, 0.1], random_state=2)
+    a, b, c = (_load_splits(tmp_path / name) for name in "abc")
+
+    for name in a:
+        assert _as_set(a[name]) == _as_set(b[name])
+    assert _as_set(a["test"]) != _as_set(c["test"])
+
+
+def test_splits_partition_triples(triples_path, tmp_path):
+    counts = hash_split(triples_path, tmp_path, [0.8, 0.1, 0.1], chunksize=100)
+    splits = _load_splits(tmp_path)
+    triples = load_triples_from_tsv(triples_path)
+
+    assert {name: len(split) for name, split in splits.items()} == {
+        name: counts[name] for name in splits
+    }
+    assert sum(len(split) for split in splits.values()) == len(triples)
+    assert set.union(*(_as_set(split) for split in splits.values())) == _as_set(triples)
+
+
+def test_test_and_val_entities_and_relations_are_in_train(triples_path, tmp_path):
+    counts = hash_split(triples_path, tmp_path, [0.8, 0.1, 0.1], chunksize=100)
+    splits = _load_splits(tmp_path)
+    train = splits["train"]
+    train_entities = set(train["subject"]) | set(train["object"])
+
+    # The repair is needed for this graph, so is tested.
+    assert counts["moved_to_train"] > 0
+    for name in ["test", "val"]:
+        assert len(splits[name]) > 0
+        assert set(splits[name]["subject"]) <= train_entities
+        assert set(splits[name]["object"]) <= train_entities
+        assert set(splits[name]["predicate"]) <= set(train["predicate"])
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import torch
+from pykeen.models import RotatE, TransE
+from pykeen.triples import TriplesFactory
+from warm_start import align_embeddings, to_initializer
+
+
+def _triples_factory() -> TriplesFactory:
+    rnd = np.random.RandomState(0)
+    triples = np.array(
+        [
+            [f"e{s}", f"r{p}", f"e{o}"]
+            for s, p, o in zip(
+                rnd.randint(0, 20, 100), rnd.randint(0, 3, 100), rnd.randint(0, 20, 100)
+            )
+        ]
+    )
+
+    return TriplesFactory.from_labeled_triples(triples)
+
+
+def _embeddings(model):
+    """Embeddings as saved by run_pykeen.py."""
+    with torch.no_grad():
+        return (
+            model.entity_representations[0](indices=None).numpy(),
+            model.relation_representations[0](indices=None).numpy(),
+        )
+
+
+@pytest.mark.parametrize("model_cls", [TransE, RotatE])
+def test_warm_start_reproduces_previous_embeddings(model_cls):
+    tf = _triples_factory()
+    previous_entities, previous_relations = _embeddings(
+        model_cls(triples_factory=tf, embedding_dim=8, random_seed=1)
+    )
+
+    # Pretend the previous model numbered entities in reverse, so the embeddings must be realigned.
+    previous_entity_to_id = {
+        label: len(tf.entity_to_id) - 1 - idx for label, idx in tf.entity_to_id.items()
+    }
+    entity_embeddings, known = align_embeddings(
+        previous_entities[::-1], previous_entity_to_id, tf.entity_to_id
+    )
+    assert known.all()
+    np.testing.assert_array_equal(entity_embeddings, previous_entities)
+
+    model = model_cls(
+        triples_factory=tf,
+        embedding_dim=8,
+        entity_initializer=to_initializer(entity_embeddings),
+        relation_initializer=to_initializer(previous_relations),
+        random_seed=0,
+    )
+    # As the training loop does before its first epoch, i.e. a warm start trained for 0 epochs.
+    model.reset_parameters_()
+    entities, relations = _embeddings(model)
+
+    np.testing.assert_allclose(entities, previous_entities, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(relations, previous_relations, rtol=1e-5, atol=1e-6)